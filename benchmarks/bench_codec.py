@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Compare the available codecs (JSON, and binary ones if msgpack or cbor2
+are installed) on list_shares replies of various sizes, by encode and
+decode time and by bytes on the wire, framing included:
+
+    python benchmarks/bench_codec.py
+"""
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from clearskies.codec import available_codecs, binary_codecs
+
+
+def make_reply(count):
+    return {"shares": [{"path": "/home/user/Shared/%08d" % n, "status": "N/A"} for n in range(count)]}
+
+
+def bench_codecs(sizes=(100, 10000, 100000), repeat=5):
+    results = []
+    for count in sizes:
+        reply = make_reply(count)
+        number = max(1, 100000 // count)
+        for codec in available_codecs() + binary_codecs():
+            data = codec.dumps(reply)
+            # a newline after each JSON message, a 4-byte length before
+            # each binary one
+            wire_bytes = len(data) + (4 if codec.binary else 1)
+            dumps = min(timeit.repeat(lambda: codec.dumps(reply), number=number, repeat=repeat)) / number
+            loads = min(timeit.repeat(lambda: codec.loads(data), number=number, repeat=repeat)) / number
+            results.append({
+                "codec": codec.name,
+                "shares": count,
+                "bytes": wire_bytes,
+                "dumps_s": dumps,
+                "loads_s": loads,
+                "loads_mb_per_s": len(data) / loads / 1e6,
+            })
+    return results
+
+
+def main():
+    print("%-8s %8s %10s %12s %12s %10s" % ("codec", "shares", "wire bytes", "dumps (ms)", "loads (ms)", "MB/s in"))
+    for r in bench_codecs():
+        print("%-8s %8d %10d %12.3f %12.3f %10.1f" % (
+            r["codec"], r["shares"], r["bytes"], r["dumps_s"] * 1000, r["loads_s"] * 1000, r["loads_mb_per_s"]
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Benchmark the client against a fake daemon on a local unix socket, and
+write the results as JSON so that runs can be compared over time:
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --quick
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from clearskies.client import ClearSkies
+from clearskies.metrics import Metrics
+from clearskies.fakedaemon import FakeDaemon
+from clearskies.codec import binary_codecs
+from bench_codec import bench_codecs
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))]
+
+
+def measure(name, fn, iterations, **extra):
+    """
+    Call fn() `iterations` times, and summarise how long each call took
+    """
+    latencies = []
+    start = time.perf_counter()
+    for n in range(iterations):
+        t = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    result = {
+        "name": name,
+        "iterations": iterations,
+        "ops_per_sec": iterations / total,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+    result.update(extra)
+    return result
+
+
+def bench_connect(daemon, iterations):
+    def connect():
+        cs = ClearSkies(daemon.control_path)
+        cs.connect()
+        cs.socket.close()
+    return [measure("connect", connect, iterations)]
+
+
+def bench_cmd(daemon, iterations):
+    cs = ClearSkies(daemon.control_path)
+    cs.connect()
+    instrumented = ClearSkies(daemon.control_path, metrics=Metrics())
+    instrumented.connect()
+    return [
+        measure("cmd", lambda: cs._cmd({"type": "status"}), iterations),
+        measure("cmd_with_metrics", lambda: instrumented._cmd({"type": "status"}), iterations),
+    ]
+
+
+def bench_list_shares(daemon, sizes):
+    results = []
+    cs = ClearSkies(daemon.control_path)
+    cs.connect()
+    for count in sizes:
+        daemon.call(daemon.set_shares, count)
+        iterations = max(3, min(1000, 100000 // count))
+        results.append(measure("list_shares", cs.list_shares, iterations, shares=count))
+        results.append(measure("list_shares_table", lambda: cs.list_shares(table=True), iterations, shares=count))
+        results.append(measure("iter_shares", lambda: sum(1 for s in cs.iter_shares()), iterations, shares=count))
+    return results
+
+
+def bench_encodings(sizes):
+    """
+    list_shares end to end over each encoding the daemon can be asked
+    for, with how many bytes each reply takes on the wire
+    """
+    results = []
+    encodings = [codec.name for codec in binary_codecs()]
+    with FakeDaemon(features=encodings) as daemon:
+        clients = []
+        for encoding in ["json"] + encodings:
+            # offer one encoding at a time, so that each client picks a
+            # different one
+            daemon.handshake["features"] = [encoding]
+            cs = ClearSkies(daemon.control_path, binary=True)
+            cs.connect()
+            clients.append((encoding, cs))
+        for count in sizes:
+            daemon.call(daemon.set_shares, count)
+            iterations = max(3, min(1000, 100000 // count))
+            for encoding, cs in clients:
+                results.append(measure(
+                    "list_shares_" + encoding, cs.list_shares, iterations,
+                    shares=count, wire_bytes=len(daemon.list_shares_reply(encoding)),
+                ))
+        for encoding, cs in clients:
+            cs.close()
+    return results
+
+
+def bench_allocations(daemon, sizes, iterations=1000):
+    """
+    How much garbage each reply creates: the peak memory traced while
+    receiving one (beyond the decoded result itself), and how many
+    generation-0 garbage collections per 1000 replies
+    """
+    results = []
+    cs = ClearSkies(daemon.control_path)
+    cs.connect()
+    for count in sizes:
+        daemon.call(daemon.set_shares, count)
+        cmd = {"type": "list_shares"}
+        cs._cmd(cmd)  # warm up the receive buffer
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        reply = cs._cmd(cmd)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del reply
+
+        n = max(10, iterations // max(1, count))
+        collections = gc.get_stats()[0]["collections"]
+        for _ in range(n):
+            cs._cmd(cmd)
+        collections = gc.get_stats()[0]["collections"] - collections
+
+        results.append({
+            "name": "allocations",
+            "shares": count,
+            "reply_bytes": len(daemon.list_shares_reply()),
+            "result_bytes": current - before,
+            "peak_overhead_bytes": peak - current,
+            "gen0_collections_per_1000": collections * 1000.0 / n,
+        })
+    return results
+
+
+def bench_pipeline(daemon, batch, iterations):
+    cs = ClearSkies(daemon.control_path)
+    cs.connect()
+
+    def serial():
+        for n in range(batch):
+            cs.status()
+
+    def pipelined():
+        with cs.pipeline() as p:
+            for n in range(batch):
+                p.status()
+
+    return [
+        measure("serial", serial, iterations, batch=batch),
+        measure("pipelined", pipelined, iterations, batch=batch),
+    ]
+
+
+def bench_startup(daemon, iterations, batch):
+    """
+    What a process which wants to run one command pays: importing the
+    client, then a whole CLI run (start, connect, handshake, command);
+    and for comparison, `batch` commands through one `cli shell`
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+
+    def python(args, stdin=None):
+        subprocess.run(
+            [sys.executable] + args,
+            input=stdin, env=env, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+    cli = ["-m", "clearskies.cli", "-c", daemon.control_path]
+    commands = b"status\n" * batch
+    return [
+        measure("startup_python", lambda: python(["-c", "pass"]), iterations),
+        measure("startup_import", lambda: python(["-c", "import clearskies.cli"]), iterations),
+        measure("startup_cli", lambda: python(cli + ["status"]), iterations),
+        measure("startup_shell", lambda: python(cli + ["shell"], commands), max(3, iterations // 10), batch=batch),
+    ]
+
+
+def run(quick=False):
+    if quick:
+        sizes, iterations, codec_sizes = (10, 1000, 10000), 200, (100, 10000)
+    else:
+        sizes, iterations, codec_sizes = (10, 100, 1000, 10000, 100000), 2000, (100, 10000, 100000)
+
+    with FakeDaemon(shares=10) as daemon:
+        results = []
+        results += bench_connect(daemon, iterations // 10)
+        results += bench_cmd(daemon, iterations)
+        results += bench_list_shares(daemon, sizes)
+        results += bench_pipeline(daemon, 500, max(5, iterations // 100))
+        results += bench_startup(daemon, max(5, iterations // 40), 100)
+        allocations = bench_allocations(daemon, sizes)
+    results += bench_encodings(sizes)
+
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_implementation() + " " + platform.python_version(),
+        "results": results,
+        "allocations": allocations,
+        "codecs": bench_codecs(codec_sizes),
+    }
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="ClearSkies client benchmarks")
+    parser.add_argument("-o", "--output", help="Write results to this file as JSON")
+    parser.add_argument("-q", "--quick", action="store_true", default=False, help="Fewer, smaller runs")
+    args = parser.parse_args(args[1:])
+
+    data = run(args.quick)
+
+    fmt = "%-20s %8s %12s %10s %10s"
+    print(fmt % ("benchmark", "size", "ops/sec", "p50 (ms)", "p99 (ms)"))
+    for r in data["results"]:
+        size = r.get("shares", r.get("batch", ""))
+        print(fmt % (r["name"], size, "%.1f" % r["ops_per_sec"], "%.3f" % r["p50_ms"], "%.3f" % r["p99_ms"]))
+
+    fmt = "%-20s %8s %12s %14s %14s"
+    print()
+    print(fmt % ("allocations", "size", "reply bytes", "peak overhead", "gc/1000 msgs"))
+    for r in data["allocations"]:
+        print(fmt % ("", r["shares"], r["reply_bytes"], r["peak_overhead_bytes"], "%.1f" % r["gen0_collections_per_1000"]))
+
+    fmt = "%-20s %8s %12s %12s %12s"
+    print()
+    print(fmt % ("codecs", "size", "wire bytes", "dumps (ms)", "loads (ms)"))
+    for r in data["codecs"]:
+        print(fmt % (r["codec"], r["shares"], r["bytes"], "%.3f" % (r["dumps_s"] * 1000), "%.3f" % (r["loads_s"] * 1000)))
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(data, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,184 @@
+"""
+asyncio versions of the client and transport, for use from inside an
+event loop without tying up a thread per call:
+
+    cs = AsyncClearSkies()
+    await cs.connect()
+    print(await cs.status())
+"""
+import asyncio
+
+from clearskies.transport import Transport
+from clearskies.client import Commands, default_control_path, check_handshake
+from clearskies.exc import ProtocolException, TransportException, TimeoutException
+
+
+class AsyncUnixJsonTransport(Transport):
+    """
+    Shares encoding, decoding and logging with the blocking transports,
+    but does its own IO through asyncio streams.
+    """
+
+    # StreamReader's line limit; longer replies are still read fine, this
+    # is just how much gets buffered before we start collecting pieces
+    limit = 2 ** 20
+
+    def __init__(self, control_path, codec=None):
+        Transport.__init__(self, control_path, codec)
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.pending = []
+        try:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.control_path, limit=self.limit)
+        except OSError as e:
+            raise TransportException(e)
+
+    async def _recv_frame(self):
+        parts = []
+        while True:
+            try:
+                parts.append(await self.reader.readuntil(b"\n"))
+                return b"".join(parts)
+            except asyncio.LimitOverrunError as e:
+                # no newline in the first e.consumed bytes; set those aside
+                # and keep looking
+                parts.append(await self.reader.readexactly(e.consumed))
+            except asyncio.IncompleteReadError as e:
+                raise TransportException("Connection closed by daemon")
+
+    async def recv(self):
+        data = None
+        try:
+            while True:
+                data = await self._recv_frame()
+                if data.strip():
+                    break
+            return self._decode(data)
+        except ValueError as e:
+            raise TransportException("Couldn't decode JSON: %r" % data)
+        except OSError as e:
+            raise TransportException(e)
+
+    async def send(self, js):
+        self.queue(js)
+        await self.flush()
+
+    async def send_many(self, jss):
+        self.pending.extend([self._encode(js) for js in jss])
+        await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, []
+        try:
+            self.writer.writelines(pending)
+            await self.writer.drain()
+            self._sent(sum(len(data) for data in pending))
+        except OSError as e:
+            raise TransportException(e)
+
+    async def close(self):
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except OSError as e:
+            raise TransportException(e)
+
+    def abort(self):
+        """
+        Close without waiting, for when we've been cancelled mid-command
+        """
+        if self.writer:
+            self.writer.close()
+
+
+class AsyncClearSkies(Commands):
+    """
+    Same methods as ClearSkies, but each returns a coroutine. Calls made
+    concurrently on one client take turns on its connection; create more
+    clients to have more than one command in flight.
+
+    Timeouts are applied with asyncio.wait_for() and include any time
+    spent waiting for a turn on the connection. A call which times out (or
+    fails) drops the connection, and the next call makes a new one.
+    """
+
+    def __init__(self, control_path=None, codec=None, metrics=None, timeout=None):
+        self.connected = False
+        self.timeout = timeout
+        self.socket = AsyncUnixJsonTransport(control_path or default_control_path(), codec)
+        self.socket.metrics = metrics
+        self.metrics = metrics
+        # made by the first call, since before Python 3.10 a Lock belongs to
+        # whichever loop was current when it was created
+        self.lock = None
+
+    async def connect(self, timeout=None):
+        await self._timed(self._connect(), timeout)
+
+    async def _connect(self):
+        try:
+            await self.socket.connect()
+            check_handshake(await self.socket.recv())
+
+            self.connected = True
+        except ValueError as e:
+            await self.socket.close()
+            raise ProtocolException("Error in CS handshake: %s" % e)
+        except asyncio.CancelledError:
+            self.socket.abort()
+            raise
+
+    async def _timed(self, coro, timeout):
+        timeout = self.timeout if timeout is None else timeout
+        if timeout is None:
+            return await coro
+        try:
+            return await asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutException("Timed out waiting for the daemon")
+
+    async def close(self):
+        self.connected = False
+        await self.socket.close()
+
+    async def _cmd(self, cmd, result=None, timeout=None):
+        metrics = self.metrics
+        if metrics is None:
+            reply = await self._timed(self._send_recv(cmd), timeout)
+        else:
+            with metrics.command(cmd["type"]):
+                reply = await self._timed(self._send_recv(cmd), timeout)
+        return result(reply) if result else reply
+
+    async def _send_recv(self, cmd):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if not self.connected:
+                await self._connect()
+            try:
+                await self.socket.send(cmd)
+                return await self.socket.recv()
+            except TransportException as e:
+                # the connection is no use to us any more; don't leave it
+                # lying around half-read
+                self.connected = False
+                try:
+                    await self.socket.close()
+                except TransportException:
+                    pass
+                raise
+            except asyncio.CancelledError:
+                # timed out (or cancelled) with the reply still to come
+                self.connected = False
+                self.socket.abort()
+                raise
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
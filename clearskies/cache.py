@@ -0,0 +1,106 @@
+"""
+An opt-in cache for replies to read-only commands:
+
+    cs = ClearSkies(cache=ResponseCache({"status": 1.0, "list_shares": 5.0}))
+
+Replies are kept for the given number of seconds per command type, and
+commands which change the daemon's state throw away the entries they
+might have made stale. Cached replies are shared between callers, so
+don't modify them.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+
+DEFAULT_TTLS = {
+    "status": 1.0,
+    "list_shares": 1.0,
+}
+
+# Which cached command types each mutating command makes stale; mutating
+# commands not listed here clear the whole cache
+INVALIDATES = {
+    "create_share": ("list_shares", "status"),
+    "add_share": ("list_shares", "status"),
+    "remove_share": ("list_shares", "status"),
+    "pause": ("list_shares", "status"),
+    "resume": ("list_shares", "status"),
+    "create_access_code": (),
+}
+
+MISS = object()
+
+
+class ResponseCache(object):
+    def __init__(self, ttls=None, max_size=256, clock=time.time):
+        self.ttls = DEFAULT_TTLS.copy() if ttls is None else dict(ttls)
+        self.max_size = max_size
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> (expiry time, reply), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(cmd):
+        return tuple(sorted(cmd.items()))
+
+    def get(self, cmd):
+        """
+        Return the cached reply for cmd, or MISS
+        """
+        if cmd["type"] not in self.ttls:
+            return MISS
+
+        key = self._key(cmd)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return MISS
+
+    def put(self, cmd, reply):
+        ttl = self.ttls.get(cmd["type"])
+        if ttl is None:
+            return
+
+        key = self._key(cmd)
+        with self.lock:
+            self.entries[key] = (self.clock() + ttl, reply)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, cmd):
+        """
+        Forget anything cmd might change; call this before sending it,
+        since even a failed command may have been acted on.
+        """
+        if cmd["type"] in self.ttls:
+            return
+
+        types = INVALIDATES.get(cmd["type"])
+        with self.lock:
+            if types is None:
+                self.entries.clear()
+            else:
+                for key in [k for k in self.entries if dict(k)["type"] in types]:
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.entries),
+            }
@@ -14,12 +14,10 @@ class CLI(object):
     def __init__(self):
         self.cs = None
 
-    def main(self, args):
-        logging.basicConfig(level=logging.DEBUG, format="%(asctime)19.19s %(levelname)4.4s %(message)s")
-        module_log = logging.getLogger("clearskies")
-
+    def make_parser(self):
         parser = argparse.ArgumentParser(description='ClearSkies python interface demo')
         parser.add_argument('-v', '--verbose', action="store_true", default=False)
+        parser.add_argument('-c', '--control-path', help="Daemon's control socket (default: in the data dir)")
 
         subparsers = parser.add_subparsers()
 
@@ -59,9 +57,29 @@ class CLI(object):
         parser_remove_share.add_argument('path')
         parser_remove_share.set_defaults(func=self.remove_share)
 
-        args = parser.parse_args(args[1:])
+        parser_bulk = subparsers.add_parser(
+            'bulk',
+            help="Run many create/attach/detach commands, one per line, from a file (or stdin)"
+        )
+        parser_bulk.add_argument('file', nargs='?', type=argparse.FileType('r'), default='-')
+        parser_bulk.set_defaults(func=self.bulk)
+
+        parser_shell = subparsers.add_parser(
+            'shell',
+            help="Read commands from stdin, one per line, running them all over one connection"
+        )
+        parser_shell.set_defaults(func=self.shell)
 
-        self.cs = ClearSkies()
+        return parser
+
+    def main(self, args):
+        logging.basicConfig(level=logging.DEBUG, format="%(asctime)19.19s %(levelname)4.4s %(message)s")
+        module_log = logging.getLogger("clearskies")
+
+        self.parser = self.make_parser()
+        args = self.parser.parse_args(args[1:])
+
+        self.cs = ClearSkies(args.control_path)
 
         if args.verbose:
             module_log.setLevel(logging.DEBUG)
@@ -76,7 +94,7 @@ class CLI(object):
             return
 
         if hasattr(args, "func"):
-            args.func(args)
+            return args.func(args)
         else:
             log.error("No command specified, use --help for a list")
 
@@ -102,7 +120,7 @@ class CLI(object):
         print(fmt % ("Status", "Share"))
         print(fmt % ("~~~~~~", "~~~~~"))
         for share in shares:
-            print(fmt % (share["status"], share["path"]))
+            print(fmt % (share.status, share.path))
 
     def create_access_code(self, args):
         print(self.cs.create_access_code(args.path, args.mode))
@@ -113,6 +131,107 @@ class CLI(object):
     def remove_share(self, args):
         print(self.cs.remove_share(args.path))
 
+    # bulk file commands, and the method + number of arguments for each
+    bulk_commands = {
+        "create": ("create_share", 1),
+        "attach": ("add_share", 2),
+        "detach": ("remove_share", 1),
+    }
+
+    def parse_bulk(self, lines):
+        """
+        Turn lines like "create <path>", "attach <code> <path>" or
+        "detach <path>" into (method, args) pairs; blank lines and
+        #comments are skipped. Paths may contain spaces.
+        """
+        calls = []
+        for n, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split(None, 1)
+            if parts[0] not in self.bulk_commands or len(parts) < 2:
+                raise ValueError("Line %d: expected create, attach or detach, got %r" % (n, line))
+            method, nargs = self.bulk_commands[parts[0]]
+            args = tuple(parts[1].split(None, nargs - 1))
+            if len(args) != nargs:
+                raise ValueError("Line %d: %s needs %d arguments" % (n, parts[0], nargs))
+            calls.append((method, args))
+        return calls
+
+    def bulk(self, args):
+        try:
+            with args.file:
+                calls = self.parse_bulk(args.file)
+        except ValueError as e:
+            log.error("%s", e)
+            return 1
+
+        failed = 0
+        for r in self.cs.bulk(calls):
+            method, params = r.item
+            if r.error:
+                failed += 1
+                print("FAIL %s %s: %s" % (method, " ".join(params), r.error))
+            else:
+                print("ok   %s %s" % (method, " ".join(params)))
+        return 1 if failed else 0
+
+    def shell(self, args):
+        """
+        Run commands like "status" or "create /home/foo/Shared" from stdin,
+        saving the cost of starting up and connecting for each one. A
+        failed command is reported and the next one run regardless.
+        """
+        import shlex
+
+        interactive = sys.stdin.isatty()
+        failed = 0
+        while True:
+            if interactive:
+                sys.stdout.write("clearskies> ")
+                sys.stdout.flush()
+            line = sys.stdin.readline()
+            if not line:
+                break
+            try:
+                words = shlex.split(line, comments=True)
+            except ValueError as e:
+                log.error("%s", e)
+                failed += 1
+                continue
+            if not words:
+                continue
+            if words[0] in ("exit", "quit"):
+                break
+            try:
+                cmd = self.parser.parse_args(words)
+            except SystemExit:
+                # argparse has already printed what was wrong
+                failed += 1
+                continue
+            if not hasattr(cmd, "func") or cmd.func == self.shell:
+                log.error("Expected a command, got %r", line.strip())
+                failed += 1
+                continue
+            if cmd.func == self.bulk and cmd.file is sys.stdin:
+                # stdin is where the shell's own commands come from
+                log.error("bulk needs a file when run from the shell")
+                failed += 1
+                continue
+            try:
+                if cmd.func(cmd):
+                    failed += 1
+            except (ClientException, ValueError) as e:
+                log.error("%s: %s", words[0], e)
+                failed += 1
+            except Exception as e:
+                # eg. the KeyError from looking for a field in an error reply
+                log.error("%s failed: %r", words[0], e)
+                failed += 1
+            sys.stdout.flush()
+        return 1 if failed else 0
+
 
 def main():
     sys.exit(CLI().main(sys.argv))
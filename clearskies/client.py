@@ -1,90 +1,155 @@
 from clearskies.transport import UnixJsonTransport, WindowsJsonTransport
-from clearskies.exc import ProtocolException, TransportException
+from clearskies.exc import ProtocolException, TransportException, TimeoutException, CommandException
+from clearskies.cache import MISS
+from clearskies.config import ConfigStore
+from collections import namedtuple
+from operator import itemgetter
 import os
-import platform
+import sys
+import random
+import time
 import logging
 
 log = logging.getLogger(__name__)
 
+# Modules which only some calls need are imported by those calls, so that
+# a short-lived process (eg. one CLI command) doesn't pay for them.
 
-try:
-    import xdg.BaseDirectory as xdgBaseDirectory
-except ImportError:  # pragma: no cover
-    # hack for dependency-free quickstart
-    print("WARNING: failed to import xdg library, using hacky fallback")
-    class xdgBaseDirectory:
-        @staticmethod
-        def save_data_path(x):
+
+class xdgBaseDirectory(object):
+    """
+    Stands in for xdg.BaseDirectory, importing it the first time it's used
+    """
+    @staticmethod
+    def save_data_path(x):
+        try:
+            import xdg.BaseDirectory
+        except ImportError:  # pragma: no cover
+            # hack for dependency-free quickstart
+            print("WARNING: failed to import xdg library, using hacky fallback")
             path = os.path.join(os.path.expanduser("~/.local/share/"), x)
             if not os.path.exists(path):
                 os.makedirs(path)
             return path
+        return xdg.BaseDirectory.save_data_path(x)
 
 
-class ClearSkies(object):
-    def __init__(self):
-        data_dir = xdgBaseDirectory.save_data_path("clearskies")
-        control_path = os.path.join(data_dir, "control")
-        self.connected = False
+def default_control_path():
+    data_dir = xdgBaseDirectory.save_data_path("clearskies")
+    return os.path.join(data_dir, "control")
 
-        plat = platform.platform()
-        if "Windows" in plat:
-            self.socket = WindowsJsonTransport(control_path)
-        else:
-            self.socket = UnixJsonTransport(control_path)
 
-    def connect(self):
-        try:
-            self.socket.connect()
+# Commands which don't change anything on the daemon, so can safely be
+# sent again if the connection drops before we see the reply
+REPLAY_SAFE_COMMANDS = frozenset([
+    "status",
+    "list_shares",
+])
 
-            handshake = self.socket.recv()
-            if handshake["protocol"] != 1:
-                raise ValueError("Only protocol V1 is currently supported")
 
-            self.connected = True
-        except ValueError as e:
-            raise ProtocolException("Error in CS handshake: %s" % e)
+def is_replay_safe(cmd):
+    return cmd["type"] in REPLAY_SAFE_COMMANDS
+
+
+def _share_list(reply):
+    from clearskies.share import Share
+    from_json = Share.from_json
+    return [from_json(js) for js in reply["shares"]]
+
+
+def _share_table(reply):
+    from clearskies.share import ShareTable
+    return ShareTable(reply["shares"])
+
+
+# One item of a bulk operation, and either what the daemon said about it
+# or why it failed
+BulkResult = namedtuple("BulkResult", ["item", "result", "error"])
+
+
+def _is_windows():
+    # platform.platform() would tell us too, but it probes the system and
+    # takes milliseconds, which matters for one-command processes
+    return sys.platform == "win32"
+
+
+def make_transport(control_path, codec=None):
+    if _is_windows():
+        return WindowsJsonTransport(control_path, codec)
+    else:
+        return UnixJsonTransport(control_path, codec)
+
+
+def deadline_after(timeout):
+    """
+    Turn a timeout in seconds (or None for no limit) into the absolute
+    time.monotonic() deadline which transports expect.
+    """
+    return None if timeout is None else time.monotonic() + timeout
+
+
+def check_handshake(handshake):
+    """
+    Make sure the greeting the daemon sends on connect is one we can talk
+    to; raises ValueError if not.
+    """
+    if handshake["protocol"] != 1:
+        raise ValueError("Only protocol V1 is currently supported")
 
-    def _cmd(self, cmd):
-        try:
-            self.socket.send(cmd)
-            return self.socket.recv()
-        except TransportException as e:
-            self.connected = False
-            raise
 
-    def stop(self):
+class Commands(object):
+    """
+    The daemon's control API, shared by every kind of client.
+
+    Each method builds a command and hands it to self._cmd(), along with
+    an optional function to pick the interesting part out of the reply;
+    subclasses decide whether that happens now (ClearSkies), later
+    (Pipeline), or in a coroutine.
+
+    Every method takes an optional timeout in seconds, covering the whole
+    call (including any reconnecting); if it runs out, TimeoutException
+    is raised.
+    """
+
+    def _cmd(self, cmd, result=None, timeout=None):
+        raise NotImplementedError()
+
+    def stop(self, timeout=None):
         return self._cmd({
             "type": "stop",
-        })
+        }, timeout=timeout)
 
-    def pause(self):
+    def pause(self, timeout=None):
         return self._cmd({
             "type": "pause",
-        })
+        }, timeout=timeout)
 
-    def resume(self):
+    def resume(self, timeout=None):
         return self._cmd({
             "type": "resume",
-        })
+        }, timeout=timeout)
 
-    def status(self):
+    def status(self, timeout=None):
         return self._cmd({
             "type": "status",
-        })
+        }, timeout=timeout)
 
-    def create_share(self, path):
+    def create_share(self, path, timeout=None):
         return self._cmd({
             "type": "create_share",
             "path": path,
-        })
+        }, timeout=timeout)
 
-    def list_shares(self):
+    def list_shares(self, table=False, timeout=None):
+        """
+        Returns a list of Share objects, or with table=True a more compact
+        (but read-only) ShareTable.
+        """
         return self._cmd({
             "type": "list_shares",
-        })["shares"]
+        }, _share_table if table else _share_list, timeout)
 
-    def create_access_code(self, path, mode):
+    def create_access_code(self, path, mode, timeout=None):
         valid_modes = ["read_write", "read_only", "untrusted"]
         if mode not in valid_modes:
             raise ValueError("Invalid access code mode, must be one of %s" % valid_modes)
@@ -93,56 +158,434 @@ class ClearSkies(object):
             "type": "create_access_code",
             "path": path,
             "mode": mode,
-        })["access_code"]
+        }, itemgetter("access_code"), timeout)
 
-    def add_share(self, code, path):
+    def add_share(self, code, path, timeout=None):
         return self._cmd({
             "type": "add_share",
             "code": code,
             "path": path,
-        })
+        }, timeout=timeout)
 
-    def remove_share(self, path):
+    def remove_share(self, path, timeout=None):
         return self._cmd({
             "type": "remove_share",
             "path": path,
-        })
+        }, timeout=timeout)
+
+
+class ClearSkies(Commands):
+    """
+    If the connection drops, the next command reconnects (redoing the
+    handshake), retrying up to `retries` times with jittered exponential
+    backoff between attempts. A command which had already been sent is
+    only retried if it is replay-safe, since otherwise we can't know
+    whether the daemon acted on it.
+
+    `timeout` is the default for calls which don't give their own. A call
+    which times out is not retried, and its connection is closed (the
+    reply may still arrive, and would be mistaken for the next one's).
+
+    With `binary=True`, if the daemon's handshake lists a binary encoding
+    we have a codec for (see clearskies.codec.binary_codecs), we ask to
+    switch to it for the rest of the connection; otherwise, or if the
+    daemon says no, we stay with JSON lines.
+    """
+
+    def __init__(self, control_path=None, retries=3, backoff=0.05, max_backoff=2.0, cache=None, codec=None,
+                 metrics=None, timeout=None, config=None, binary=False):
+        self.connected = False
+        self.handshake = None
+        self.socket = make_transport(control_path or default_control_path(), codec)
+        self.socket.metrics = metrics
+        self.metrics = metrics
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.binary = binary
+        self.config = config or ConfigStore(on_flush=self._push_config)
+
+    def _deadline(self, timeout):
+        return deadline_after(self.timeout if timeout is None else timeout)
+
+    def connect(self, timeout=None):
+        self._connect(self._deadline(timeout))
+
+    def _connect(self, deadline):
+        try:
+            self.socket.connect(deadline)
+
+            handshake = self.socket.recv(deadline)
+            check_handshake(handshake)
+
+            self.handshake = handshake
+            if self.binary:
+                self._negotiate_encoding(deadline)
+            self.connected = True
+        except ValueError as e:
+            raise ProtocolException("Error in CS handshake: %s" % e)
+        except TimeoutException:
+            self._close_socket()
+            raise
+
+    def _negotiate_encoding(self, deadline):
+        from clearskies.codec import binary_codecs
+        for codec in binary_codecs():
+            if self.supports(codec.name):
+                self.socket.send({
+                    "type": "set_encoding",
+                    "encoding": codec.name,
+                }, deadline)
+                reply = self.socket.recv(deadline)
+                if "error" in reply:
+                    log.warning("Daemon refused %s encoding: %s", codec.name, reply["error"])
+                    continue
+                self.socket.binary = codec
+                return
+
+    def close(self):
+        self.connected = False
+        self.socket.close()
+
+    def supports(self, feature):
+        """
+        Whether the daemon listed `feature` in its handshake; protocol
+        extensions are only used when the daemon says it has them.
+        """
+        return feature in (self.handshake or {}).get("features", ())
+
+    def _close_socket(self):
+        self.connected = False
+        try:
+            self.socket.close()
+        except Exception as e:
+            log.debug("Error closing old connection: %s", e)
+
+    def reconnect(self, timeout=None):
+        self._reconnect(self._deadline(timeout))
+
+    def _reconnect(self, deadline):
+        self._close_socket()
+        if self.metrics is not None and self.handshake is not None:
+            # a client's first connection is made here too, lazily; that
+            # one isn't a reconnect
+            self.metrics.reconnected()
+        self._connect(deadline)
+
+    def _backoff(self, attempt, deadline=None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            raise TimeoutException("Timed out reconnecting to the daemon")
+        time.sleep(delay)
+
+    def _cmd(self, cmd, result=None, timeout=None):
+        deadline = self._deadline(timeout)
+        cache = self.cache
+        if cache is not None:
+            reply = cache.get(cmd)
+            if reply is MISS:
+                cache.invalidate(cmd)
+                reply = self._send_recv(cmd, deadline)
+                cache.put(cmd, reply)
+        else:
+            reply = self._send_recv(cmd, deadline)
+        return result(reply) if result else reply
+
+    def _send_recv(self, cmd, deadline=None):
+        metrics = self.metrics
+        if metrics is None:
+            return self._send_recv_retrying(cmd, deadline)
+        with metrics.command(cmd["type"]):
+            return self._send_recv_retrying(cmd, deadline)
+
+    def _send_recv_retrying(self, cmd, deadline=None):
+        attempt = 0
+        while True:
+            sent = False
+            try:
+                if not self.connected:
+                    self._reconnect(deadline)
+                sent = True
+                self.socket.send(cmd, deadline)
+                reply = self.socket.recv(deadline)
+                break
+            except TimeoutException:
+                self._close_socket()
+                raise
+            except TransportException as e:
+                self.connected = False
+                if attempt >= self.retries or (sent and not is_replay_safe(cmd)):
+                    raise
+                log.debug("Lost connection to daemon (%s), retrying %r", e, cmd["type"])
+                self._backoff(attempt, deadline)
+                attempt += 1
+        return reply
+
+    def _pipeline(self, cmds, deadline=None):
+        """
+        Send all of cmds in one write, then yield their replies in order
+        as they arrive.
+        """
+        if self.cache is not None:
+            for cmd in cmds:
+                self.cache.invalidate(cmd)
+        try:
+            if not self.connected:
+                self._reconnect(deadline)
+            self.socket.send_many(cmds, deadline)
+            for _ in cmds:
+                yield self.socket.recv(deadline)
+        except TimeoutException:
+            self._close_socket()
+            raise
+        except TransportException as e:
+            self.connected = False
+            raise
+
+    def iter_shares(self, timeout=None):
+        """
+        Like list_shares(), but yields each Share as soon as it has been
+        read, so memory use stays flat however many shares there are.
+        The timeout covers reading the whole listing.
+        """
+        from clearskies.share import Share
+        from clearskies.jsonstream import iter_json_array
+        deadline = self._deadline(timeout)
+        try:
+            if not self.connected:
+                self._reconnect(deadline)
+            self.socket.send({
+                "type": "list_shares",
+            }, deadline)
+            if self.socket.binary is not None:
+                # binary messages can't be decoded piece by piece, but are
+                # smaller and quicker to decode anyway
+                for js in self.socket.recv(deadline)["shares"]:
+                    yield Share.from_json(js)
+                return
+            chunks = self.socket.recv_chunks(deadline)
+            try:
+                for js in iter_json_array(chunks, "shares"):
+                    yield Share.from_json(js)
+            finally:
+                # read (and discard) the rest of the reply, so that the next
+                # one lines up with the next command
+                for chunk in chunks:
+                    pass
+        except TimeoutException:
+            self._close_socket()
+            raise
+        except ValueError as e:
+            self.connected = False
+            raise TransportException("Couldn't decode JSON: %s" % e)
+        except TransportException as e:
+            self.connected = False
+            raise
+
+    def events(self, **kwargs):
+        """
+        Watch for changes to shares, see clearskies.events.ShareWatcher
+        for the options:
+
+            for event in cs.events():
+                print(event)
+        """
+        from clearskies.events import ShareWatcher
+        return ShareWatcher(self.socket.control_path, codec=self.socket.codec, **kwargs)
+
+    def bulk(self, calls, timeout=None, batch_size=100):
+        """
+        Run many commands, given as (method name, args) pairs, pipelining
+        them over one connection `batch_size` at a time. Returns a
+        BulkResult for each, in order; failures (including the daemon
+        answering with an error, as a CommandException) don't stop the
+        rest.
+
+            cs.bulk([
+                ("create_share", ("/home/foo/A", )),
+                ("remove_share", ("/home/foo/B", )),
+            ])
+        """
+        return self._bulk(calls, calls, timeout, batch_size)
+
+    def create_shares(self, paths, timeout=None, batch_size=100):
+        paths = list(paths)
+        calls = [("create_share", (path, )) for path in paths]
+        return self._bulk(calls, paths, timeout, batch_size)
+
+    def add_shares(self, codes_and_paths, timeout=None, batch_size=100):
+        """
+        Takes a list of (access code, path) pairs
+        """
+        items = [tuple(item) for item in codes_and_paths]
+        calls = [("add_share", item) for item in items]
+        return self._bulk(calls, items, timeout, batch_size)
+
+    def remove_shares(self, paths, timeout=None, batch_size=100):
+        paths = list(paths)
+        calls = [("remove_share", (path, )) for path in paths]
+        return self._bulk(calls, paths, timeout, batch_size)
+
+    def _bulk(self, calls, items, timeout, batch_size):
+        results = []
+        for n in range(0, len(calls), batch_size):
+            p = self.pipeline()
+            futures = [getattr(p, method)(*args) for method, args in calls[n:n + batch_size]]
+            try:
+                p.execute(timeout)
+            except Exception as e:
+                # each future has its own result or error
+                log.debug("Error in bulk operation: %s", e)
+            for item, future in zip(items[n:n + batch_size], futures):
+                error = future.exception()
+                result = None if error else future.result()
+                if isinstance(result, dict) and "error" in result:
+                    # the daemon refused this one
+                    result, error = None, CommandException(result["error"])
+                results.append(BulkResult(item, result, error))
+        return results
+
+    def scan_shares(self, workers=None, timeout=None):
+        """
+        Check every share's directory on disk, using a pool of `workers`
+        processes (default one per core), and yield a
+        clearskies.scan.ScanResult for each as it finishes, along with
+        the daemon's status for it. The timeout covers list_shares().
+        """
+        from clearskies import scan
+        return scan.scan_shares(self.list_shares(timeout=timeout), workers)
+
+    def pipeline(self):
+        """
+        Queue up commands and send them all at once, rather than waiting
+        for each reply before sending the next command:
+
+            with cs.pipeline() as p:
+                statuses = [p.status() for n in range(10)]
+                shares = p.list_shares()
+            print(shares.result())
+
+        Each method returns a Future, which is filled in when the
+        pipeline is executed (explicitly, or at the end of the with-block).
+        """
+        return Pipeline(self)
 
     ##########################################################################
     # Not official APIs section
     ##########################################################################
+    def _log_path(self):
+        data_dir = xdgBaseDirectory.save_data_path("clearskies")
+        return os.path.join(data_dir, "log")
+
     def get_log_data(self, lines=0):
+        """
+        Return the daemon's log, or just the last `lines` lines of it
+        (which only reads as much of the file as it needs to).
+        """
+        from clearskies import logtail
         try:
-            data_dir = xdgBaseDirectory.save_data_path("clearskies")
-            log_path = os.path.join(data_dir, "log")
-            data = open(log_path).read()
             if lines:
-                data = "\n".join(data.split("\n")[-(lines + 1):])
-            return data
+                return logtail.tail(self._log_path(), lines)
+            with open(self._log_path()) as f:
+                return f.read()
         except Exception as e:
             raise ProtocolException("Couldn't get log data: %s" % e)
 
-    __config = {
-        "tracker": "http://clearskies.tuxng.org/clearskies/track",
-        "upload_limit": 32000,
-        "download_limit": 256000,
-        "demo_int": 123,
-        "demo_bool": True,
-        "demo_string": "foo",
-    }
+    def follow_log(self, lines=0, interval=1.0):
+        """
+        Yield the last `lines` lines of the daemon's log, then each new
+        line as it is written; see clearskies.logtail.follow
+        """
+        from clearskies import logtail
+        try:
+            log_path = self._log_path()
+            for line in logtail.follow(log_path, lines, interval):
+                yield line
+        except (IOError, OSError) as e:
+            raise ProtocolException("Couldn't get log data: %s" % e)
+
+    def _push_config(self, changed):
+        # daemons which don't take config from us read the file themselves
+        if self.connected and self.supports("config"):
+            self._cmd({
+                "type": "set_config",
+                "config": changed,
+            })
 
     def get_config(self):
-        log.debug("STUB: Getting config")
-        return self.__config.copy()
+        return self.config.get_all()
 
     def set_config(self, config):
-        log.debug("STUB: Setting config")
-        self.__config = config.copy()
+        self.config.replace(config)
 
     def get_config_value(self, key):
-        log.debug("STUB: Getting config %r", key)
-        return self.__config[key]
+        return self.config.get(key)
 
     def set_config_value(self, key, value):
-        log.debug("STUB: Setting config %r to %r", key, value)
-        self.__config[key] = value
+        self.config.set(key, value)
+
+    def config_batch(self):
+        """
+        Make several set_config_value() calls, saving (and sending to the
+        daemon) only once, at the end:
+
+            with cs.config_batch():
+                cs.set_config_value("upload_limit", 64000)
+                cs.set_config_value("download_limit", 512000)
+        """
+        return self.config.batch()
+
+
+class Pipeline(Commands):
+    """
+    Commands queued on a pipeline share one timeout, given to execute();
+    per-command timeouts are ignored.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.queue = []
+
+    def _cmd(self, cmd, result=None, timeout=None):
+        from concurrent.futures import Future
+        future = Future()
+        self.queue.append((cmd, result, future))
+        return future
+
+    def execute(self, timeout=None):
+        """
+        Send every queued command and wait for all the replies; returns
+        the results in the order the commands were queued (raising the
+        first error, if any -- the Futures hold per-command errors).
+        """
+        queue, self.queue = self.queue, []
+        if not queue:
+            return []
+
+        if timeout is None:
+            timeout = getattr(self.client, "timeout", None)
+        replies = self.client._pipeline([cmd for cmd, result, future in queue], deadline_after(timeout))
+        pending = iter(queue)
+        try:
+            for reply in replies:
+                cmd, result, future = next(pending)
+                try:
+                    future.set_result(result(reply) if result else reply)
+                except Exception as e:
+                    future.set_exception(e)
+        except Exception as e:
+            for cmd, result, future in queue:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+
+        return [future.result() for cmd, result, future in queue]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
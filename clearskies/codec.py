@@ -0,0 +1,147 @@
+"""
+Ways of turning messages into bytes and back.
+
+Transports use whichever is fastest out of orjson, ujson and the standard
+library's json module, unless told otherwise; all of them work directly
+on bytes, so there's no separate utf8 encode / decode step.
+
+Binary codecs (MessagePack, CBOR) are more compact and quicker to decode,
+but only used once both ends have agreed on one, see
+ClearSkies(binary=True).
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class Codec(object):
+    name = None
+    # binary output may contain anything, newlines included, so it has
+    # to be sent length-prefixed rather than one message per line
+    binary = False
+
+    def dumps(self, obj):
+        """
+        Encode obj as bytes; the result must not contain newlines, since
+        those separate messages on the wire.
+        """
+        raise NotImplementedError()
+
+    def loads(self, data):
+        """
+        Decode bytes, a bytearray or a memoryview; raises ValueError for
+        malformed input.
+        """
+        raise NotImplementedError()
+
+
+class StdlibJsonCodec(Codec):
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj).encode("utf8")
+
+    def loads(self, data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name = "orjson"
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class UjsonCodec(Codec):
+    name = "ujson"
+
+    def dumps(self, obj):
+        return ujson.dumps(obj, ensure_ascii=False).encode("utf8")
+
+    def loads(self, data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return ujson.loads(data)
+
+
+# The binary codecs are opt-in, so their libraries are only imported when
+# one is created (raising ImportError if it isn't installed), rather than
+# slowing down every `import clearskies`.
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    binary = True
+
+    def __init__(self):
+        import msgpack
+        self.packb = msgpack.packb
+        self.unpackb = msgpack.unpackb
+
+    def dumps(self, obj):
+        return self.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        # all of msgpack's decoding errors are ValueErrors
+        return self.unpackb(data, raw=False)
+
+
+class CborCodec(Codec):
+    name = "cbor"
+    binary = True
+
+    def __init__(self):
+        import cbor2
+        self.cbor2 = cbor2
+
+    def dumps(self, obj):
+        return self.cbor2.dumps(obj)
+
+    def loads(self, data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        try:
+            return self.cbor2.loads(data)
+        except self.cbor2.CBORError as e:
+            raise ValueError(str(e))
+
+
+def available_codecs():
+    """
+    Every codec which can be used here, fastest first.
+    """
+    codecs = []
+    if orjson:
+        codecs.append(OrjsonCodec())
+    if ujson:
+        codecs.append(UjsonCodec())
+    codecs.append(StdlibJsonCodec())
+    return codecs
+
+
+def binary_codecs():
+    """
+    Every binary codec which can be used here, most preferred first.
+    """
+    codecs = []
+    for cls in (MsgpackCodec, CborCodec):
+        try:
+            codecs.append(cls())
+        except ImportError:
+            pass
+    return codecs
+
+
+def default_codec():
+    return available_codecs()[0]
@@ -0,0 +1,159 @@
+"""
+Client-side settings, kept in a JSON file in the ClearSkies data dir.
+
+    store = ConfigStore()
+    with store.batch():
+        store.set("upload_limit", 64000)
+        store.set("download_limit", 512000)
+    # written to disk once, at the end of the batch
+"""
+from contextlib import contextmanager
+import json
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+
+# Settings we know about, and the types they must have; anything else is
+# stored as-is
+SCHEMA = {
+    "tracker": str,
+    "upload_limit": int,
+    "download_limit": int,
+}
+
+DEFAULTS = {
+    "tracker": "http://clearskies.tuxng.org/clearskies/track",
+    "upload_limit": 32000,
+    "download_limit": 256000,
+    "demo_int": 123,
+    "demo_bool": True,
+    "demo_string": "foo",
+}
+
+
+def default_config_path():
+    # imported here rather than at the top, since the client imports us
+    from clearskies.client import xdgBaseDirectory
+    return os.path.join(xdgBaseDirectory.save_data_path("clearskies"), "config.json")
+
+
+def validate(key, value):
+    """
+    Raise ValueError if `value` isn't allowed for `key`
+    """
+    expected = SCHEMA.get(key)
+    if expected is None:
+        return
+    # bool is a subclass of int, but True isn't a sensible speed limit
+    if not isinstance(value, expected) or isinstance(value, bool):
+        raise ValueError("Config %r must be a %s, not %r" % (key, expected.__name__, value))
+    if expected is int and value < 0:
+        raise ValueError("Config %r can't be negative" % key)
+
+
+class ConfigStore(object):
+    """
+    Settings are read from `path` the first time they're needed, and
+    written back (atomically, so a crash never leaves half a file) after
+    each change, or once at the end of a batch().
+
+    `on_flush` is called with a dict of what changed after each write,
+    eg. to pass the new settings on to the daemon.
+    """
+
+    def __init__(self, path=None, on_flush=None):
+        self.path = path
+        self.on_flush = on_flush
+        self.values = None
+        self.changed = {}
+        self.depth = 0
+
+    def _load(self):
+        if self.values is None:
+            self.path = self.path or default_config_path()
+            values = DEFAULTS.copy()
+            try:
+                with open(self.path) as f:
+                    saved = json.load(f)
+            except (IOError, OSError):
+                saved = {}
+            except ValueError as e:
+                log.warning("Ignoring unreadable config file %s: %s", self.path, e)
+                saved = {}
+            for key, value in saved.items():
+                try:
+                    validate(key, value)
+                    values[key] = value
+                except ValueError as e:
+                    log.warning("Ignoring saved setting: %s", e)
+            self.values = values
+        return self.values
+
+    def get(self, key):
+        return self._load()[key]
+
+    def get_all(self):
+        return self._load().copy()
+
+    def set(self, key, value):
+        validate(key, value)
+        self._load()[key] = value
+        self.changed[key] = value
+        if not self.depth:
+            self.flush()
+
+    def update(self, config):
+        """
+        Change several settings at once; nothing is changed if any of
+        them are invalid.
+        """
+        for key, value in config.items():
+            validate(key, value)
+        with self.batch():
+            for key, value in config.items():
+                self.set(key, value)
+
+    def replace(self, config):
+        """
+        Throw away every setting and use `config` instead
+        """
+        for key, value in config.items():
+            validate(key, value)
+        self._load()
+        self.values = dict(config)
+        self.changed = dict(config)
+        if not self.depth:
+            self.flush()
+
+    @contextmanager
+    def batch(self):
+        """
+        Hold back writes until the end of the with-block
+        """
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if not self.depth and self.changed:
+                self.flush()
+
+    def flush(self):
+        import tempfile  # only needed here, and slow to import
+        values = self._load()
+        changed, self.changed = self.changed, {}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".config-", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(values, f, indent=4, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        if self.on_flush and changed:
+            self.on_flush(changed)
@@ -0,0 +1,176 @@
+"""
+Find out about changes to shares as they happen, rather than polling
+list_shares() by hand:
+
+    for event in ClearSkies().events():
+        print(event["event"], event["path"])
+
+Events are dicts with "event" set to one of:
+
+- share_added: a new share, with "path" and "status"
+- share_removed: a share went away, with "path"
+- share_status: a share's status changed, with "path", "status" and
+  "old_status"
+
+If the daemon advertises the "events" feature in its handshake, we
+subscribe and it pushes events to us over a dedicated connection;
+otherwise we poll list_shares() and work out the events ourselves,
+polling more often while things are changing and backing off while
+they're not.
+"""
+import threading
+import logging
+
+from clearskies.client import ClearSkies
+from clearskies.share import Share, ShareIndex
+from clearskies.exc import TransportException, ProtocolException
+
+log = logging.getLogger(__name__)
+
+
+def delta_events(delta):
+    """
+    Turn a ShareDelta into the equivalent list of events
+    """
+    events = []
+    for share in delta.added:
+        events.append({"event": "share_added", "path": share.path, "status": share.status})
+    for old, new in delta.changed:
+        events.append({"event": "share_status", "path": new.path, "status": new.status, "old_status": old.status})
+    for share in delta.removed:
+        events.append({"event": "share_removed", "path": share.path})
+    return events
+
+
+class ShareWatcher(object):
+    """
+    Iterate over a watcher to get events, or use run(callback) / start(callback)
+    to have them delivered to a function (start() runs in a background
+    thread). stop() ends either.
+
+    With initial=True, the shares which exist when watching starts are
+    reported as share_added events. push=False forces polling even if the
+    daemon supports events.
+    """
+
+    def __init__(self, control_path=None, codec=None, min_interval=0.5, max_interval=30.0,
+                 initial=True, push=None, client_factory=ClearSkies):
+        self.client = client_factory(control_path, codec=codec)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial = initial
+        self.push = push
+        self.index = None  # the state of the shares as of the last event we gave out
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _changes(self, shares):
+        if self.index is None:
+            self.index = ShareIndex()
+            if not self.initial:
+                self.index.apply(shares)
+                return []
+        return delta_events(self.index.apply(shares))
+
+    def _apply(self, event):
+        """
+        Keep our index up to date with a pushed event
+        """
+        if event.get("event") == "share_removed":
+            self.index.discard(event["path"])
+        elif event.get("event") in ("share_added", "share_status"):
+            self.index.update(Share(event["path"], event["status"]))
+
+    def _subscribe(self):
+        """
+        Ask for events, returning False if the daemon won't send them
+        """
+        reply = self.client._cmd({"type": "subscribe"})
+        if "error" in reply:
+            log.warning("Daemon refused to send events (%s), polling instead", reply["error"])
+            return False
+        return True
+
+    def _list_subscribed(self):
+        """
+        list_shares() on a subscribed connection, where events may arrive
+        ahead of the reply; they happened before the listing was made, so
+        it covers them and they're skipped
+        """
+        self.client.socket.send({"type": "list_shares"})
+        while True:
+            reply = self.client.socket.recv()
+            if "event" not in reply:
+                break
+        if "shares" not in reply:
+            raise ProtocolException("Couldn't list shares: %s" % reply.get("error", reply))
+        return [Share.from_json(js) for js in reply["shares"]]
+
+    def _watch_push(self):
+        while not self.stopped.is_set():
+            event = self.client.socket.recv()
+            self._apply(event)
+            yield event
+
+    def _watch_poll(self):
+        interval = self.min_interval
+        while not self.stopped.wait(interval):
+            events = self._changes(self.client.list_shares())
+            for event in events:
+                yield event
+            if events:
+                interval = self.min_interval
+            else:
+                interval = min(self.max_interval, interval * 2)
+
+    def __iter__(self):
+        failures = 0
+        while not self.stopped.is_set():
+            try:
+                if not self.client.connected:
+                    self.client.reconnect()
+
+                push = self.push
+                if push is None:
+                    push = self.client.supports("events")
+                # subscribe before listing, so that nothing can change
+                # unnoticed in between
+                push = push and self._subscribe()
+
+                # start (or pick up again after a reconnect) from a full listing
+                shares = self._list_subscribed() if push else self.client.list_shares()
+                for event in self._changes(shares):
+                    yield event
+                failures = 0
+
+                for event in (self._watch_push() if push else self._watch_poll()):
+                    yield event
+            except TransportException as e:
+                if self.stopped.is_set():
+                    break
+                self.client.connected = False
+                failures += 1
+                delay = min(self.max_interval, self.min_interval * (2 ** failures))
+                log.debug("Lost connection while watching (%s), retrying in %.1fs", e, delay)
+                self.stopped.wait(delay)
+
+    def run(self, callback):
+        for event in self:
+            callback(event)
+
+    def start(self, callback):
+        self.thread = threading.Thread(target=self.run, args=(callback, ))
+        self.thread.daemon = True
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.stopped.set()
+        if self.client.connected:
+            # wakes up a blocking recv() in push mode
+            try:
+                self.client.close()
+            except TransportException as e:
+                log.debug("Error closing watcher connection: %s", e)
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
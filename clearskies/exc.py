@@ -6,5 +6,16 @@ class TransportException(ClientException):
     pass
 
 
+class TimeoutException(TransportException):
+    pass
+
+
 class ProtocolException(ClientException):
     pass
+
+
+class CommandException(ClientException):
+    """
+    The daemon understood a command, but answered it with an error
+    """
+    pass
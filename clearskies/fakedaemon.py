@@ -0,0 +1,348 @@
+"""
+A stand-in for the ClearSkies daemon which speaks the control protocol
+over a unix socket, keeping its shares in memory. It's for testing and
+benchmarking code which uses the client without running the real daemon,
+and can be made slow, flaky or awkward on purpose:
+
+    with FakeDaemon(latency=0.01, fragment=7, failure_rate=0.05) as daemon:
+        cs = ClearSkies(daemon.control_path)
+        cs.create_share("/home/foo/Shared")
+
+The server runs on its own event loop in a background thread, so it can
+serve any number of blocking clients; from inside an event loop, use
+`async with FakeDaemon() as daemon` instead.
+"""
+import asyncio
+import binascii
+import json
+import os
+import random
+import shutil
+import tempfile
+import struct
+import threading
+import logging
+
+from clearskies.codec import binary_codecs
+
+log = logging.getLogger(__name__)
+
+
+HANDSHAKE = {"protocol": 1, "service": "ClearSkies Control", "software": "fakedaemon"}
+
+ACCESS_MODES = ("read_write", "read_only", "untrusted")
+
+
+class FakeDaemon(object):
+    """
+    `latency` is how long to wait before each reply, in seconds, or a
+    function returning that. Given the "request_ids" feature, tagged
+    commands are answered concurrently, so with varying latency their
+    replies come back out of order. `fragment` splits everything sent into
+    writes of at most that many bytes. `failure_rate` is the chance of
+    hanging up on a client instead of answering its command (after the
+    command has been carried out, which is the awkward case for clients);
+    fail_next() does the same deterministically.
+
+    Listing "msgpack" or "cbor" in `features` lets clients switch to that
+    encoding (if it's installed here) with a set_encoding command.
+    """
+
+    def __init__(self, control_path=None, shares=0, latency=0, fragment=None, failure_rate=0.0, features=(),
+                 seed=None):
+        self.tmpdir = None
+        if control_path is None:
+            self.tmpdir = tempfile.mkdtemp(prefix="clearskies-fake-")
+            control_path = os.path.join(self.tmpdir, "control")
+        self.control_path = control_path
+        self.handshake = dict(HANDSHAKE, features=list(features))
+        self.latency = latency
+        self.fragment = fragment
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.codecs = dict((c.name, c) for c in binary_codecs())
+
+        self.shares = {}  # path -> status
+        self.access_codes = {}  # code -> (path, mode)
+        self.paused = False
+        self._list_replies = {}  # encoding -> encoded list_shares reply
+        self.set_shares(shares)
+
+        self.failures = 0
+        self.connections = 0  # currently open
+        self.max_connections = 0
+        self.total_connections = 0
+        self.commands = 0
+
+        self.server = None
+        self.writers = set()
+        self.tasks = set()
+        self.loop = None
+        self.thread = None
+
+    ##########################################################################
+    # State
+    ##########################################################################
+
+    def set_shares(self, count):
+        """
+        Replace every share with `count` made-up ones
+        """
+        self.shares = dict(("/home/user/Shared/%08d" % n, "N/A") for n in range(count))
+        self._changed()
+
+    def fail_next(self, count=1):
+        """
+        Hang up instead of answering the next `count` commands
+        """
+        self.failures += count
+
+    def list_shares_reply(self, encoding="json"):
+        # encoding a big listing is slow, and it rarely changes
+        reply = self._list_replies.get(encoding)
+        if reply is None:
+            reply = self._list_replies[encoding] = self.encode(self.cmd_list_shares({}), encoding)
+        return reply
+
+    def _changed(self):
+        self._list_replies = {}
+
+    def encode(self, js, encoding="json"):
+        if encoding == "json":
+            return (json.dumps(js) + "\n").encode("utf8")
+        data = self.codecs[encoding].dumps(js)
+        return struct.pack(">I", len(data)) + data
+
+    ##########################################################################
+    # Commands
+    ##########################################################################
+
+    def reply(self, cmd, encoding="json"):
+        """
+        Carry out a command, returning the encoded reply, with the
+        command's "id" (if any) copied into it
+        """
+        if cmd.get("type") == "list_shares" and "id" not in cmd:
+            return self.list_shares_reply(encoding)
+        handler = getattr(self, "cmd_" + str(cmd.get("type")), None)
+        if handler is None:
+            reply = {"error": "Unknown command %r" % cmd.get("type")}
+        else:
+            try:
+                reply = handler(cmd)
+            except KeyError as e:
+                reply = {"error": "Missing or unknown %s" % e}
+        if "id" in cmd:
+            reply = dict(reply, id=cmd["id"])
+        return self.encode(reply, encoding)
+
+    def cmd_status(self, cmd):
+        return {"status": "paused" if self.paused else "ok"}
+
+    def cmd_stop(self, cmd):
+        return {}
+
+    def cmd_pause(self, cmd):
+        self.paused = True
+        return {}
+
+    def cmd_resume(self, cmd):
+        self.paused = False
+        return {}
+
+    def cmd_list_shares(self, cmd):
+        return {"shares": [{"path": path, "status": status} for path, status in self.shares.items()]}
+
+    def cmd_create_share(self, cmd):
+        self.shares[cmd["path"]] = "N/A"
+        self._changed()
+        return {}
+
+    def cmd_add_share(self, cmd):
+        # there are no other peers, so only codes made here are any good
+        if cmd["code"] not in self.access_codes:
+            raise KeyError("code")
+        self.shares[cmd["path"]] = "N/A"
+        self._changed()
+        return {}
+
+    def cmd_remove_share(self, cmd):
+        del self.shares[cmd["path"]]
+        self._changed()
+        return {}
+
+    def cmd_create_access_code(self, cmd):
+        path, mode = cmd["path"], cmd["mode"]
+        if path not in self.shares:
+            raise KeyError("path")
+        if mode not in ACCESS_MODES:
+            raise KeyError("mode")
+        code = "SYNC" + binascii.hexlify(os.urandom(8)).decode("ascii").upper()
+        self.access_codes[code] = (path, mode)
+        return {"access_code": code}
+
+    ##########################################################################
+    # Serving
+    ##########################################################################
+
+    async def _write(self, writer, data):
+        if self.fragment:
+            for n in range(0, len(data), self.fragment):
+                writer.write(data[n:n + self.fragment])
+                await writer.drain()
+                # give the client a chance to read each piece separately
+                await asyncio.sleep(0)
+        else:
+            writer.write(data)
+            await writer.drain()
+
+    async def _delay(self):
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+
+    def _should_fail(self):
+        if self.failures:
+            self.failures -= 1
+            return True
+        return self.failure_rate and self.random.random() < self.failure_rate
+
+    async def answer(self, writer, lock, cmd, encoding="json"):
+        """
+        Carry out a command and send the reply; returns False if we hung
+        up instead
+        """
+        self.commands += 1
+        reply = self.reply(cmd, encoding)
+        await self._delay()
+        if self._should_fail():
+            log.debug("Dropping connection instead of answering %r", cmd.get("type"))
+            writer.close()
+            return False
+        async with lock:
+            await self._write(writer, reply)
+        return True
+
+    async def _answer_later(self, writer, lock, cmd, encoding):
+        self.tasks.add(asyncio.current_task())
+        try:
+            await self.answer(writer, lock, cmd, encoding)
+        except ConnectionError:
+            pass
+        finally:
+            self.tasks.discard(asyncio.current_task())
+
+    async def handle(self, reader, writer):
+        self.tasks.add(asyncio.current_task())
+        self.writers.add(writer)
+        self.connections += 1
+        self.total_connections += 1
+        self.max_connections = max(self.max_connections, self.connections)
+        # with request ids, commands are answered concurrently (so replies
+        # can overtake each other); this keeps their frames whole
+        lock = asyncio.Lock()
+        tagged = "request_ids" in self.handshake["features"]
+        encoding = "json"
+        try:
+            await self._write(writer, self.encode(self.handshake))
+            while True:
+                if encoding == "json":
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    if not line.strip():
+                        continue
+                else:
+                    size = struct.unpack(">I", await reader.readexactly(4))[0]
+                    line = await reader.readexactly(size)
+                try:
+                    cmd = self.decode(line, encoding)
+                except ValueError:
+                    await self._write(writer, self.encode({"error": "Couldn't decode message"}, encoding))
+                    continue
+                if cmd.get("type") == "set_encoding":
+                    encoding = await self.set_encoding(writer, cmd, encoding)
+                elif tagged and "id" in cmd:
+                    asyncio.ensure_future(self._answer_later(writer, lock, cmd, encoding))
+                elif not await self.answer(writer, lock, cmd, encoding):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            self.writers.discard(writer)
+            self.tasks.discard(asyncio.current_task())
+            writer.close()
+
+    def decode(self, data, encoding):
+        if encoding == "json":
+            return json.loads(data.decode("utf8"))
+        return self.codecs[encoding].loads(data)
+
+    async def set_encoding(self, writer, cmd, encoding):
+        """
+        Agree (in the old encoding) to switch to a new one, and return
+        whichever is now in use
+        """
+        self.commands += 1
+        new = cmd.get("encoding")
+        if new != "json" and (new not in self.handshake["features"] or new not in self.codecs):
+            await self._write(writer, self.encode({"error": "Unsupported encoding %r" % new}, encoding))
+            return encoding
+        await self._write(writer, self.encode({}, encoding))
+        return new
+
+    async def start_server(self):
+        # a big backlog, so that thousands of clients connecting at once
+        # are queued rather than refused
+        self.server = await asyncio.start_unix_server(self.handle, self.control_path, backlog=4096, limit=2 ** 20)
+        return self
+
+    async def close_server(self):
+        self.server.close()
+        # closing the connections from our end makes each handler's next
+        # read see EOF, so they all finish on their own
+        for writer in list(self.writers):
+            writer.close()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.server.wait_closed()
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    async def __aenter__(self):
+        return await self.start_server()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close_server()
+
+    def start(self):
+        """
+        Serve from a background thread
+        """
+        self.loop = asyncio.new_event_loop()
+        started = self.loop.run_until_complete(self.start_server())
+        self.thread = threading.Thread(target=self.loop.run_forever, name="FakeDaemon")
+        self.thread.daemon = True
+        self.thread.start()
+        return started
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.run_until_complete(self.close_server())
+        self.loop.close()
+
+    def call(self, fn, *args):
+        """
+        Run fn(*args) on the server's thread, for changing its state
+        safely while it's running
+        """
+        async def call():
+            return fn(*args)
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,114 @@
+"""
+Run the same command against many daemons at once:
+
+    fleet = ClearSkiesFleet(["/run/cs/host1.sock", "/run/cs/host2.sock"])
+    for r in fleet.status():
+        if r.error:
+            print(r.daemon, "failed:", r.error)
+        else:
+            print(r.daemon, r.result)
+
+Results are yielded as each daemon answers, so one slow daemon doesn't
+hold up reporting on the others.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import logging
+
+from clearskies.client import ClearSkies
+from clearskies.exc import ClientException
+
+log = logging.getLogger(__name__)
+
+
+FleetResult = namedtuple("FleetResult", ["daemon", "result", "error"])
+
+
+class ClearSkiesFleet(object):
+    """
+    `daemons` is a list of control socket paths or of ClearSkies clients;
+    each daemon is connected to when first used, and at most
+    `max_workers` daemons are talked to at the same time. Give a
+    `timeout` to stop a hung daemon from holding on to a worker forever;
+    it applies to each daemon separately, to connecting and to the call.
+    """
+
+    def __init__(self, daemons, max_workers=16, client_factory=ClearSkies):
+        self.clients = {}
+        for daemon in daemons:
+            if isinstance(daemon, ClearSkies):
+                self.clients[daemon.socket.control_path] = daemon
+            else:
+                self.clients[daemon] = client_factory(daemon)
+        self.max_workers = max_workers
+        # a client can only do one thing at a time, so stop two overlapping
+        # fan-outs from using the same one in parallel
+        self.locks = dict((name, threading.Lock()) for name in self.clients)
+
+    def _call(self, name, method, args, kwargs):
+        client = self.clients[name]
+        with self.locks[name]:
+            if not client.connected:
+                client.connect(timeout=kwargs.get("timeout"))
+            return getattr(client, method)(*args, **kwargs)
+
+    def call(self, method, *args, **kwargs):
+        """
+        Call client.method(*args, **kwargs) on every daemon, returning an
+        iterator which yields a FleetResult for each as soon as it
+        finishes. The calls are started straight away, so eg. pause()
+        takes effect whether or not the results are looked at.
+        """
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(self.clients))))
+        futures = dict(
+            (executor.submit(self._call, name, method, args, kwargs), name)
+            for name in self.clients
+        )
+        # the workers go away once they've run out of daemons
+        executor.shutdown(wait=False)
+        return self._results(method, futures)
+
+    def _results(self, method, futures):
+        try:
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    yield FleetResult(name, future.result(), None)
+                except Exception as e:
+                    # anything going wrong with one daemon (including a reply
+                    # we can't make sense of) is that daemon's result
+                    log.debug("%s failed on %s: %r", method, name, e)
+                    yield FleetResult(name, None, e)
+        finally:
+            # if the caller stops early, don't start on daemons we haven't
+            # got to yet
+            for future in futures:
+                future.cancel()
+
+    def call_all(self, method, *args, **kwargs):
+        """
+        Like call(), but wait for every daemon and return a dict of
+        daemon -> FleetResult
+        """
+        return dict((r.daemon, r) for r in self.call(method, *args, **kwargs))
+
+    def status(self, timeout=None):
+        return self.call("status", timeout=timeout)
+
+    def list_shares(self, timeout=None):
+        return self.call("list_shares", timeout=timeout)
+
+    def pause(self, timeout=None):
+        return self.call("pause", timeout=timeout)
+
+    def resume(self, timeout=None):
+        return self.call("resume", timeout=timeout)
+
+    def close(self):
+        for name, client in self.clients.items():
+            if client.connected:
+                try:
+                    client.close()
+                except ClientException as e:
+                    log.debug("Error closing connection to %s: %s", name, e)
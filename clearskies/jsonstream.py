@@ -0,0 +1,70 @@
+"""
+Incremental decoding of large JSON documents, so that big replies can be
+processed as they arrive rather than after they've all been read.
+"""
+import codecs
+import json
+import re
+
+
+_whitespace = re.compile(r"[\s,]*")
+
+
+def iter_json_array(chunks, key):
+    """
+    Given an iterable of byte strings making up a JSON object, yield the
+    items of the array at object[key] one at a time, holding no more than
+    one item's worth of text in memory at once.
+
+    The array is found by looking for the first `"key": [` in the text,
+    which is good enough for the daemon's replies, but isn't a general
+    purpose JSON parser. Any chunks after the end of the array are left
+    unread.
+    """
+    chunks = iter(chunks)
+    text = codecs.getincrementaldecoder("utf8")()
+    decoder = json.JSONDecoder()
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+
+    buf = ""
+    while True:
+        match = start.search(buf)
+        if match:
+            buf = buf[match.end():]
+            break
+        # keep enough of the end that a key split across chunks still matches
+        buf = buf[-(len(key) + 256):]
+        try:
+            buf += text.decode(next(chunks))
+        except StopIteration:
+            raise ValueError("No %r array found" % key)
+
+    pos = 0
+    exhausted = False
+    while True:
+        pos = _whitespace.match(buf, pos).end()
+        if pos < len(buf):
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if exhausted:
+                    raise
+            else:
+                # a number or literal running up to the end of what we have
+                # so far might have more digits to come
+                if end < len(buf) or exhausted or isinstance(item, (dict, list, str)):
+                    yield item
+                    pos = end
+                    continue
+        elif exhausted:
+            raise ValueError("Unterminated %r array" % key)
+
+        buf = buf[pos:]
+        pos = 0
+        try:
+            buf += text.decode(next(chunks))
+        except StopIteration:
+            buf += text.decode(b"", True)
+            exhausted = True
@@ -0,0 +1,142 @@
+"""
+Reading the end of a (potentially huge) log file, and following it as it
+grows, without ever loading more of it than we need.
+"""
+import os
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+def _text(data):
+    return data.decode("utf8", "replace")
+
+
+def _tail_bytes(f, end, lines, block_size):
+    """
+    Read backwards from `end` a block at a time until we have the last
+    `lines` lines (a final line with no newline counts as one).
+    """
+    blocks = []
+    newlines = 0
+    pos = end
+    while pos > 0:
+        step = min(block_size, pos)
+        pos -= step
+        f.seek(pos)
+        block = f.read(step)
+        blocks.append(block)
+        newlines += block.count(b"\n")
+        if pos + step == end and block.endswith(b"\n"):
+            # that one ends the last line rather than starting a new one
+            newlines -= 1
+        if newlines >= lines:
+            break
+    data = b"".join(reversed(blocks))
+
+    body, nl, last = data.rpartition(b"\n") if data.endswith(b"\n") else (data, b"", b"")
+    return b"\n".join(body.split(b"\n")[-lines:]) + nl
+
+
+def tail(path, lines, block_size=65536):
+    """
+    Return the last `lines` lines of the file at `path` as a string;
+    memory use depends on the size of those lines, not of the file.
+    """
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        return _text(_tail_bytes(f, end, lines, block_size))
+
+
+class _Poller(object):
+    def __init__(self, path, interval):
+        self.interval = interval
+
+    def wait(self):
+        time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class _INotifyWaiter(object):
+    """
+    Wake up as soon as anything in the log's directory changes (watching
+    the directory rather than the file means we also see it being rotated
+    and recreated), or after `interval` at the latest.
+    """
+    def __init__(self, path, interval):
+        flags = inotify_simple.flags
+        self.interval = interval
+        self.inotify = inotify_simple.INotify()
+        self.inotify.add_watch(
+            os.path.dirname(os.path.abspath(path)),
+            flags.MODIFY | flags.CREATE | flags.MOVED_TO | flags.DELETE
+        )
+
+    def wait(self):
+        self.inotify.read(timeout=int(self.interval * 1000))
+
+    def close(self):
+        self.inotify.close()
+
+
+def _replaced(f, path):
+    """
+    Whether the file at `path` is no longer the one we have open, or has
+    been truncated.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        # rotated away, but the new one hasn't been created yet
+        return False
+    return st.st_ino != os.fstat(f.fileno()).st_ino or st.st_size < f.tell()
+
+
+def follow(path, lines=0, interval=1.0, block_size=65536):
+    """
+    Like `tail -F`: yield the last `lines` lines of the file, then each
+    new line as it is written, forever (close the generator to stop).
+    Lines are yielded without their newline, and only once complete.
+
+    Uses inotify (via the inotify_simple module) when it's installed, or
+    checks every `interval` seconds when it's not. Log rotation and
+    truncation are noticed, and reading carries on with the new file.
+    """
+    f = open(path, "rb")
+    waiter = None
+    try:
+        waiter = (_INotifyWaiter if inotify_simple else _Poller)(path, interval)
+        end = f.seek(0, os.SEEK_END)
+        partial = b""
+        if lines:
+            complete = _tail_bytes(f, end, lines, block_size).split(b"\n")
+            partial = complete.pop()
+            for line in complete:
+                yield _text(line)
+            f.seek(end)
+
+        while True:
+            data = f.read(block_size)
+            if data:
+                complete = (partial + data).split(b"\n")
+                partial = complete.pop()
+                for line in complete:
+                    yield _text(line)
+            elif _replaced(f, path):
+                if partial:
+                    # the old file's last line is as complete as it'll get
+                    yield _text(partial)
+                    partial = b""
+                f.close()
+                f = open(path, "rb")
+            else:
+                waiter.wait()
+    finally:
+        f.close()
+        if waiter:
+            waiter.close()
@@ -0,0 +1,165 @@
+"""
+Counters and histograms for the client's hot paths.
+
+Nothing is recorded unless a Metrics object is attached to the client:
+
+    metrics = Metrics()
+    cs = ClearSkies(metrics=metrics)
+    ...
+    print(metrics.to_prometheus())
+
+Pass `callback` to also be told about each event as it happens, eg to
+forward it to some other monitoring system; it's called as
+callback(event, fields) with event one of "command", "sent", "received"
+or "reconnect".
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+
+# seconds; covers everything from a fast local round-trip to a stuck daemon
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimate the q'th quantile (0..1) as the upper bound of the bucket
+        it falls in
+        """
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics(object):
+    def __init__(self, callback=None, buckets=DEFAULT_BUCKETS):
+        self.callback = callback
+        self.buckets = buckets
+        self.lock = threading.Lock()
+
+        self.latency = {}  # command type -> Histogram
+        self.errors = {}  # command type -> count
+        self.decode_time = Histogram(buckets)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.writes = 0
+        self.messages_received = 0
+        self.reconnects = 0
+        self.in_flight = 0
+
+    def command_started(self, cmd_type):
+        with self.lock:
+            self.in_flight += 1
+
+    def command_finished(self, cmd_type, seconds, error=None):
+        with self.lock:
+            self.in_flight -= 1
+            histogram = self.latency.get(cmd_type)
+            if histogram is None:
+                histogram = self.latency[cmd_type] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            if error is not None:
+                self.errors[cmd_type] = self.errors.get(cmd_type, 0) + 1
+        if self.callback:
+            self.callback("command", {"type": cmd_type, "seconds": seconds, "error": error})
+
+    @contextmanager
+    def command(self, cmd_type):
+        """
+        Time the body of a with-block as one command
+        """
+        self.command_started(cmd_type)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.command_finished(cmd_type, time.perf_counter() - start, error)
+
+    def sent(self, nbytes):
+        with self.lock:
+            self.bytes_sent += nbytes
+            self.writes += 1
+        if self.callback:
+            self.callback("sent", {"bytes": nbytes})
+
+    def received(self, nbytes, decode_seconds):
+        with self.lock:
+            self.bytes_received += nbytes
+            self.messages_received += 1
+            self.decode_time.observe(decode_seconds)
+        if self.callback:
+            self.callback("received", {"bytes": nbytes, "decode_seconds": decode_seconds})
+
+    def reconnected(self):
+        with self.lock:
+            self.reconnects += 1
+        if self.callback:
+            self.callback("reconnect", {})
+
+    def to_prometheus(self, prefix="clearskies_client"):
+        """
+        Render everything in the Prometheus text exposition format
+        """
+        lines = []
+
+        def histogram(name, help, histograms):
+            lines.append("# HELP %s_%s %s" % (prefix, name, help))
+            lines.append("# TYPE %s_%s histogram" % (prefix, name))
+            for labels, h in histograms:
+                sep = "," if labels else ""
+                seen = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    seen += n
+                    lines.append('%s_%s_bucket{%s%sle="%s"} %d' % (prefix, name, labels, sep, bound, seen))
+                lines.append('%s_%s_bucket{%s%sle="+Inf"} %d' % (prefix, name, labels, sep, h.count))
+                braces = "{%s}" % labels if labels else ""
+                lines.append("%s_%s_sum%s %r" % (prefix, name, braces, h.sum))
+                lines.append("%s_%s_count%s %d" % (prefix, name, braces, h.count))
+
+        def scalar(name, type, help, value):
+            lines.append("# HELP %s_%s %s" % (prefix, name, help))
+            lines.append("# TYPE %s_%s %s" % (prefix, name, type))
+            lines.append("%s_%s %s" % (prefix, name, value))
+
+        with self.lock:
+            histogram(
+                "command_seconds", "Time from sending a command to decoding its reply",
+                [('command="%s"' % t, h) for t, h in sorted(self.latency.items())]
+            )
+            lines.append("# HELP %s_command_errors_total Commands which failed" % prefix)
+            lines.append("# TYPE %s_command_errors_total counter" % prefix)
+            for t, n in sorted(self.errors.items()):
+                lines.append('%s_command_errors_total{command="%s"} %d' % (prefix, t, n))
+            histogram("decode_seconds", "Time spent decoding replies", [("", self.decode_time)])
+            scalar("sent_bytes_total", "counter", "Bytes written to the control socket", self.bytes_sent)
+            scalar("received_bytes_total", "counter", "Bytes read from the control socket", self.bytes_received)
+            scalar("writes_total", "counter", "Writes to the control socket (each may hold several messages)", self.writes)
+            scalar("received_messages_total", "counter", "Messages read from the control socket", self.messages_received)
+            scalar("reconnects_total", "counter", "Times the connection to the daemon was re-established", self.reconnects)
+            scalar("in_flight", "gauge", "Commands waiting for a reply", self.in_flight)
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,231 @@
+"""
+One connection shared by many threads, each with commands in flight at
+the same time:
+
+    cs = MultiplexedClearSkies()
+    with ThreadPoolExecutor(32) as pool:
+        statuses = list(pool.map(lambda n: cs.status(), range(1000)))
+
+A background thread reads every frame and hands each reply to whichever
+call is waiting for it. If the daemon lists "request_ids" in its
+handshake, each command is tagged with an "id" which the daemon copies
+into its reply, so replies may come back in any order, and frames with
+no id (eg. events) are put on `events` rather than being mistaken for a
+reply. With older daemons replies are matched up in the order the
+commands were sent, which still lets callers share the connection but
+relies on the daemon answering in order.
+"""
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+import itertools
+import queue
+import threading
+import time
+import logging
+
+from clearskies.client import Commands, make_transport, default_control_path, check_handshake, deadline_after
+from clearskies.exc import ProtocolException, TransportException, TimeoutException
+
+log = logging.getLogger(__name__)
+
+
+class MultiplexedClearSkies(Commands):
+    """
+    `timeout` is the default for calls which don't give their own, and
+    covers waiting for a turn to send, (re)connecting, sending and waiting
+    for the reply. A call which times out while its command is only partly
+    sent drops the connection, failing everything else in flight on it.
+    """
+
+    def __init__(self, control_path=None, codec=None, metrics=None, timeout=None):
+        self.connected = False
+        self.handshake = None
+        self.socket = make_transport(control_path or default_control_path(), codec)
+        self.socket.metrics = metrics
+        self.metrics = metrics
+        self.timeout = timeout
+        self.events = queue.Queue()
+
+        # held while connecting or sending; separate from the lock on the
+        # routing state, so that the reader can keep handing out replies
+        # while a writer is blocked on a full socket
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.waiting = {}  # request id -> Future
+        self.in_order = deque()  # Futures, when the daemon can't do ids
+        self.tagged = False
+        self.reader = None
+
+    def supports(self, feature):
+        return feature in (self.handshake or {}).get("features", ())
+
+    def _deadline(self, timeout):
+        return deadline_after(self.timeout if timeout is None else timeout)
+
+    def _acquire_send_lock(self, deadline):
+        if deadline is None:
+            self.send_lock.acquire()
+        elif not self.send_lock.acquire(timeout=max(0, deadline - time.monotonic())):
+            raise TimeoutException("Timed out waiting for a turn on the connection")
+
+    def connect(self, timeout=None):
+        deadline = self._deadline(timeout)
+        self._acquire_send_lock(deadline)
+        try:
+            if not self.connected:
+                self._connect(deadline)
+        finally:
+            self.send_lock.release()
+
+    def _connect(self, deadline):
+        # called with self.send_lock held
+        if self.reader:
+            # the last connection dropped, and its reader has finished with
+            # it (or is just about to); tidy up after it
+            self.reader.join()
+            self.reader = None
+            self.socket.close()
+        try:
+            self.socket.connect(deadline)
+            handshake = self.socket.recv(deadline)
+            check_handshake(handshake)
+        except ValueError as e:
+            self.socket.close()
+            raise ProtocolException("Error in CS handshake: %s" % e)
+        except TimeoutException:
+            self.socket.close()
+            raise
+        self.handshake = handshake
+        self.tagged = self.supports("request_ids")
+        with self.lock:
+            self.connected = True
+        self.reader = threading.Thread(target=self._read, args=(self.socket, ), name="clearskies-mux")
+        self.reader.daemon = True
+        self.reader.start()
+
+    def close(self):
+        if self.reader:
+            # wake the reader, and any writer blocked on a full socket, so
+            # that they let go of the connection
+            self.socket.interrupt()
+        with self.send_lock:
+            with self.lock:
+                self.connected = False
+            reader, self.reader = self.reader, None
+            if reader and reader is not threading.current_thread():
+                reader.join()
+            self.socket.close()
+
+    def _read(self, transport):
+        try:
+            while True:
+                self._route(transport.recv())
+        except TransportException as e:
+            self._fail(e)
+        except Exception as e:  # pragma: no cover
+            log.exception("Error routing replies")
+            self._fail(TransportException("Error routing replies: %s" % e))
+
+    def _route(self, reply):
+        if self.tagged:
+            request_id = reply.pop("id", None)
+            if request_id is None:
+                self.events.put(reply)
+                return
+            with self.lock:
+                future = self.waiting.pop(request_id, None)
+            if future is None:
+                # the caller gave up waiting for this one
+                log.debug("Dropping reply to abandoned request %r", request_id)
+                return
+        else:
+            with self.lock:
+                if not self.in_order:
+                    log.warning("Dropping unexpected frame %r", reply)
+                    return
+                future = self.in_order.popleft()
+        if not future.done():
+            future.set_result(reply)
+
+    def _fail(self, e):
+        """
+        The connection has gone; let down everyone waiting on it
+        """
+        with self.lock:
+            self.connected = False
+            futures = list(self.waiting.values()) + list(self.in_order)
+            self.waiting.clear()
+            self.in_order.clear()
+        for future in futures:
+            if not future.done():
+                future.set_exception(e)
+
+    def _forget(self, request_id, future):
+        with self.lock:
+            if request_id is not None:
+                self.waiting.pop(request_id, None)
+            elif future in self.in_order:
+                self.in_order.remove(future)
+
+    def _send(self, cmd, deadline):
+        future = Future()
+        self._acquire_send_lock(deadline)
+        try:
+            if not self.connected:
+                self._connect(deadline)
+            request_id = None
+            with self.lock:
+                if self.tagged:
+                    request_id = next(self.ids)
+                    cmd = dict(cmd, id=request_id)
+                    self.waiting[request_id] = future
+                else:
+                    # commands are queued in the order they're sent, which
+                    # the send lock keeps the same as the order of writes
+                    self.in_order.append(future)
+            try:
+                self.socket.send(cmd, deadline)
+            except TimeoutException:
+                # part of the command may have gone, leaving the stream in
+                # a state the daemon can't make sense of
+                self._forget(request_id, future)
+                self.socket.interrupt()
+                raise
+            except BaseException:
+                # eg. the connection has gone, or the command couldn't be
+                # encoded; either way no reply is coming for it
+                self._forget(request_id, future)
+                raise
+        finally:
+            self.send_lock.release()
+        return request_id, future
+
+    def _cmd(self, cmd, result=None, timeout=None):
+        deadline = self._deadline(timeout)
+        metrics = self.metrics
+        if metrics is None:
+            reply = self._send_recv(cmd, deadline)
+        else:
+            with metrics.command(cmd["type"]):
+                reply = self._send_recv(cmd, deadline)
+        return result(reply) if result else reply
+
+    def _send_recv(self, cmd, deadline):
+        request_id, future = self._send(cmd, deadline)
+        try:
+            return future.result(None if deadline is None else max(0, deadline - time.monotonic()))
+        except TimeoutError:
+            if request_id is not None:
+                # the reply can still arrive, and will be dropped; in order
+                # mode it has to stay queued, to keep the others lined up
+                with self.lock:
+                    self.waiting.pop(request_id, None)
+            raise TimeoutException("Timed out waiting for the daemon")
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,179 @@
+"""
+A pool of connected, handshaken transports which can be shared between
+threads; each command borrows a connection for as long as it takes to
+send the command and read the reply.
+
+    pool = ClearSkiesPool(max_size=4)
+    pool.status()  # safe to call from any thread
+"""
+from contextlib import contextmanager
+import threading
+import time
+import logging
+
+from clearskies.client import (Commands, Pipeline, make_transport, default_control_path, check_handshake,
+                               is_replay_safe, deadline_after)
+from clearskies.exc import ProtocolException, TransportException, TimeoutException
+
+log = logging.getLogger(__name__)
+
+
+class ClearSkiesPool(Commands):
+    def __init__(self, control_path=None, max_size=8, idle_timeout=60.0, transport_factory=make_transport,
+                 metrics=None, timeout=None):
+        self.control_path = control_path or default_control_path()
+        self.metrics = metrics
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.transport_factory = transport_factory
+        self.timeout = timeout
+
+        self.cond = threading.Condition()
+        self.idle = []  # [(transport, time it was released)], most recent last
+        self.size = 0  # open transports, idle or borrowed
+
+    def _open(self, deadline=None):
+        transport = self.transport_factory(self.control_path)
+        transport.metrics = self.metrics
+        try:
+            transport.connect(deadline)
+            check_handshake(transport.recv(deadline))
+        except ValueError as e:
+            self._close(transport)
+            raise ProtocolException("Error in CS handshake: %s" % e)
+        except TimeoutException:
+            self._close(transport)
+            raise
+        return transport
+
+    def _close(self, transport):
+        try:
+            transport.close()
+        except TransportException as e:
+            log.debug("Error closing pooled connection: %s", e)
+
+    def _evict(self, now):
+        # called with self.cond held; idle is in release order, so anything
+        # which has been idle too long is at the front
+        while self.idle and now - self.idle[0][1] > self.idle_timeout:
+            transport, released = self.idle.pop(0)
+            self.size -= 1
+            self._close(transport)
+
+    def acquire(self, timeout=None):
+        """
+        Borrow a connection, opening a new one if none are idle and the
+        pool isn't full; returns (transport, reused).
+        """
+        return self._acquire(deadline_after(timeout))
+
+    def _acquire(self, deadline):
+        with self.cond:
+            while True:
+                self._evict(time.time())
+                while self.idle:
+                    transport, released = self.idle.pop()
+                    if transport.alive():
+                        return transport, True
+                    self.size -= 1
+                    self._close(transport)
+                if self.size < self.max_size:
+                    self.size += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutException("Timed out waiting for a free connection")
+                self.cond.wait(remaining)
+
+        try:
+            return self._open(deadline), False
+        except Exception:
+            with self.cond:
+                self.size -= 1
+                self.cond.notify()
+            raise
+
+    def release(self, transport, broken=False):
+        """
+        Return a borrowed connection; broken ones are closed rather than
+        being handed out again.
+        """
+        with self.cond:
+            if broken:
+                self.size -= 1
+                self._close(transport)
+            else:
+                self.idle.append((transport, time.time()))
+            self._evict(time.time())
+            self.cond.notify()
+
+    def connection(self, timeout=None):
+        """
+        Borrow a connection for the length of a with-block
+        """
+        return self._connection(deadline_after(timeout))
+
+    @contextmanager
+    def _connection(self, deadline):
+        transport, reused = self._acquire(deadline)
+        # if anything goes wrong while it's borrowed we don't know whether a
+        # reply is still on its way, so don't reuse it
+        broken = True
+        try:
+            yield transport
+            broken = False
+        finally:
+            self.release(transport, broken)
+
+    def close(self):
+        """
+        Close every idle connection; borrowed ones are closed when they're
+        released.
+        """
+        with self.cond:
+            while self.idle:
+                transport, released = self.idle.pop()
+                self.size -= 1
+                self._close(transport)
+
+    def _cmd(self, cmd, result=None, timeout=None):
+        deadline = deadline_after(self.timeout if timeout is None else timeout)
+        metrics = self.metrics
+        if metrics is None:
+            reply = self._send_recv(cmd, deadline)
+        else:
+            with metrics.command(cmd["type"]):
+                reply = self._send_recv(cmd, deadline)
+        return result(reply) if result else reply
+
+    def _send_recv(self, cmd, deadline=None):
+        while True:
+            transport, reused = self._acquire(deadline)
+            # as in _connection(), anything short of a reply means the
+            # connection can't be trusted again
+            broken = True
+            try:
+                transport.send(cmd, deadline)
+                reply = transport.recv(deadline)
+                broken = False
+                return reply
+            except TransportException as e:
+                if reused and is_replay_safe(cmd) and not isinstance(e, TimeoutException):
+                    # most likely the daemon closed this connection while it
+                    # was sitting in the pool; try again on a fresh one
+                    log.debug("Pooled connection failed (%s), reconnecting", e)
+                    if self.metrics is not None:
+                        self.metrics.reconnected()
+                    continue
+                raise
+            finally:
+                self.release(transport, broken)
+
+    def _pipeline(self, cmds, deadline=None):
+        with self._connection(deadline) as transport:
+            transport.send_many(cmds, deadline)
+            for _ in cmds:
+                yield transport.recv(deadline)
+
+    def pipeline(self):
+        return Pipeline(self)
@@ -0,0 +1,89 @@
+"""
+Check shares against what's actually on disk:
+
+    for result in cs.scan_shares():
+        if not result.exists:
+            print("Missing:", result.path, result.status)
+
+Walking big directory trees is slow, so the work is spread over a pool of
+processes (one per core by default), and results are yielded as each
+share finishes rather than in order.
+"""
+from collections import namedtuple
+import os
+import stat
+
+
+# `status` is what the daemon said about the share; the rest is what we
+# found on disk. `error` is the first problem reading the share, if any
+# (the counts then cover whatever could be read).
+ScanResult = namedtuple("ScanResult", ["path", "status", "exists", "files", "dirs", "size", "error"])
+
+
+def scan_path(path):
+    """
+    Count the files, directories and bytes under `path`, without following
+    symlinks. Returns a ScanResult with no status.
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return ScanResult(path, None, False, 0, 0, 0, None)
+    except OSError as e:
+        return ScanResult(path, None, False, 0, 0, 0, str(e))
+    if not stat.S_ISDIR(st.st_mode):
+        return ScanResult(path, None, True, 1, 0, st.st_size, None)
+
+    files = dirs = size = 0
+    error = None
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs += 1
+                            stack.append(entry.path)
+                        else:
+                            files += 1
+                            size += entry.stat(follow_symlinks=False).st_size
+                    except OSError as e:
+                        error = error or str(e)
+        except OSError as e:
+            error = error or str(e)
+    return ScanResult(path, None, True, files, dirs, size, error)
+
+
+def scan_paths(paths):
+    # shares are sent to the workers in batches, since most are small and
+    # handing them over one at a time would cost more than scanning them
+    return [scan_path(path) for path in paths]
+
+
+def scan_shares(shares, workers=None, chunksize=16, executor=None):
+    """
+    Scan each of `shares` (Shares, or dicts as the daemon sends them),
+    yielding a ScanResult for each as soon as it's done.
+
+    `executor` is a concurrent.futures executor to use instead of
+    starting a pool of `workers` processes for the duration of the scan.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    shares = list(shares)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(workers)
+    try:
+        batches = {}
+        for n in range(0, len(shares), chunksize):
+            batch = shares[n:n + chunksize]
+            future = executor.submit(scan_paths, [share["path"] for share in batch])
+            batches[future] = batch
+        for future in as_completed(batches):
+            for share, result in zip(batches[future], future.result()):
+                yield result._replace(status=share["status"])
+    finally:
+        if own_executor:
+            # if we were stopped early, don't wait for the rest
+            executor.shutdown(cancel_futures=True)
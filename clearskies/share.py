@@ -0,0 +1,256 @@
+"""
+Objects for the shares that list_shares() reports.
+"""
+from array import array
+from collections import namedtuple
+
+
+class Share(object):
+    """
+    One share, as reported by the daemon. Any fields beyond path and
+    status are kept in `extra` (None if there weren't any).
+
+    Also supports share["path"] etc, for code written against the plain
+    dicts list_shares() used to return.
+    """
+    __slots__ = ("path", "status", "extra")
+
+    def __init__(self, path, status, extra=None):
+        self.path = path
+        self.status = status
+        self.extra = extra
+
+    @classmethod
+    def from_json(cls, js):
+        if len(js) == 2:
+            # the common case; skip the copy-and-pop below
+            return cls(js["path"], js["status"])
+        extra = dict(js)
+        return cls(extra.pop("path"), extra.pop("status"), extra or None)
+
+    def to_json(self):
+        js = dict(self.extra) if self.extra else {}
+        js["path"] = self.path
+        js["status"] = self.status
+        return js
+
+    def __getitem__(self, key):
+        if key == "path":
+            return self.path
+        if key == "status":
+            return self.status
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __eq__(self, other):
+        if not isinstance(other, Share):
+            return NotImplemented
+        return (self.path, self.status, self.extra) == (other.path, other.status, other.extra)
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        return hash((self.path, self.status))
+
+    def __repr__(self):
+        return "Share(%r, %r)" % (self.path, self.status)
+
+
+class ShareTable(object):
+    """
+    A column-oriented, read-only list of shares for very large listings.
+
+    All the paths are stored in one string with an array of offsets into
+    it, and statuses as small integer codes into a table of the distinct
+    statuses seen, so each share costs a dozen or so bytes plus the length
+    of its path rather than a whole object. Only path and status are kept.
+    """
+
+    def __init__(self, shares=()):
+        self.status_names = []
+        codes = {}
+        self.statuses = array("H")
+        self.offsets = array("L", [0])
+
+        paths = []
+        end = 0
+        for share in shares:
+            if isinstance(share, Share):
+                path, status = share.path, share.status
+            else:
+                path, status = share["path"], share["status"]
+
+            code = codes.get(status)
+            if code is None:
+                code = codes[status] = len(self.status_names)
+                self.status_names.append(status)
+            self.statuses.append(code)
+
+            paths.append(path)
+            end += len(path)
+            self.offsets.append(end)
+        self.paths_blob = "".join(paths)
+
+    def __len__(self):
+        return len(self.statuses)
+
+    def path(self, n):
+        return self.paths_blob[self.offsets[n]:self.offsets[n + 1]]
+
+    def status(self, n):
+        return self.status_names[self.statuses[n]]
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError("share index out of range")
+        return Share(self.path(n), self.status(n))
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield Share(self.path(n), self.status(n))
+
+    def paths(self):
+        for n in range(len(self)):
+            yield self.path(n)
+
+    def with_status(self, status):
+        try:
+            code = self.status_names.index(status)
+        except ValueError:
+            return
+        for n, c in enumerate(self.statuses):
+            if c == code:
+                yield Share(self.path(n), status)
+
+    def count_by_status(self):
+        counts = [0] * len(self.status_names)
+        for code in self.statuses:
+            counts[code] += 1
+        return dict(zip(self.status_names, counts))
+
+
+# added and removed are lists of Shares; changed is a list of
+# (old Share, new Share) pairs
+ShareDelta = namedtuple("ShareDelta", ["added", "removed", "changed"])
+
+
+class ShareIndex(object):
+    """
+    The latest known state of every share, indexed by path and by status.
+
+    Feed it each new listing with apply() to find out what changed:
+
+        index = ShareIndex()
+        while True:
+            delta = index.apply(cs.list_shares())
+            for share in delta.added:
+                ...
+
+    Unchanged shares are left alone, and the scan for removed shares is
+    skipped when the counts show there can't be any, so a quiet listing
+    costs one dict lookup and comparison per share.
+    """
+
+    def __init__(self, shares=()):
+        self.by_path = {}
+        self.by_status = {}  # status -> set of paths
+        self.apply(shares)
+
+    def _add(self, share):
+        self.by_path[share.path] = share
+        paths = self.by_status.get(share.status)
+        if paths is None:
+            paths = self.by_status[share.status] = set()
+        paths.add(share.path)
+
+    def _remove(self, share):
+        del self.by_path[share.path]
+        paths = self.by_status[share.status]
+        paths.discard(share.path)
+        if not paths:
+            del self.by_status[share.status]
+
+    def apply(self, shares):
+        """
+        Replace the index's contents with a full listing (of Shares, or of
+        dicts as the daemon sends them), returning a ShareDelta
+        """
+        if not isinstance(shares, (list, tuple, ShareTable)):
+            shares = list(shares)
+
+        by_path = self.by_path
+        added = []
+        changed = []
+        seen = 0
+
+        for share in shares:
+            if not isinstance(share, Share):
+                share = Share.from_json(share)
+            path = share.path
+            old = by_path.get(path)
+            if old is None:
+                added.append(share)
+            else:
+                seen += 1
+                if old.status != share.status:
+                    changed.append((old, share))
+
+        removed = []
+        if seen < len(by_path):
+            listed = set(share["path"] for share in shares)
+            removed = [share for path, share in by_path.items() if path not in listed]
+
+        for share in removed:
+            self._remove(share)
+        for old, new in changed:
+            self._remove(old)
+            self._add(new)
+        for share in added:
+            self._add(share)
+
+        return ShareDelta(added, removed, changed)
+
+    def update(self, share):
+        """
+        Add or replace one share, returning the previous version (or None)
+        """
+        old = self.by_path.get(share.path)
+        if old is not None:
+            self._remove(old)
+        self._add(share)
+        return old
+
+    def discard(self, path):
+        """
+        Remove one share, returning it (or None if it wasn't there)
+        """
+        old = self.by_path.get(path)
+        if old is not None:
+            self._remove(old)
+        return old
+
+    def get(self, path, default=None):
+        return self.by_path.get(path, default)
+
+    def with_status(self, status):
+        """
+        The paths of every share with the given status
+        """
+        return frozenset(self.by_status.get(status, ()))
+
+    def count_by_status(self):
+        return dict((status, len(paths)) for status, paths in self.by_status.items())
+
+    def __contains__(self, path):
+        return path in self.by_path
+
+    def __len__(self):
+        return len(self.by_path)
+
+    def __iter__(self):
+        return iter(self.by_path.values())
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from clearskies.aio import AsyncClearSkies, AsyncUnixJsonTransport
+from clearskies.exc import ProtocolException, TransportException, TimeoutException
+from clearskies.fakedaemon import FakeDaemon
+from clearskies.share import Share
+
+
+HANDSHAKE = {"protocol": 1, "service": "ClearSkies Control", "software": "test"}
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class AsyncTestCase(unittest.TestCase):
+    """
+    Start a unix socket server which greets each client with `handshake`
+    and answers the n'th line it receives with replies[n]
+    """
+    handshake = HANDSHAKE
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "control")
+        self.received = []
+        self.replies = []
+        self.handlers = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    async def handle(self, reader, writer):
+        self.handlers.append(asyncio.current_task())
+        writer.write((json.dumps(self.handshake) + "\n").encode("utf8"))
+        while True:
+            line = await reader.readline()
+            if not line or not self.replies:
+                break
+            self.received.append(json.loads(line.decode("utf8")))
+            writer.write(self.replies.pop(0))
+        writer.close()
+        await writer.wait_closed()
+
+    def run_with_server(self, test):
+        async def wrapper():
+            server = await asyncio.start_unix_server(self.handle, self.path)
+            try:
+                return await test()
+            finally:
+                server.close()
+                await server.wait_closed()
+                # let the server side of each connection see the client hang up
+                await asyncio.wait_for(asyncio.gather(*self.handlers), 5)
+        return run(wrapper())
+
+
+class TestAsyncUnixJsonTransport(AsyncTestCase):
+    def test_connect__error(self):
+        s = AsyncUnixJsonTransport(self.path)
+        self.assertRaises(TransportException, run, s.connect())
+
+    def test_recv__large(self):
+        shares = [{"path": "/home/foo/Shared%d" % n, "status": "N/A"} for n in range(100000)]
+        self.replies = [(json.dumps({"shares": shares}) + "\n").encode("utf8")]
+
+        async def test():
+            s = AsyncUnixJsonTransport(self.path)
+            await s.connect()
+            self.assertEqual(await s.recv(), HANDSHAKE)
+            await s.send({"type": "list_shares"})
+            self.assertEqual(await s.recv(), {"shares": shares})
+            await s.close()
+        self.run_with_server(test)
+
+    def test_recv__not_json(self):
+        self.replies = [b"somethingblah\n"]
+
+        async def test():
+            s = AsyncUnixJsonTransport(self.path)
+            await s.connect()
+            await s.recv()
+            await s.send({"type": "status"})
+            with self.assertRaises(TransportException):
+                await s.recv()
+            await s.close()
+        self.run_with_server(test)
+
+    def test_send_many__unencodable(self):
+        self.replies = [b'{"status": "ok"}\n']
+
+        async def test():
+            s = AsyncUnixJsonTransport(self.path)
+            await s.connect()
+            await s.recv()
+            with self.assertRaises(TypeError):
+                await s.send_many([{"type": "pause"}, {"type": "create_share", "path": object()}])
+            await s.send({"type": "status"})
+            self.assertEqual(await s.recv(), {"status": "ok"})
+            self.assertEqual(self.received, [{"type": "status"}])
+            await s.close()
+        self.run_with_server(test)
+
+
+class TestAsyncClearSkies(AsyncTestCase):
+    def test_commands(self):
+        self.replies = [
+            b'{"status": "ok"}\n',
+            b'{"shares": [{"path": "/home/foo/Shared", "status": "N/A"}]}\n',
+            b'{"access_code": "SYNC123ABC"}\n',
+        ]
+
+        async def test():
+            async with AsyncClearSkies(self.path) as cs:
+                self.assertTrue(cs.connected)
+                self.assertEqual(await cs.status(), {"status": "ok"})
+                self.assertEqual(await cs.list_shares(), [Share("/home/foo/Shared", "N/A")])
+                self.assertEqual(await cs.create_access_code("/home/foo/Shared", "read_only"), "SYNC123ABC")
+        self.run_with_server(test)
+
+        self.assertEqual(self.received, [
+            {"type": "status"},
+            {"type": "list_shares"},
+            {"type": "create_access_code", "path": "/home/foo/Shared", "mode": "read_only"},
+        ])
+
+    def test_concurrent(self):
+        self.replies = [('{"n": %d}\n' % n).encode("utf8") for n in range(50)]
+
+        async def test():
+            async with AsyncClearSkies(self.path) as cs:
+                return await asyncio.gather(*[cs.status() for n in range(50)])
+        self.assertEqual(self.run_with_server(test), [{"n": n} for n in range(50)])
+
+    def test_connect__bad_protocol(self):
+        self.handshake = {"protocol": 2, "service": "ClearSkies Control", "software": "test"}
+
+        async def test():
+            with self.assertRaises(ProtocolException):
+                await AsyncClearSkies(self.path).connect()
+        self.run_with_server(test)
+
+    def test_cmd__error(self):
+        async def test():
+            cs = AsyncClearSkies(self.path)
+            await cs.connect()
+            with self.assertRaises(TransportException):
+                await cs.stop()
+            self.assertFalse(cs.connected)
+        self.run_with_server(test)
+
+    def test_cmd__timeout(self):
+        async def handle(reader, writer):
+            # greet, then never reply
+            self.handlers.append(asyncio.current_task())
+            writer.write((json.dumps(self.handshake) + "\n").encode("utf8"))
+            await reader.read()
+            writer.close()
+            await writer.wait_closed()
+        self.handle = handle
+
+        async def test():
+            cs = AsyncClearSkies(self.path, timeout=0.05)
+            await cs.connect()
+            with self.assertRaises(TimeoutException):
+                await cs.status()
+            self.assertFalse(cs.connected)
+        self.run_with_server(test)
+
+    def test_cmd__timeout_reconnects(self):
+        latencies = [0.5]
+
+        async def test():
+            async with FakeDaemon(latency=lambda: latencies.pop(0) if latencies else 0) as daemon:
+                cs = AsyncClearSkies(daemon.control_path)
+                await cs.connect()
+                with self.assertRaises(TimeoutException):
+                    await cs.status(timeout=0.05)
+                # the next call carries on, on a new connection
+                self.assertEqual(await cs.status(), {"status": "ok"})
+                self.assertEqual(daemon.total_connections, 2)
+                await cs.close()
+        run(test())
+
+    def test_cmd__connects(self):
+        async def test():
+            async with FakeDaemon() as daemon:
+                cs = AsyncClearSkies(daemon.control_path)
+                self.assertEqual(await cs.status(), {"status": "ok"})
+                await cs.close()
+        run(test())
+
+    def test_cmd__made_outside_loop(self):
+        # as in the module docstring: made first, then used by a new loop
+        with FakeDaemon(latency=0.01) as daemon:
+            cs = AsyncClearSkies(daemon.control_path)
+
+            async def test():
+                replies = await asyncio.gather(*[cs.status() for n in range(3)])
+                await cs.close()
+                return replies
+            self.assertEqual(run(test()), [{"status": "ok"}] * 3)
@@ -0,0 +1,64 @@
+import unittest
+
+from clearskies.cache import ResponseCache, MISS
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = ResponseCache({"status": 1.0, "list_shares": 5.0}, max_size=2, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        self.assertIs(self.cache.get({"type": "status"}), MISS)
+        self.cache.put({"type": "status"}, {"status": "ok"})
+        self.assertEqual(self.cache.get({"type": "status"}), {"status": "ok"})
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+    def test_uncacheable(self):
+        self.cache.put({"type": "create_share", "path": "/foo"}, {})
+        self.assertIs(self.cache.get({"type": "create_share", "path": "/foo"}), MISS)
+        self.assertEqual(self.cache.stats(), {"hits": 0, "misses": 0, "size": 0})
+
+    def test_ttl(self):
+        self.cache.put({"type": "status"}, {"status": "ok"})
+        self.cache.put({"type": "list_shares"}, {"shares": []})
+        self.clock.now += 2
+        self.assertIs(self.cache.get({"type": "status"}), MISS)
+        self.assertEqual(self.cache.get({"type": "list_shares"}), {"shares": []})
+        self.assertEqual(self.cache.stats()["size"], 1)
+
+    def test_max_size(self):
+        self.cache.ttls["other"] = 1.0
+        self.cache.put({"type": "status"}, 1)
+        self.cache.put({"type": "list_shares"}, 2)
+        self.cache.get({"type": "status"})
+        self.cache.put({"type": "other"}, 3)
+        self.assertEqual(self.cache.get({"type": "status"}), 1)
+        self.assertIs(self.cache.get({"type": "list_shares"}), MISS)
+
+    def test_invalidate(self):
+        self.cache.ttls["other"] = 1.0
+        self.cache.max_size = 10
+        self.cache.put({"type": "status"}, 1)
+        self.cache.put({"type": "other"}, 2)
+
+        self.cache.invalidate({"type": "create_access_code", "path": "/foo", "mode": "read_only"})
+        self.assertEqual(self.cache.stats()["size"], 2)
+
+        self.cache.invalidate({"type": "status"})
+        self.assertEqual(self.cache.stats()["size"], 2)
+
+        self.cache.invalidate({"type": "pause"})
+        self.assertIs(self.cache.get({"type": "status"}), MISS)
+        self.assertEqual(self.cache.get({"type": "other"}), 2)
+
+        self.cache.invalidate({"type": "stop"})
+        self.assertEqual(self.cache.stats()["size"], 0)
@@ -1,33 +1,47 @@
 from mock import patch, Mock
 import unittest
+import tempfile
+import shutil
 import sys
+import os
 
-from clearskies.client import ClearSkies, ProtocolException
-from clearskies.exc import TransportException
+from clearskies.client import ClearSkies, BulkResult, ProtocolException
+from clearskies.exc import TransportException, TimeoutException, CommandException
+from clearskies.cache import ResponseCache
+from clearskies.metrics import Metrics
+from clearskies.share import Share
 
 
 _open = "__builtin__.open" if sys.version_info[0] == 2 else "builtins.open"
 
 
-# This one test needs a controllable mock of platform.platform()
+# This one test needs a controllable mock of _is_windows()
 # Every other test can use a constant of Linux to force UJS
 class TestClearSkies_Init(unittest.TestCase):
     @patch("clearskies.client.UnixJsonTransport")
     @patch("clearskies.client.WindowsJsonTransport")
-    @patch("platform.platform")
-    def test_init(self, platform, WJS, UJS):
-        platform.return_value = "Windows"
+    @patch("clearskies.client._is_windows")
+    def test_init(self, is_windows, WJS, UJS):
+        is_windows.return_value = True
         c = ClearSkies()
         self.assertEqual(c.socket, WJS())
 
-        platform.return_value = "Linux"
+        is_windows.return_value = False
         c = ClearSkies()
         self.assertEqual(c.socket, UJS())
 
 
-@patch("platform.platform", Mock(return_value="Linux"))
+@patch("clearskies.client._is_windows", Mock(return_value=False))
 @patch("clearskies.client.UnixJsonTransport")
 class TestClearSkies(unittest.TestCase):
+    def setUp(self):
+        # keep the config file out of the real data dir
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        patcher = patch("clearskies.client.xdgBaseDirectory.save_data_path", Mock(return_value=self.data_dir))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_connect(self, UJS):
         UJS().recv.side_effect = [
             {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
@@ -36,6 +50,17 @@ class TestClearSkies(unittest.TestCase):
         c = ClearSkies()
         c.connect()
 
+    def test_supports(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test", "features": ["events"]},
+        ]
+
+        c = ClearSkies()
+        self.assertFalse(c.supports("events"))
+        c.connect()
+        self.assertTrue(c.supports("events"))
+        self.assertFalse(c.supports("something_else"))
+
     def test_connect__not_json(self, UJS):
         UJS().recv.side_effect = [
             ValueError("Could not decode JSON"),
@@ -64,7 +89,7 @@ class TestClearSkies(unittest.TestCase):
 
         UJS().send.assert_called_with({
             "type": "stop",
-        })
+        }, None)
 
     def test_stop__error(self, UJS):
         UJS().recv.side_effect = [
@@ -76,6 +101,153 @@ class TestClearSkies(unittest.TestCase):
         c.connect()
         self.assertRaises(TransportException, c.stop)
 
+    @patch("time.sleep")
+    def test_status__reconnect(self, sleep, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            TransportException("Connection closed by daemon"),
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {"status": "ok"},
+        ]
+
+        c = ClearSkies()
+        c.connect()
+        self.assertEqual(c.status(), {"status": "ok"})
+        self.assertTrue(c.connected)
+        self.assertEqual(UJS().connect.call_count, 2)
+        self.assertEqual(sleep.call_count, 1)
+
+    @patch("time.sleep")
+    @patch("random.uniform", lambda low, high: high)
+    def test_status__reconnect_gives_up(self, sleep, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            TransportException("Connection closed by daemon"),
+        ]
+        UJS().connect.side_effect = [None] + [TransportException("Connection refused")] * 3
+
+        c = ClearSkies(retries=3, backoff=1, max_backoff=3)
+        c.connect()
+        self.assertRaises(TransportException, c.status)
+        self.assertFalse(c.connected)
+        self.assertEqual(
+            [call[0][0] for call in sleep.call_args_list],
+            [1, 2, 3],
+        )
+
+    @patch("time.sleep")
+    def test_create_share__not_replayed(self, sleep, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            TransportException("Connection closed by daemon"),
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {},
+        ]
+
+        c = ClearSkies()
+        c.connect()
+        self.assertRaises(TransportException, c.create_share, "/home/foo/Shared")
+        self.assertEqual(UJS().send.call_count, 1)
+        self.assertFalse(sleep.called)
+
+        # the next command reconnects first, so it's safe to send anything
+        c.create_share("/home/foo/Shared")
+        self.assertEqual(UJS().send.call_count, 2)
+        self.assertTrue(c.connected)
+
+    @patch("time.sleep")
+    def test_status__timeout(self, sleep, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            TimeoutException("Timed out waiting for the daemon"),
+        ]
+
+        c = ClearSkies(timeout=5)
+        c.connect()
+        self.assertRaises(TimeoutException, c.status)
+        # not retried, and the connection (which may yet get the reply)
+        # is dropped
+        self.assertEqual(UJS().send.call_count, 1)
+        self.assertFalse(sleep.called)
+        self.assertFalse(c.connected)
+        self.assertTrue(UJS().close.called)
+
+    def test_status__deadline(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {"status": "ok"},
+        ]
+
+        c = ClearSkies()
+        c.connect()
+        with patch("time.monotonic", Mock(return_value=100)):
+            c.status(timeout=2)
+        UJS().recv.assert_called_with(102)
+
+    @patch("time.sleep")
+    @patch("random.uniform", lambda low, high: high)
+    def test_status__no_backoff_past_deadline(self, sleep, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            TransportException("Connection closed by daemon"),
+        ]
+
+        c = ClearSkies(backoff=10)
+        c.connect()
+        self.assertRaises(TimeoutException, c.status, timeout=1)
+        self.assertFalse(sleep.called)
+
+    def test_cache(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {"shares": []},
+            {},
+            {"shares": [{"path": "/home/foo/Shared", "status": "N/A"}]},
+        ]
+
+        c = ClearSkies(cache=ResponseCache())
+        c.connect()
+        self.assertEqual(c.list_shares(), [])
+        self.assertEqual(c.list_shares(), [])
+        self.assertEqual(UJS().send.call_count, 1)
+
+        c.create_share("/home/foo/Shared")
+        self.assertEqual(c.list_shares(), [Share("/home/foo/Shared", "N/A")])
+        self.assertEqual(UJS().send.call_count, 3)
+        self.assertEqual(c.cache.stats(), {"hits": 1, "misses": 2, "size": 1})
+
+    @patch("time.sleep")
+    def test_metrics(self, sleep, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {},
+            TransportException("Connection closed by daemon"),
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {},
+        ]
+
+        metrics = Metrics()
+        c = ClearSkies(metrics=metrics)
+        self.assertIs(UJS().metrics, metrics)
+        c.connect()
+        c.status()
+        c.status()
+        self.assertEqual(metrics.latency["status"].count, 2)
+        self.assertEqual(metrics.reconnects, 1)
+        self.assertEqual(metrics.in_flight, 0)
+
+    def test_metrics__lazy_connect(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {},
+        ]
+
+        metrics = Metrics()
+        c = ClearSkies(metrics=metrics)
+        c.status()
+        self.assertTrue(c.connected)
+        self.assertEqual(metrics.reconnects, 0)
+
     def test_pause(self, UJS):
         UJS().recv.side_effect = [
             {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
@@ -88,7 +260,7 @@ class TestClearSkies(unittest.TestCase):
 
         UJS().send.assert_called_with({
             "type": "pause",
-        })
+        }, None)
 
     def test_resume(self, UJS):
         UJS().recv.side_effect = [
@@ -102,7 +274,7 @@ class TestClearSkies(unittest.TestCase):
 
         UJS().send.assert_called_with({
             "type": "resume",
-        })
+        }, None)
 
     def test_status(self, UJS):
         UJS().recv.side_effect = [
@@ -116,7 +288,7 @@ class TestClearSkies(unittest.TestCase):
 
         UJS().send.assert_called_with({
             "type": "status",
-        })
+        }, None)
 
     def test_create_share(self, UJS):
         UJS().recv.side_effect = [
@@ -131,7 +303,7 @@ class TestClearSkies(unittest.TestCase):
         UJS().send.assert_called_with({
             "type": "create_share",
             "path": "/home/foo/Shared",
-        })
+        }, None)
 
     def test_list_shares(self, UJS):
         UJS().recv.side_effect = [
@@ -141,11 +313,74 @@ class TestClearSkies(unittest.TestCase):
 
         c = ClearSkies()
         c.connect()
-        c.list_shares()
+        shares = c.list_shares()
 
         UJS().send.assert_called_with({
             "type": "list_shares",
-        })
+        }, None)
+        self.assertEqual(shares, [Share("/home/foo/Shared", "N/A")])
+        self.assertEqual(shares[0]["status"], "N/A")
+
+    def test_list_shares__table(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {"shares": [{"path": "/home/foo/Shared", "status": "N/A"}]},
+        ]
+
+        c = ClearSkies()
+        c.connect()
+        shares = c.list_shares(table=True)
+
+        self.assertEqual(list(shares), [Share("/home/foo/Shared", "N/A")])
+
+    def test_iter_shares(self, UJS):
+        UJS().binary = None
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+        ]
+        chunks = iter([
+            b'{"shares": [{"path": "/home/foo/Shared", "status": "N/A"}, ',
+            b'{"path": "/home/foo/Pictures", "status": "N/A"}]',
+            b'}',
+        ])
+        UJS().recv_chunks.return_value = chunks
+
+        c = ClearSkies()
+        c.connect()
+        shares = c.iter_shares()
+        self.assertEqual(next(shares), Share("/home/foo/Shared", "N/A"))
+        UJS().send.assert_called_with({
+            "type": "list_shares",
+        }, None)
+
+        # stopping early still reads the rest of the reply
+        shares.close()
+        self.assertEqual(list(chunks), [])
+        self.assertTrue(c.connected)
+
+    def test_iter_shares__binary(self, UJS):
+        UJS().binary = Mock()
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {"shares": [{"path": "/home/foo/Shared", "status": "N/A"}]},
+        ]
+
+        c = ClearSkies()
+        c.connect()
+        self.assertEqual(list(c.iter_shares()), [Share("/home/foo/Shared", "N/A")])
+        self.assertFalse(UJS().recv_chunks.called)
+
+    def test_iter_shares__not_json(self, UJS):
+        UJS().binary = None
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+        ]
+        UJS().recv_chunks.return_value = iter([b'{"shares": [{"path"', b'}'])
+
+        c = ClearSkies()
+        c.connect()
+        self.assertRaises(TransportException, list, c.iter_shares())
+        self.assertFalse(c.connected)
 
     def test_create_access_code(self, UJS):
         UJS().recv.side_effect = [
@@ -162,7 +397,7 @@ class TestClearSkies(unittest.TestCase):
             "type": "create_access_code",
             "path": "/home/foo/Shared",
             "mode": "read_write",
-        })
+        }, None)
 
     def test_create_access_code__invalid_mode(self, UJS):
         UJS().recv.side_effect = [
@@ -188,7 +423,7 @@ class TestClearSkies(unittest.TestCase):
             "type": "add_share",
             "code": "ABCDEF",
             "path": "/home/foo/Shared",
-        })
+        }, None)
 
     def test_remove_share(self, UJS):
         UJS().recv.side_effect = [
@@ -203,7 +438,189 @@ class TestClearSkies(unittest.TestCase):
         UJS().send.assert_called_with({
             "type": "remove_share",
             "path": "/home/foo/Shared",
-        })
+        }, None)
+
+    def test_pipeline(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {"status": "ok"},
+            {"shares": [{"path": "/home/foo/Shared", "status": "N/A"}]},
+            {"access_code": "SYNC123ABC"},
+        ]
+
+        c = ClearSkies()
+        c.connect()
+        with c.pipeline() as p:
+            status = p.status()
+            shares = p.list_shares()
+            code = p.create_access_code("/home/foo/Shared", "read_only")
+            self.assertFalse(status.done())
+
+        self.assertEqual(status.result(), {"status": "ok"})
+        self.assertEqual(shares.result(), [Share("/home/foo/Shared", "N/A")])
+        self.assertEqual(code.result(), "SYNC123ABC")
+        UJS().send_many.assert_called_once_with([
+            {"type": "status"},
+            {"type": "list_shares"},
+            {"type": "create_access_code", "path": "/home/foo/Shared", "mode": "read_only"},
+        ], None)
+
+    def test_pipeline__execute(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {},
+            {"shares": []},
+        ]
+
+        c = ClearSkies()
+        c.connect()
+        p = c.pipeline()
+        p.pause()
+        p.list_shares()
+        self.assertEqual(p.execute(), [{}, []])
+        self.assertEqual(p.execute(), [])
+
+    def test_create_shares(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {}, {}, {},
+        ]
+
+        c = ClearSkies()
+        c.connect()
+        self.assertEqual(c.create_shares(["/a", "/b", "/c"], batch_size=2), [
+            BulkResult("/a", {}, None),
+            BulkResult("/b", {}, None),
+            BulkResult("/c", {}, None),
+        ])
+        self.assertEqual(UJS().send_many.call_count, 2)
+        UJS().send_many.assert_called_with([{"type": "create_share", "path": "/c"}], None)
+
+    @patch("time.sleep")
+    def test_add_shares__error(self, sleep, UJS):
+        error = TransportException("Connection closed by daemon")
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {},
+            error,
+        ]
+
+        c = ClearSkies()
+        c.connect()
+        self.assertEqual(c.add_shares([("CODE1", "/a"), ("CODE2", "/b")]), [
+            BulkResult(("CODE1", "/a"), {}, None),
+            BulkResult(("CODE2", "/b"), None, error),
+        ])
+        UJS().send_many.assert_called_with([
+            {"type": "add_share", "code": "CODE1", "path": "/a"},
+            {"type": "add_share", "code": "CODE2", "path": "/b"},
+        ], None)
+
+    def test_remove_shares__handshake_error(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 2, "service": "ClearSkies Control", "software": "test"},
+        ]
+
+        c = ClearSkies()
+        results = c.remove_shares(["/a"])
+        self.assertEqual(results[0].item, "/a")
+        self.assertIsInstance(results[0].error, ProtocolException)
+
+    def test_bulk__refused(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {}, {"error": "No such share"},
+        ]
+
+        c = ClearSkies()
+        results = c.remove_shares(["/a", "/b"])
+        self.assertEqual(results[0], BulkResult("/a", {}, None))
+        self.assertIsNone(results[1].result)
+        self.assertIsInstance(results[1].error, CommandException)
+        self.assertEqual(str(results[1].error), "No such share")
+
+    def test_bulk(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {}, {},
+        ]
+
+        c = ClearSkies()
+        calls = [("create_share", ("/a", )), ("remove_share", ("/b", ))]
+        self.assertEqual(c.bulk(calls), [
+            BulkResult(calls[0], {}, None),
+            BulkResult(calls[1], {}, None),
+        ])
+
+    @patch("clearskies.codec.binary_codecs")
+    def test_binary(self, binary_codecs, UJS):
+        msgpack, cbor = Mock(), Mock()
+        msgpack.name, cbor.name = "msgpack", "cbor"
+        binary_codecs.return_value = [msgpack, cbor]
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test", "features": ["cbor"]},
+            {},
+        ]
+
+        c = ClearSkies(binary=True)
+        c.connect()
+        UJS().send.assert_called_with({"type": "set_encoding", "encoding": "cbor"}, None)
+        self.assertEqual(UJS().binary, cbor)
+
+    @patch("clearskies.codec.binary_codecs")
+    def test_binary__refused(self, binary_codecs, UJS):
+        msgpack = Mock()
+        msgpack.name = "msgpack"
+        binary_codecs.return_value = [msgpack]
+        UJS().binary = None
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test", "features": ["msgpack"]},
+            {"error": "Unsupported encoding 'msgpack'"},
+        ]
+
+        c = ClearSkies(binary=True)
+        c.connect()
+        self.assertTrue(c.connected)
+        self.assertIsNone(UJS().binary)
+
+    def test_binary__not_offered(self, UJS):
+        UJS().binary = None
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+        ]
+
+        c = ClearSkies(binary=True)
+        c.connect()
+        self.assertFalse(UJS().send.called)
+        self.assertIsNone(UJS().binary)
+
+    @patch("clearskies.scan.scan_shares")
+    def test_scan_shares(self, scan_shares, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {"shares": [{"path": "/a", "status": "synced"}]},
+        ]
+
+        c = ClearSkies()
+        self.assertEqual(c.scan_shares(workers=4), scan_shares.return_value)
+        scan_shares.assert_called_with([Share("/a", "synced")], 4)
+
+    def test_pipeline__error(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+            {},
+            TransportException("Connection closed by daemon"),
+        ]
+
+        c = ClearSkies()
+        c.connect()
+        p = c.pipeline()
+        pause = p.pause()
+        resume = p.resume()
+        self.assertRaises(TransportException, p.execute)
+        self.assertEqual(pause.result(), {})
+        self.assertRaises(TransportException, resume.result)
+        self.assertFalse(c.connected)
 
     ##########################################################################
     # Not official APIs section
@@ -218,13 +635,18 @@ class TestClearSkies(unittest.TestCase):
         c = ClearSkies()
         c.connect()
 
-        with patch(_open) as mock_open:
-            mock_open.return_value.read.return_value = "some\nlog\ndata\n"
-            # get all the log data
-            self.assertEqual(c.get_log_data(), "some\nlog\ndata\n")
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmpdir, "log"), "w") as f:
+                f.write("some\nlog\ndata\n")
+            with patch("clearskies.client.xdgBaseDirectory.save_data_path", Mock(return_value=tmpdir)):
+                # get all the log data
+                self.assertEqual(c.get_log_data(), "some\nlog\ndata\n")
 
-            # get the bottom two lines
-            self.assertEqual(c.get_log_data(2), "log\ndata\n")
+                # get the bottom two lines
+                self.assertEqual(c.get_log_data(2), "log\ndata\n")
+        finally:
+            shutil.rmtree(tmpdir)
 
     def test_get_log_data__io_error(self, UJS):
         UJS().recv.side_effect = [
@@ -239,6 +661,31 @@ class TestClearSkies(unittest.TestCase):
         with patch(_open) as mock_open:
             mock_open.side_effect = IOError("File not found")
             self.assertRaises(ProtocolException, c.get_log_data)
+            self.assertRaises(ProtocolException, c.get_log_data, 2)
+            self.assertRaises(ProtocolException, next, c.follow_log())
+
+    @patch("clearskies.logtail.inotify_simple", None)
+    @patch("time.sleep")
+    def test_follow_log(self, sleep, UJS):
+        c = ClearSkies()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            log_path = os.path.join(tmpdir, "log")
+            with open(log_path, "w") as f:
+                f.write("some\nlog\n")
+
+            def append(n):
+                with open(log_path, "a") as f:
+                    f.write("data\n")
+            sleep.side_effect = append
+
+            with patch("clearskies.client.xdgBaseDirectory.save_data_path", Mock(return_value=tmpdir)):
+                lines = c.follow_log(1)
+                self.assertEqual(next(lines), "log")
+                self.assertEqual(next(lines), "data")
+                lines.close()
+        finally:
+            shutil.rmtree(tmpdir)
 
     def test_get_config(self, UJS):
         UJS().recv.side_effect = [
@@ -307,3 +754,41 @@ class TestClearSkies(unittest.TestCase):
         #    "key": "foo",
         #    "value": "bar",
         #})
+
+    def test_set_config_value__invalid(self, UJS):
+        c = ClearSkies()
+        self.assertRaises(ValueError, c.set_config_value, "upload_limit", "fast")
+        self.assertEqual(c.get_config_value("upload_limit"), 32000)
+
+    def test_config__saved(self, UJS):
+        c = ClearSkies()
+        c.set_config_value("upload_limit", 64000)
+        self.assertEqual(ClearSkies().get_config_value("upload_limit"), 64000)
+
+    def test_config__pushed(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test", "features": ["config"]},
+            {},
+        ]
+
+        c = ClearSkies()
+        c.connect()
+        with c.config_batch():
+            c.set_config_value("upload_limit", 64000)
+            c.set_config_value("download_limit", 512000)
+
+        self.assertEqual(UJS().send.call_count, 1)
+        UJS().send.assert_called_with({
+            "type": "set_config",
+            "config": {"upload_limit": 64000, "download_limit": 512000},
+        }, None)
+
+    def test_config__not_pushed(self, UJS):
+        UJS().recv.side_effect = [
+            {"protocol": 1, "service": "ClearSkies Control", "software": "test"},
+        ]
+
+        c = ClearSkies()
+        c.connect()
+        c.set_config_value("upload_limit", 64000)
+        self.assertFalse(UJS().send.called)
@@ -0,0 +1,51 @@
+from mock import patch
+import unittest
+
+from clearskies import codec
+
+
+SHARES = {"shares": [{"path": u"/home/föö/Shared\n%d" % n, "status": "N/A"} for n in range(10)]}
+
+
+class TestCodecs(unittest.TestCase):
+    def test_round_trip(self):
+        for c in codec.available_codecs():
+            data = c.dumps(SHARES)
+            self.assertIsInstance(data, bytes, c.name)
+            self.assertNotIn(b"\n", data, c.name)
+            self.assertEqual(c.loads(data), SHARES, c.name)
+            self.assertEqual(c.loads(bytearray(data)), SHARES, c.name)
+            self.assertEqual(c.loads(memoryview(data)), SHARES, c.name)
+
+    def test_not_json(self):
+        for c in codec.available_codecs():
+            self.assertRaises(ValueError, c.loads, b"somethingblah")
+
+    def test_binary_round_trip(self):
+        for c in codec.binary_codecs():
+            data = c.dumps(SHARES)
+            self.assertIsInstance(data, bytes, c.name)
+            self.assertTrue(c.binary, c.name)
+            self.assertLess(len(data), len(codec.StdlibJsonCodec().dumps(SHARES)), c.name)
+            self.assertEqual(c.loads(data), SHARES, c.name)
+            self.assertEqual(c.loads(bytearray(data)), SHARES, c.name)
+            self.assertEqual(c.loads(memoryview(data)), SHARES, c.name)
+
+    def test_binary_garbage(self):
+        for c in codec.binary_codecs():
+            self.assertRaises(ValueError, c.loads, b"\xc1")
+            self.assertRaises(ValueError, c.loads, b"")
+
+    @patch.dict("sys.modules", {"msgpack": None, "cbor2": None})
+    def test_binary__none(self):
+        self.assertEqual(codec.binary_codecs(), [])
+
+    def test_base(self):
+        c = codec.Codec()
+        self.assertRaises(NotImplementedError, c.dumps, {})
+        self.assertRaises(NotImplementedError, c.loads, b"{}")
+
+    @patch("clearskies.codec.orjson", None)
+    @patch("clearskies.codec.ujson", None)
+    def test_default__fallback(self):
+        self.assertIsInstance(codec.default_codec(), codec.StdlibJsonCodec)
@@ -0,0 +1,97 @@
+from mock import patch, Mock
+import unittest
+import tempfile
+import shutil
+import json
+import os
+
+from clearskies.config import ConfigStore, DEFAULTS
+
+
+class TestConfigStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "config.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def saved(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    def test_defaults(self):
+        store = ConfigStore(self.path)
+        self.assertEqual(store.get_all(), DEFAULTS)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_lazy(self):
+        with patch("clearskies.config.default_config_path", Mock(return_value=self.path)) as path:
+            store = ConfigStore()
+            self.assertFalse(path.called)
+            store.get("tracker")
+            self.assertEqual(store.path, self.path)
+
+    def test_set(self):
+        store = ConfigStore(self.path)
+        store.set("upload_limit", 1000)
+        self.assertEqual(store.get("upload_limit"), 1000)
+        self.assertEqual(self.saved()["upload_limit"], 1000)
+        self.assertEqual(ConfigStore(self.path).get("upload_limit"), 1000)
+
+    def test_set__unknown_key(self):
+        store = ConfigStore(self.path)
+        store.set("colour", "blue")
+        self.assertEqual(ConfigStore(self.path).get("colour"), "blue")
+
+    def test_validate(self):
+        store = ConfigStore(self.path)
+        self.assertRaises(ValueError, store.set, "upload_limit", "1000")
+        self.assertRaises(ValueError, store.set, "upload_limit", -1)
+        self.assertRaises(ValueError, store.set, "upload_limit", True)
+        self.assertRaises(ValueError, store.set, "tracker", 123)
+        self.assertRaises(ValueError, store.update, {"upload_limit": 1, "download_limit": "lots"})
+        self.assertEqual(store.get("upload_limit"), DEFAULTS["upload_limit"])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_bad_file(self):
+        with open(self.path, "w") as f:
+            json.dump({"upload_limit": "fast", "tracker": "http://example.com/"}, f)
+        store = ConfigStore(self.path)
+        self.assertEqual(store.get("upload_limit"), DEFAULTS["upload_limit"])
+        self.assertEqual(store.get("tracker"), "http://example.com/")
+
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        self.assertEqual(ConfigStore(self.path).get_all(), DEFAULTS)
+
+    def test_batch(self):
+        flushed = []
+        store = ConfigStore(self.path, on_flush=flushed.append)
+        with store.batch():
+            store.set("upload_limit", 1)
+            with store.batch():
+                store.set("download_limit", 2)
+            self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(flushed, [{"upload_limit": 1, "download_limit": 2}])
+        self.assertEqual(self.saved()["download_limit"], 2)
+
+    def test_update(self):
+        flushed = []
+        store = ConfigStore(self.path, on_flush=flushed.append)
+        store.update({"upload_limit": 1, "download_limit": 2})
+        self.assertEqual(flushed, [{"upload_limit": 1, "download_limit": 2}])
+
+    def test_replace(self):
+        store = ConfigStore(self.path)
+        store.replace({"key": "value"})
+        self.assertEqual(store.get_all(), {"key": "value"})
+        self.assertEqual(self.saved(), {"key": "value"})
+
+    def test_atomic(self):
+        store = ConfigStore(self.path)
+        store.set("upload_limit", 1)
+        with patch("os.replace", Mock(side_effect=OSError("disk full"))):
+            self.assertRaises(OSError, store.set, "upload_limit", 2)
+        self.assertEqual(self.saved()["upload_limit"], 1)
+        self.assertEqual(os.listdir(self.tmpdir), ["config.json"])
@@ -0,0 +1,181 @@
+import threading
+import unittest
+
+from clearskies.events import ShareWatcher, delta_events
+from clearskies.exc import TransportException
+from clearskies.share import Share, ShareIndex
+
+
+class FakeSocket(object):
+    def __init__(self, client):
+        self.client = client
+
+    def send(self, cmd):
+        self.client.sent.append(cmd)
+
+    def recv(self):
+        event = self.client.pushed.pop(0)
+        if isinstance(event, Exception):
+            raise event
+        return event
+
+
+class FakeClient(object):
+    """
+    Each list_shares() returns the next of `listings`; in push mode, each
+    recv() returns the next of `pushed` (listings included)
+    """
+    def __init__(self, control_path, codec=None):
+        self.control_path = control_path
+        self.connected = False
+        self.features = []
+        self.listings = []
+        self.pushed = []
+        self.sent = []
+        self.subscribe_reply = {}
+        self.socket = FakeSocket(self)
+
+    def reconnect(self):
+        self.connected = True
+
+    def close(self):
+        self.connected = False
+
+    def supports(self, feature):
+        return feature in self.features
+
+    def list_shares(self):
+        # the last listing is repeated forever
+        listing = self.listings.pop(0) if len(self.listings) > 1 else self.listings[0]
+        if isinstance(listing, Exception):
+            raise listing
+        return [Share(path, status) for path, status in listing]
+
+    def _cmd(self, cmd):
+        self.sent.append(cmd)
+        return self.subscribe_reply
+
+
+class TestDeltaEvents(unittest.TestCase):
+    def test_delta_events(self):
+        index = ShareIndex([Share("/a", "N/A"), Share("/b", "N/A")])
+        self.assertEqual(
+            sorted(delta_events(index.apply([Share("/b", "syncing"), Share("/c", "N/A")])), key=lambda e: e["path"]),
+            [
+                {"event": "share_removed", "path": "/a"},
+                {"event": "share_status", "path": "/b", "status": "syncing", "old_status": "N/A"},
+                {"event": "share_added", "path": "/c", "status": "N/A"},
+            ]
+        )
+
+
+class TestShareWatcher(unittest.TestCase):
+    def watcher(self, **kwargs):
+        w = ShareWatcher("foo.sock", min_interval=0, max_interval=0, client_factory=FakeClient, **kwargs)
+        return w, w.client
+
+    def test_poll(self):
+        w, client = self.watcher()
+        client.listings = [
+            [("/a", "N/A")],
+            [("/a", "N/A")],
+            [("/a", "syncing"), ("/b", "N/A")],
+        ]
+        events = iter(w)
+        self.assertEqual(next(events), {"event": "share_added", "path": "/a", "status": "N/A"})
+        self.assertEqual(
+            sorted([next(events), next(events)], key=lambda e: e["path"]),
+            [
+                {"event": "share_status", "path": "/a", "status": "syncing", "old_status": "N/A"},
+                {"event": "share_added", "path": "/b", "status": "N/A"},
+            ]
+        )
+
+    def test_poll__no_initial(self):
+        w, client = self.watcher(initial=False)
+        client.listings = [[("/a", "N/A")], [("/b", "N/A")]]
+        events = iter(w)
+        self.assertEqual(
+            sorted([next(events), next(events)], key=lambda e: e["event"]),
+            [
+                {"event": "share_added", "path": "/b", "status": "N/A"},
+                {"event": "share_removed", "path": "/a"},
+            ]
+        )
+
+    def test_poll__backoff(self):
+        w = ShareWatcher("foo.sock", min_interval=1, max_interval=3, client_factory=FakeClient)
+        w.client.listings = [[], [], [], [], [("/a", "N/A")], [("/a", "N/A")]]
+        waits = []
+
+        def wait(interval):
+            waits.append(interval)
+            if len(waits) == 6:
+                w.stopped.set()
+            return w.stopped.is_set()
+        w.stopped.wait = wait
+        self.assertEqual(len(list(w)), 1)
+        self.assertEqual(waits, [1, 2, 3, 3, 1, 2])
+
+    def test_push(self):
+        w, client = self.watcher()
+        client.features = ["events"]
+        client.pushed = [
+            {"shares": [{"path": "/a", "status": "N/A"}]},
+            {"event": "share_status", "path": "/a", "status": "syncing", "old_status": "N/A"},
+            {"event": "share_removed", "path": "/a"},
+        ]
+        events = iter(w)
+        self.assertEqual(next(events)["event"], "share_added")
+        self.assertEqual(next(events)["event"], "share_status")
+        self.assertEqual(w.index.get("/a"), Share("/a", "syncing"))
+        self.assertEqual(next(events)["event"], "share_removed")
+        # subscribed before listing, so no change can slip between the two
+        self.assertEqual(client.sent, [{"type": "subscribe"}, {"type": "list_shares"}])
+        self.assertEqual(len(w.index), 0)
+
+    def test_push__events_before_listing(self):
+        w, client = self.watcher(initial=False)
+        client.features = ["events"]
+        client.pushed = [
+            # already covered by the listing which follows
+            {"event": "share_added", "path": "/b", "status": "N/A"},
+            {"shares": [{"path": "/a", "status": "N/A"}, {"path": "/b", "status": "N/A"}]},
+            {"event": "share_removed", "path": "/a"},
+        ]
+        events = iter(w)
+        self.assertEqual(next(events), {"event": "share_removed", "path": "/a"})
+        self.assertEqual(list(w.index), [Share("/b", "N/A")])
+
+    def test_push__refused(self):
+        w, client = self.watcher(push=True)
+        client.subscribe_reply = {"error": "Unknown command 'subscribe'"}
+        client.listings = [[("/a", "N/A")]]
+        events = iter(w)
+        # falls back to polling, rather than waiting forever for events
+        self.assertEqual(next(events), {"event": "share_added", "path": "/a", "status": "N/A"})
+        self.assertEqual(client.sent, [{"type": "subscribe"}])
+        self.assertEqual(client.pushed, [])
+
+    def test_push__reconnect(self):
+        w, client = self.watcher()
+        client.features = ["events"]
+        client.pushed = [
+            {"shares": [{"path": "/a", "status": "N/A"}]},
+            TransportException("Connection closed by daemon"),
+            {"shares": [{"path": "/a", "status": "N/A"}, {"path": "/b", "status": "N/A"}]},
+        ]
+        events = iter(w)
+        self.assertEqual(next(events)["path"], "/a")
+        # changes which happened while we were disconnected come from the diff
+        self.assertEqual(next(events), {"event": "share_added", "path": "/b", "status": "N/A"})
+        self.assertTrue(client.connected)
+
+    def test_start_stop(self):
+        w, client = self.watcher(push=False)
+        client.listings = [[("/a", "N/A")]]
+        got = threading.Event()
+        w.start(lambda event: got.set())
+        self.assertTrue(got.wait(5))
+        w.stop()
+        self.assertFalse(w.thread.is_alive())
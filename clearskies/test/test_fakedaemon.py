@@ -0,0 +1,167 @@
+from mock import patch
+import asyncio
+import threading
+import unittest
+import time
+
+from clearskies.aio import AsyncClearSkies
+from clearskies.client import ClearSkies
+from clearskies.codec import binary_codecs
+from clearskies.exc import TransportException
+from clearskies.fakedaemon import FakeDaemon
+from clearskies.pool import ClearSkiesPool
+from clearskies.share import Share
+
+
+class TestFakeDaemon(unittest.TestCase):
+    def setUp(self):
+        self.clients = []
+
+    def tearDown(self):
+        for cs in self.clients:
+            cs.close()
+
+    def client(self, daemon, **kwargs):
+        cs = ClearSkies(daemon.control_path, **kwargs)
+        self.clients.append(cs)
+        return cs
+
+    def test_commands(self):
+        with FakeDaemon(features=["config"]) as daemon:
+            cs = self.client(daemon)
+            cs.connect()
+            self.assertEqual(cs.handshake["protocol"], 1)
+            self.assertTrue(cs.supports("config"))
+
+            self.assertEqual(cs.status(), {"status": "ok"})
+            cs.pause()
+            self.assertEqual(cs.status(), {"status": "paused"})
+            cs.resume()
+
+            cs.create_share("/home/foo/A")
+            code = cs.create_access_code("/home/foo/A", "read_only")
+            self.assertEqual(daemon.access_codes[code], ("/home/foo/A", "read_only"))
+
+            self.assertIn("error", cs.add_share("SYNC123ABC", "/home/foo/B"))
+            cs.add_share(code, "/home/foo/B")
+            self.assertEqual(cs.list_shares(), [Share("/home/foo/A", "N/A"), Share("/home/foo/B", "N/A")])
+
+            cs.remove_share("/home/foo/A")
+            self.assertEqual(cs.list_shares(), [Share("/home/foo/B", "N/A")])
+            self.assertIn("error", cs.remove_share("/home/foo/A"))
+            self.assertIn("error", cs._cmd({"type": "frobnicate"}))
+
+    @unittest.skipUnless(binary_codecs(), "needs msgpack or cbor2")
+    def test_binary(self):
+        for codec in binary_codecs():
+            with FakeDaemon(shares=1000, features=[codec.name]) as daemon:
+                cs = self.client(daemon, binary=True)
+                cs.connect()
+                self.assertEqual(cs.socket.binary.name, codec.name)
+                self.assertEqual(cs.status(), {"status": "ok"})
+                self.assertEqual(len(cs.list_shares()), 1000)
+                self.assertEqual(len(list(cs.iter_shares())), 1000)
+                self.assertIn("error", cs._cmd({"type": "frobnicate"}))
+
+                # a reconnect negotiates all over again
+                daemon.fail_next()
+                self.assertEqual(cs.status(), {"status": "ok"})
+                self.assertEqual(cs.socket.binary.name, codec.name)
+
+    def test_binary__not_offered(self):
+        with FakeDaemon(shares=3) as daemon:
+            cs = self.client(daemon, binary=True)
+            self.assertEqual(len(cs.list_shares()), 3)
+            self.assertIsNone(cs.socket.binary)
+
+    def test_set_encoding__unsupported(self):
+        with FakeDaemon() as daemon:
+            cs = self.client(daemon)
+            self.assertIn("error", cs._cmd({"type": "set_encoding", "encoding": "msgpack"}))
+            self.assertEqual(cs.status(), {"status": "ok"})
+
+    def test_set_shares(self):
+        with FakeDaemon(shares=3) as daemon:
+            cs = self.client(daemon)
+            self.assertEqual(len(cs.list_shares()), 3)
+            daemon.call(daemon.set_shares, 1000)
+            self.assertEqual(len(list(cs.iter_shares())), 1000)
+
+    def test_fragment(self):
+        with FakeDaemon(shares=20, fragment=3) as daemon:
+            cs = self.client(daemon)
+            self.assertEqual(len(cs.list_shares()), 20)
+            self.assertEqual(cs.status(), {"status": "ok"})
+
+    def test_latency(self):
+        with FakeDaemon(latency=0.2) as daemon:
+            cs = self.client(daemon)
+            cs.connect()
+            start = time.monotonic()
+            cs.status()
+            self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    @patch("time.sleep")
+    def test_fail_next(self, sleep):
+        with FakeDaemon() as daemon:
+            cs = self.client(daemon)
+            cs.connect()
+
+            # replay-safe commands are retried on a new connection...
+            daemon.fail_next()
+            self.assertEqual(cs.status(), {"status": "ok"})
+            self.assertEqual(daemon.total_connections, 2)
+
+            # ...others aren't, though the daemon did act on it
+            daemon.fail_next()
+            self.assertRaises(TransportException, cs.create_share, "/home/foo/A")
+            self.assertIn("/home/foo/A", daemon.shares)
+
+    def test_failure_rate(self):
+        with FakeDaemon(failure_rate=0.3, seed=1) as daemon:
+            cs = self.client(daemon, retries=10, backoff=0)
+            for n in range(50):
+                self.assertEqual(cs.status(), {"status": "ok"})
+            self.assertGreater(daemon.total_connections, 1)
+
+    def test_soak_pool(self):
+        with FakeDaemon(latency=0.001, fragment=64, failure_rate=0.01, seed=1) as daemon:
+            pool = ClearSkiesPool(daemon.control_path, max_size=16)
+            errors = []
+
+            def worker():
+                for n in range(50):
+                    try:
+                        pool.status()
+                    except Exception as e:
+                        errors.append(e)
+            threads = [threading.Thread(target=worker) for n in range(32)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            # a dropped connection is only retried if it had been sitting
+            # in the pool, so a few errors get through; but none of them
+            # should leak connections or break the pool
+            self.assertTrue(all(isinstance(e, TransportException) for e in errors))
+            self.assertLess(len(errors), 32 * 50 * 0.01 * 2)
+            self.assertEqual(pool.size, len(pool.idle))
+            self.assertEqual(pool.status(), {"status": "ok"})
+            pool.close()
+
+    def test_many_clients(self):
+        async def test():
+            async with FakeDaemon(latency=0.01) as daemon:
+                clients = [AsyncClearSkies(daemon.control_path) for n in range(200)]
+                await asyncio.gather(*[cs.connect() for cs in clients])
+                self.assertEqual(daemon.connections, 200)
+                replies = await asyncio.gather(*[cs.status() for cs in clients])
+                await asyncio.gather(*[cs.close() for cs in clients])
+            return replies
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(loop.run_until_complete(test()), [{"status": "ok"}] * 200)
+        finally:
+            loop.close()
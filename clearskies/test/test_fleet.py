@@ -0,0 +1,106 @@
+from mock import Mock
+import threading
+import unittest
+
+from clearskies.client import ClearSkies
+from clearskies.fleet import ClearSkiesFleet, FleetResult
+from clearskies.exc import TransportException
+
+
+class FakeClient(object):
+    def __init__(self, control_path):
+        self.control_path = control_path
+        self.connected = False
+        self.closed = False
+        self.gate = None
+        self.timeouts = []
+        self.paused = threading.Event()
+
+    def connect(self, timeout=None):
+        self.timeouts.append(timeout)
+        if self.control_path == "down.sock":
+            raise TransportException("Connection refused")
+        self.connected = True
+
+    def status(self, timeout=None):
+        self.timeouts.append(timeout)
+        if self.gate:
+            self.gate.wait(5)
+        return {"status": self.control_path}
+
+    def list_shares(self, timeout=None):
+        if self.control_path == "error.sock":
+            # what list_shares() does with an {"error": ...} reply
+            raise KeyError("shares")
+        return []
+
+    def pause(self, timeout=None):
+        self.paused.set()
+        return {}
+
+    def close(self):
+        self.closed = True
+        self.connected = False
+
+
+class TestClearSkiesFleet(unittest.TestCase):
+    def test_status(self):
+        fleet = ClearSkiesFleet(["a.sock", "b.sock", "down.sock"], client_factory=FakeClient)
+        results = fleet.call_all("status")
+        self.assertEqual(results["a.sock"], FleetResult("a.sock", {"status": "a.sock"}, None))
+        self.assertEqual(results["b.sock"].result, {"status": "b.sock"})
+        self.assertIsNone(results["down.sock"].result)
+        self.assertIsInstance(results["down.sock"].error, TransportException)
+
+    def test_unexpected_error(self):
+        fleet = ClearSkiesFleet(["a.sock", "error.sock", "b.sock"], client_factory=FakeClient)
+        results = fleet.call_all("list_shares")
+        self.assertEqual(results["a.sock"].result, [])
+        self.assertEqual(results["b.sock"].result, [])
+        self.assertIsInstance(results["error.sock"].error, KeyError)
+
+    def test_timeout(self):
+        fleet = ClearSkiesFleet(["a.sock"], client_factory=FakeClient)
+        list(fleet.status(timeout=0.5))
+        self.assertEqual(fleet.clients["a.sock"].timeouts, [0.5, 0.5])
+
+    def test_slow_daemon(self):
+        fleet = ClearSkiesFleet(["slow.sock", "a.sock", "b.sock"], max_workers=3, client_factory=FakeClient)
+        gate = fleet.clients["slow.sock"].gate = threading.Event()
+
+        results = fleet.status()
+        self.assertEqual(set([next(results).daemon, next(results).daemon]), set(["a.sock", "b.sock"]))
+        gate.set()
+        self.assertEqual(next(results).daemon, "slow.sock")
+
+    def test_pause(self):
+        fleet = ClearSkiesFleet(["a.sock", "b.sock"], client_factory=FakeClient)
+        self.assertEqual(sorted(r.daemon for r in fleet.pause()), ["a.sock", "b.sock"])
+
+    def test_pause__results_ignored(self):
+        fleet = ClearSkiesFleet(["a.sock", "b.sock"], client_factory=FakeClient)
+        fleet.pause()
+        for client in fleet.clients.values():
+            self.assertTrue(client.paused.wait(5))
+
+    def test_stop_early(self):
+        fleet = ClearSkiesFleet(["a.sock", "slow.sock", "b.sock"], max_workers=1, client_factory=FakeClient)
+        gate = fleet.clients["slow.sock"].gate = threading.Event()
+        results = fleet.status()
+        self.assertEqual(next(results).daemon, "a.sock")
+        results.close()
+        gate.set()
+        # the daemon still waiting for a worker is never called
+        self.assertEqual(fleet.clients["b.sock"].timeouts, [])
+
+    def test_clients(self):
+        client = Mock(spec=ClearSkies)
+        client.socket = Mock(control_path="c.sock")
+        fleet = ClearSkiesFleet([client])
+        self.assertIs(fleet.clients["c.sock"], client)
+
+    def test_close(self):
+        fleet = ClearSkiesFleet(["a.sock", "b.sock"], client_factory=FakeClient)
+        list(fleet.status())
+        fleet.close()
+        self.assertTrue(all(c.closed for c in fleet.clients.values()))
@@ -0,0 +1,39 @@
+import json
+import unittest
+
+from clearskies.jsonstream import iter_json_array
+
+
+def split(data, size):
+    return [data[n:n + size] for n in range(0, len(data), size)]
+
+
+class TestIterJsonArray(unittest.TestCase):
+    def test_items(self):
+        shares = [{"path": u"/home/föö/Shared%d" % n, "status": "N/A"} for n in range(100)]
+        data = json.dumps({"shares": shares}).encode("utf8")
+        for size in [1, 7, 100, len(data)]:
+            self.assertEqual(list(iter_json_array(split(data, size), "shares")), shares)
+
+    def test_other_keys(self):
+        data = b'{"count": 2, "shares" :\n [ 1 , [2], "x"] , "more": true}'
+        self.assertEqual(list(iter_json_array(split(data, 1), "shares")), [1, [2], "x"])
+
+    def test_numbers_across_chunks(self):
+        self.assertEqual(list(iter_json_array([b'{"n": [12', b'34, 5', b'6]}'], "n")), [1234, 56])
+        self.assertRaises(ValueError, list, iter_json_array([b'{"n": [12'], "n"))
+
+    def test_empty(self):
+        self.assertEqual(list(iter_json_array([b'{"shares": []}'], "shares")), [])
+
+    def test_stops_at_end_of_array(self):
+        chunks = iter([b'{"shares": [1]', b'}'])
+        self.assertEqual(list(iter_json_array(chunks, "shares")), [1])
+        self.assertEqual(list(chunks), [b'}'])
+
+    def test_missing(self):
+        self.assertRaises(ValueError, list, iter_json_array([b'{"error": "nope"}'], "shares"))
+
+    def test_truncated(self):
+        self.assertRaises(ValueError, list, iter_json_array([b'{"shares": [{"path": '], "shares"))
+        self.assertRaises(ValueError, list, iter_json_array([b'{"shares": [1, '], "shares"))
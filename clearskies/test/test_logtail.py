@@ -0,0 +1,123 @@
+from mock import patch
+import unittest
+import tempfile
+import shutil
+import os
+
+from clearskies import logtail
+
+
+class TestTail(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, data, mode="wb"):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def test_tail(self):
+        self.write(b"some\nlog\ndata\n")
+        self.assertEqual(logtail.tail(self.path, 2), "log\ndata\n")
+        self.assertEqual(logtail.tail(self.path, 3), "some\nlog\ndata\n")
+        self.assertEqual(logtail.tail(self.path, 10), "some\nlog\ndata\n")
+
+    def test_tail__no_trailing_newline(self):
+        self.write(b"some\nlog\ndata")
+        self.assertEqual(logtail.tail(self.path, 2), "log\ndata")
+
+    def test_tail__empty(self):
+        self.write(b"")
+        self.assertEqual(logtail.tail(self.path, 2), "")
+
+    def test_tail__blocks(self):
+        # lines spanning several blocks, and a newline right on a boundary
+        self.write(b"".join(b"line %03d\n" % n for n in range(500)))
+        for block_size in (1, 9, 10, 4096):
+            self.assertEqual(
+                logtail.tail(self.path, 3, block_size),
+                "line 497\nline 498\nline 499\n",
+            )
+
+    def test_tail__bounded_read(self):
+        self.write(b"x" * 100000 + b"\nlast\n")
+        real_open = open
+        reads = []
+
+        def counting_open(*args):
+            f = real_open(*args)
+            real_read = f.read
+            f.read = lambda n: reads.append(n) or real_read(n)
+            return f
+
+        with patch("clearskies.logtail.open", counting_open, create=True):
+            self.assertEqual(logtail.tail(self.path, 1, 16), "last\n")
+        self.assertEqual(sum(reads), 16)
+
+    def test_tail__unicode(self):
+        self.write(u"café\n".encode("utf8"))
+        self.assertEqual(logtail.tail(self.path, 1), u"café\n")
+
+
+@patch("clearskies.logtail.inotify_simple", None)
+@patch("time.sleep")
+class TestFollow(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "log")
+        with open(self.path, "wb") as f:
+            f.write(b"old\nlines\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def append(self, data):
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def test_follow(self, sleep):
+        lines = logtail.follow(self.path, 1)
+        self.assertEqual(next(lines), "lines")
+
+        sleep.side_effect = lambda n: self.append(b"new\nli")
+        self.assertEqual(next(lines), "new")
+
+        # partial lines are held back until they're complete
+        sleep.side_effect = lambda n: self.append(b"ne\n")
+        self.assertEqual(next(lines), "line")
+        lines.close()
+
+    def test_follow__from_end(self, sleep):
+        lines = logtail.follow(self.path)
+        sleep.side_effect = lambda n: self.append(b"new\n")
+        self.assertEqual(next(lines), "new")
+        lines.close()
+
+    def test_follow__rotated(self, sleep):
+        lines = logtail.follow(self.path)
+
+        def rotate(n):
+            self.append(b"last")
+            os.rename(self.path, self.path + ".1")
+            with open(self.path, "wb") as f:
+                f.write(b"first\n")
+        sleep.side_effect = rotate
+        self.assertEqual(next(lines), "last")
+        self.assertEqual(next(lines), "first")
+        lines.close()
+
+    def test_follow__truncated(self, sleep):
+        lines = logtail.follow(self.path)
+
+        def truncate(n):
+            with open(self.path, "wb") as f:
+                f.write(b"a\n")
+        sleep.side_effect = truncate
+        self.assertEqual(next(lines), "a")
+        lines.close()
+
+    def test_follow__missing(self, sleep):
+        self.assertRaises(IOError, next, logtail.follow(os.path.join(self.tmpdir, "nope")))
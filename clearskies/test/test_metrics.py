@@ -0,0 +1,71 @@
+import unittest
+
+from clearskies.metrics import Histogram, Metrics
+
+
+class TestHistogram(unittest.TestCase):
+    def test_observe(self):
+        h = Histogram((1, 2, 5))
+        for v in [0.5, 1, 1.5, 3, 10]:
+            h.observe(v)
+        self.assertEqual(h.counts, [2, 1, 1, 1])
+        self.assertEqual(h.count, 5)
+        self.assertEqual(h.sum, 16)
+
+    def test_quantile(self):
+        h = Histogram((1, 2, 5))
+        self.assertIsNone(h.quantile(0.5))
+        for v in [0.5, 0.5, 1.5, 3]:
+            h.observe(v)
+        self.assertEqual(h.quantile(0.5), 1)
+        self.assertEqual(h.quantile(0.99), 5)
+        h.observe(100)
+        self.assertEqual(h.quantile(1), float("inf"))
+
+
+class TestMetrics(unittest.TestCase):
+    def test_command(self):
+        events = []
+        m = Metrics(callback=lambda event, fields: events.append((event, fields)))
+
+        with m.command("status"):
+            self.assertEqual(m.in_flight, 1)
+        self.assertEqual(m.in_flight, 0)
+
+        error = ValueError("oops")
+        with self.assertRaises(ValueError):
+            with m.command("status"):
+                raise error
+
+        self.assertEqual(m.latency["status"].count, 2)
+        self.assertEqual(m.errors, {"status": 1})
+        self.assertEqual([e for e, f in events], ["command", "command"])
+        self.assertIs(events[1][1]["error"], error)
+
+    def test_counters(self):
+        m = Metrics()
+        m.sent(10)
+        m.received(20, 0.001)
+        m.received(30, 0.002)
+        m.reconnected()
+        self.assertEqual((m.bytes_sent, m.writes), (10, 1))
+        self.assertEqual((m.bytes_received, m.messages_received), (50, 2))
+        self.assertEqual(m.decode_time.count, 2)
+        self.assertEqual(m.reconnects, 1)
+
+    def test_to_prometheus(self):
+        m = Metrics(buckets=(0.1, 1.0))
+        m.command_started("status")
+        m.command_finished("status", 0.5, ValueError())
+        m.sent(10)
+
+        text = m.to_prometheus()
+        self.assertIn('clearskies_client_command_seconds_bucket{command="status",le="0.1"} 0\n', text)
+        self.assertIn('clearskies_client_command_seconds_bucket{command="status",le="1.0"} 1\n', text)
+        self.assertIn('clearskies_client_command_seconds_bucket{command="status",le="+Inf"} 1\n', text)
+        self.assertIn('clearskies_client_command_seconds_count{command="status"} 1\n', text)
+        self.assertIn('clearskies_client_command_errors_total{command="status"} 1\n', text)
+        self.assertIn('clearskies_client_decode_seconds_bucket{le="+Inf"} 0\n', text)
+        self.assertIn('clearskies_client_decode_seconds_count 0\n', text)
+        self.assertIn("clearskies_client_sent_bytes_total 10\n", text)
+        self.assertIn("# TYPE clearskies_client_in_flight gauge\n", text)
@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+import socket
+import tempfile
+import threading
+import shutil
+import random
+import time
+import os
+import unittest
+
+from clearskies.exc import TransportException, TimeoutException
+from clearskies.fakedaemon import FakeDaemon
+from clearskies.mux import MultiplexedClearSkies
+
+
+class TestMultiplexed(unittest.TestCase):
+    def test_out_of_order(self):
+        # replies overtake each other, but each caller gets its own
+        rand = random.Random(1)
+        with FakeDaemon(features=["request_ids"], latency=lambda: rand.random() / 100) as daemon:
+            with MultiplexedClearSkies(daemon.control_path) as cs:
+                self.assertTrue(cs.tagged)
+                paths = ["/home/foo/%03d" % n for n in range(200)]
+                with ThreadPoolExecutor(32) as pool:
+                    results = list(pool.map(cs.create_share, paths))
+                    codes = list(pool.map(lambda p: cs.create_access_code(p, "read_only"), paths))
+                self.assertEqual(results, [{}] * 200)
+                for path, code in zip(paths, codes):
+                    self.assertEqual(daemon.access_codes[code], (path, "read_only"))
+                self.assertEqual(daemon.connections, 1)
+
+    def test_in_order(self):
+        with FakeDaemon(latency=0.001, shares=3) as daemon:
+            with MultiplexedClearSkies(daemon.control_path) as cs:
+                self.assertFalse(cs.tagged)
+                with ThreadPoolExecutor(8) as pool:
+                    replies = list(pool.map(lambda n: cs.status(), range(100)))
+                self.assertEqual(replies, [{"status": "ok"}] * 100)
+                self.assertEqual(len(cs.list_shares()), 3)
+
+    def test_unencodable(self):
+        for features in ([], ["request_ids"]):
+            with FakeDaemon(features=features) as daemon:
+                with MultiplexedClearSkies(daemon.control_path) as cs:
+                    self.assertRaises(TypeError, cs.create_share, object())
+                    # nothing was sent, so nobody is left waiting for a reply
+                    self.assertEqual(len(cs.in_order), 0)
+                    self.assertEqual(cs.waiting, {})
+                    self.assertEqual(cs.status(timeout=1), {"status": "ok"})
+                    self.assertEqual(cs.create_share("/home/foo", timeout=1), {})
+
+    def test_timeout(self):
+        latencies = [0.5, 0]
+        with FakeDaemon(features=["request_ids"], latency=lambda: latencies.pop(0)) as daemon:
+            with MultiplexedClearSkies(daemon.control_path) as cs:
+                self.assertRaises(TimeoutException, cs.status, timeout=0.05)
+                # the connection is still fine, and the late reply is dropped
+                self.assertEqual(cs.status(timeout=1), {"status": "ok"})
+                self.assertEqual(cs.waiting, {})
+                self.assertEqual(daemon.total_connections, 1)
+
+    def test_events(self):
+        with FakeDaemon(features=["request_ids"]) as daemon:
+            with MultiplexedClearSkies(daemon.control_path) as cs:
+                cs.status()
+
+                async def push():
+                    for writer in daemon.writers:
+                        writer.write(daemon.encode({"event": "share_changed"}))
+                daemon.call(lambda: daemon.loop.create_task(push()))
+                self.assertEqual(cs.events.get(timeout=1), {"event": "share_changed"})
+                self.assertEqual(cs.status(), {"status": "ok"})
+
+    def test_hang_up(self):
+        with FakeDaemon(features=["request_ids"], latency=0.05) as daemon:
+            with MultiplexedClearSkies(daemon.control_path) as cs:
+                daemon.fail_next()
+                with ThreadPoolExecutor(4) as pool:
+                    futures = [pool.submit(cs.status) for n in range(4)]
+                    errors = [f.exception() for f in futures]
+                # everyone in flight hears about it...
+                self.assertTrue(any(isinstance(e, TransportException) for e in errors))
+                # ...and the next command reconnects
+                self.assertEqual(cs.status(), {"status": "ok"})
+                self.assertEqual(daemon.total_connections, 2)
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs unix sockets")
+class TestMultiplexedTimeouts(unittest.TestCase):
+    def setUp(self):
+        # a daemon which accepts connections, but never says anything
+        self.tmpdir = tempfile.mkdtemp()
+        self.control_path = os.path.join(self.tmpdir, "control")
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.control_path)
+        self.server.listen(5)
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_handshake_timeout(self):
+        cs = MultiplexedClearSkies(self.control_path, timeout=0.2)
+        started = time.monotonic()
+        with ThreadPoolExecutor(4) as pool:
+            # one thread waits for the handshake, the others for their turn
+            futures = [pool.submit(cs.status) for n in range(4)]
+            errors = [f.exception() for f in futures]
+        self.assertTrue(all(isinstance(e, TimeoutException) for e in errors), errors)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertFalse(cs.connected)
+
+    def test_connect_timeout(self):
+        cs = MultiplexedClearSkies(self.control_path)
+        self.assertRaises(TimeoutException, cs.connect, timeout=0.05)
+
+    def test_send_timeout(self):
+        # the daemon says hello, then stops reading, so the socket fills up
+        conns = []
+
+        def accept():
+            conn, _ = self.server.accept()
+            conn.sendall(b'{"protocol": 1, "service": "ClearSkies Control", "software": "test"}\n')
+            conns.append(conn)
+        t = threading.Thread(target=accept)
+        t.start()
+
+        cs = MultiplexedClearSkies(self.control_path)
+        cs.connect(timeout=1)
+        t.join()
+        try:
+            self.assertRaises(TimeoutException, cs.create_share, "x" * (16 * 1024 * 1024), timeout=0.2)
+            # half a command has gone, so the connection is dropped
+            cs.reader.join(1)
+            self.assertFalse(cs.connected)
+            self.assertEqual(len(cs.in_order), 0)
+        finally:
+            cs.close()
+            conns[0].close()
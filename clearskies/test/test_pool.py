@@ -0,0 +1,190 @@
+import threading
+import unittest
+
+from clearskies.pool import ClearSkiesPool
+from clearskies.exc import ProtocolException, TransportException, TimeoutException
+
+
+HANDSHAKE = {"protocol": 1, "service": "ClearSkies Control", "software": "test"}
+
+
+class FakeTransport(object):
+    """
+    Stand-in transport which replies to each command with {"n": <number
+    of commands this transport has seen>}
+    """
+    def __init__(self, control_path):
+        self.control_path = control_path
+        self.sent = []
+        self.is_alive = True
+        self.closed = False
+        self.fail = None
+
+    def connect(self, deadline=None):
+        self.replies = [HANDSHAKE]
+
+    def send(self, js, deadline=None):
+        if self.fail:
+            raise self.fail
+        self.sent.append(js)
+        self.replies.append({"n": len(self.sent)})
+
+    def send_many(self, jss, deadline=None):
+        for js in jss:
+            self.send(js)
+
+    def recv(self, deadline=None):
+        if deadline is not None and not self.replies:
+            raise TimeoutException("Timed out waiting for the daemon")
+        return self.replies.pop(0)
+
+    def alive(self):
+        return self.is_alive
+
+    def close(self):
+        self.closed = True
+
+
+class TestClearSkiesPool(unittest.TestCase):
+    def setUp(self):
+        self.transports = []
+
+        def factory(control_path):
+            t = FakeTransport(control_path)
+            self.transports.append(t)
+            return t
+        self.factory = factory
+
+    def test_reuse(self):
+        pool = ClearSkiesPool("foo.sock", transport_factory=self.factory)
+        self.assertEqual(pool.status(), {"n": 1})
+        self.assertEqual(pool.status(), {"n": 2})
+        self.assertEqual(len(self.transports), 1)
+        self.assertEqual(self.transports[0].control_path, "foo.sock")
+
+    def test_max_size(self):
+        pool = ClearSkiesPool("foo.sock", max_size=2, transport_factory=self.factory)
+        a, reused = pool.acquire()
+        b, reused = pool.acquire()
+        self.assertRaises(TransportException, pool.acquire, 0.01)
+
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.acquire(5)))
+        waiter.start()
+        pool.release(a)
+        waiter.join()
+        self.assertEqual(got, [(a, True)])
+        self.assertEqual(len(self.transports), 2)
+
+    def test_broken(self):
+        pool = ClearSkiesPool("foo.sock", max_size=1, transport_factory=self.factory)
+        a, reused = pool.acquire()
+        pool.release(a, broken=True)
+        self.assertTrue(a.closed)
+        b, reused = pool.acquire()
+        self.assertIsNot(a, b)
+        self.assertFalse(reused)
+
+    def test_health_check(self):
+        pool = ClearSkiesPool("foo.sock", transport_factory=self.factory)
+        pool.status()
+        self.transports[0].is_alive = False
+        self.assertEqual(pool.status(), {"n": 1})
+        self.assertTrue(self.transports[0].closed)
+        self.assertEqual(len(self.transports), 2)
+
+    def test_idle_eviction(self):
+        pool = ClearSkiesPool("foo.sock", idle_timeout=-1, transport_factory=self.factory)
+        pool.status()
+        self.assertTrue(self.transports[0].closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_reconnect(self):
+        pool = ClearSkiesPool("foo.sock", transport_factory=self.factory)
+        pool.status()
+        self.transports[0].fail = TransportException("Connection closed by daemon")
+        self.assertEqual(pool.status(), {"n": 1})
+        self.assertEqual(len(self.transports), 2)
+
+    def test_reconnect__not_replay_safe(self):
+        pool = ClearSkiesPool("foo.sock", transport_factory=self.factory)
+        pool.status()
+        self.transports[0].fail = TransportException("Connection closed by daemon")
+        self.assertRaises(TransportException, pool.create_share, "/home/foo/Shared")
+        self.assertEqual(len(self.transports), 1)
+        self.assertEqual(pool.size, 0)
+
+    def test_error__fresh_connection(self):
+        def factory(control_path):
+            t = FakeTransport(control_path)
+            t.fail = TransportException("Connection closed by daemon")
+            return t
+
+        pool = ClearSkiesPool("foo.sock", transport_factory=factory)
+        self.assertRaises(TransportException, pool.status)
+        self.assertEqual(pool.size, 0)
+
+    def test_error__unexpected(self):
+        pool = ClearSkiesPool("foo.sock", max_size=1, transport_factory=self.factory)
+        pool.status()
+        self.transports[0].fail = TypeError("Type is not JSON serializable")
+        self.assertRaises(TypeError, pool.status)
+        # the connection isn't trusted again, and its slot is given back
+        self.assertTrue(self.transports[0].closed)
+        self.assertEqual(pool.size, 0)
+        self.assertEqual(pool.status(timeout=0.1), {"n": 1})
+
+    def test_bad_handshake(self):
+        def factory(control_path):
+            t = FakeTransport(control_path)
+            t.connect = lambda deadline: setattr(t, "replies", [{"protocol": 2}])
+            return t
+
+        pool = ClearSkiesPool("foo.sock", transport_factory=factory)
+        self.assertRaises(ProtocolException, pool.status)
+        self.assertEqual(pool.size, 0)
+
+    def test_timeout(self):
+        pool = ClearSkiesPool("foo.sock", transport_factory=self.factory)
+        pool.status()
+        self.transports[0].send = lambda js, deadline: None  # the daemon never replies
+        self.assertRaises(TimeoutException, pool.status, timeout=0.01)
+        # a connection which timed out may still get a reply, so isn't reused
+        self.assertTrue(self.transports[0].closed)
+        self.assertEqual(len(self.transports), 1)
+        self.assertEqual(pool.size, 0)
+
+    def test_pipeline(self):
+        pool = ClearSkiesPool("foo.sock", transport_factory=self.factory)
+        with pool.pipeline() as p:
+            a = p.pause()
+            b = p.resume()
+        self.assertEqual((a.result(), b.result()), ({"n": 1}, {"n": 2}))
+        self.assertEqual(pool.idle[0][0], self.transports[0])
+
+    def test_close(self):
+        pool = ClearSkiesPool("foo.sock", transport_factory=self.factory)
+        pool.status()
+        pool.close()
+        self.assertTrue(self.transports[0].closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_threads(self):
+        pool = ClearSkiesPool("foo.sock", max_size=4, transport_factory=self.factory)
+        errors = []
+
+        def worker():
+            try:
+                for n in range(100):
+                    pool.status()
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+        threads = [threading.Thread(target=worker) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(self.transports), 4)
+        self.assertEqual(sum(len(t.sent) for t in self.transports), 800)
@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+import tempfile
+import shutil
+import os
+
+from clearskies import scan
+from clearskies.scan import ScanResult
+from clearskies.share import Share
+
+
+class TestScan(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_share(self, name, files):
+        path = os.path.join(self.tmpdir, name)
+        for filename, size in files.items():
+            filename = os.path.join(path, filename)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, "wb") as f:
+                f.write(b"x" * size)
+        return path
+
+    def test_scan_path(self):
+        path = self.make_share("A", {"a": 10, "b/c": 20, "b/d/e": 30})
+        os.symlink("/", os.path.join(path, "root"))
+        self.assertEqual(scan.scan_path(path), ScanResult(path, None, True, 4, 2, 60 + len("/"), None))
+
+    def test_scan_path__empty(self):
+        path = os.path.join(self.tmpdir, "A")
+        os.mkdir(path)
+        self.assertEqual(scan.scan_path(path), ScanResult(path, None, True, 0, 0, 0, None))
+
+    def test_scan_path__missing(self):
+        path = os.path.join(self.tmpdir, "nope")
+        self.assertEqual(scan.scan_path(path), ScanResult(path, None, False, 0, 0, 0, None))
+
+    @unittest.skipIf(hasattr(os, "geteuid") and os.geteuid() == 0, "root can read anything")
+    def test_scan_path__unreadable(self):
+        path = self.make_share("A", {"a": 10, "b/c": 20})
+        os.chmod(os.path.join(path, "b"), 0)
+        try:
+            result = scan.scan_path(path)
+        finally:
+            os.chmod(os.path.join(path, "b"), 0o755)
+        self.assertEqual(result[:6], (path, None, True, 1, 1, 10))
+        self.assertIn("Permission denied", result.error)
+
+    def test_scan_shares(self):
+        shares = [Share(self.make_share("%02d" % n, {"f": n}), "synced") for n in range(20)]
+        shares.append({"path": os.path.join(self.tmpdir, "nope"), "status": "unknown"})
+
+        results = list(scan.scan_shares(shares, workers=2, chunksize=3))
+        self.assertEqual(sorted(results), sorted(
+            [ScanResult(share.path, "synced", True, 1, 0, n, None) for n, share in enumerate(shares[:20])] +
+            [ScanResult(os.path.join(self.tmpdir, "nope"), "unknown", False, 0, 0, 0, None)]
+        ))
+
+    def test_scan_shares__executor(self):
+        shares = [Share(self.make_share("%02d" % n, {"f": 1}), "synced") for n in range(5)]
+        with ThreadPoolExecutor(2) as executor:
+            results = scan.scan_shares(shares, executor=executor, chunksize=1)
+            self.assertEqual(next(results).status, "synced")
+            results.close()
+            # the executor is left for its owner to shut down
+            self.assertEqual(executor.submit(len, "abc").result(), 3)
@@ -0,0 +1,121 @@
+import unittest
+
+from clearskies.share import Share, ShareTable, ShareIndex, ShareDelta
+
+
+class TestShare(unittest.TestCase):
+    def test_from_json(self):
+        s = Share.from_json({"path": "/home/foo/Shared", "status": "N/A"})
+        self.assertEqual(s.path, "/home/foo/Shared")
+        self.assertEqual(s.status, "N/A")
+        self.assertIsNone(s.extra)
+        self.assertFalse(hasattr(s, "__dict__"))
+
+    def test_from_json__extra(self):
+        js = {"path": "/home/foo/Shared", "status": "N/A", "peers": 3}
+        s = Share.from_json(js)
+        self.assertEqual(s.extra, {"peers": 3})
+        self.assertEqual(s["peers"], 3)
+        self.assertEqual(s.to_json(), js)
+
+    def test_getitem(self):
+        s = Share("/home/foo/Shared", "N/A")
+        self.assertEqual(s["path"], "/home/foo/Shared")
+        self.assertEqual(s["status"], "N/A")
+        self.assertRaises(KeyError, lambda: s["peers"])
+
+    def test_eq(self):
+        self.assertEqual(Share("/a", "N/A"), Share("/a", "N/A"))
+        self.assertNotEqual(Share("/a", "N/A"), Share("/a", "syncing"))
+        self.assertNotEqual(Share("/a", "N/A"), {"path": "/a", "status": "N/A"})
+        self.assertEqual(len(set([Share("/a", "N/A"), Share("/a", "N/A")])), 1)
+
+    def test_repr(self):
+        self.assertEqual(repr(Share("/a", "N/A")), "Share('/a', 'N/A')")
+
+
+class TestShareTable(unittest.TestCase):
+    def setUp(self):
+        self.table = ShareTable([
+            {"path": "/home/foo/Shared", "status": "N/A"},
+            Share("/home/foo/Pictures", "syncing"),
+            {"path": "", "status": "N/A"},
+            {"path": "/home/foo/Music", "status": "N/A"},
+        ])
+
+    def test_access(self):
+        self.assertEqual(len(self.table), 4)
+        self.assertEqual(self.table.path(1), "/home/foo/Pictures")
+        self.assertEqual(self.table.status(1), "syncing")
+        self.assertEqual(self.table[2], Share("", "N/A"))
+        self.assertEqual(self.table[-1], Share("/home/foo/Music", "N/A"))
+        self.assertRaises(IndexError, lambda: self.table[4])
+
+    def test_iter(self):
+        self.assertEqual(
+            list(self.table.paths()),
+            ["/home/foo/Shared", "/home/foo/Pictures", "", "/home/foo/Music"],
+        )
+        self.assertEqual(list(self.table)[1], Share("/home/foo/Pictures", "syncing"))
+
+    def test_with_status(self):
+        self.assertEqual(list(self.table.with_status("syncing")), [Share("/home/foo/Pictures", "syncing")])
+        self.assertEqual(list(self.table.with_status("missing")), [])
+
+    def test_count_by_status(self):
+        self.assertEqual(self.table.count_by_status(), {"N/A": 3, "syncing": 1})
+
+    def test_empty(self):
+        self.assertEqual(len(ShareTable()), 0)
+        self.assertEqual(list(ShareTable()), [])
+
+
+class TestShareIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = ShareIndex([
+            {"path": "/a", "status": "N/A"},
+            {"path": "/b", "status": "N/A"},
+            {"path": "/c", "status": "syncing"},
+        ])
+
+    def test_lookup(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertIn("/a", self.index)
+        self.assertEqual(self.index.get("/c"), Share("/c", "syncing"))
+        self.assertIsNone(self.index.get("/d"))
+        self.assertEqual(self.index.with_status("N/A"), frozenset(["/a", "/b"]))
+        self.assertEqual(self.index.with_status("missing"), frozenset())
+        self.assertEqual(self.index.count_by_status(), {"N/A": 2, "syncing": 1})
+        self.assertEqual(sorted(s.path for s in self.index), ["/a", "/b", "/c"])
+
+    def test_apply__unchanged(self):
+        a = self.index.get("/a")
+        delta = self.index.apply([Share("/a", "N/A"), Share("/b", "N/A"), Share("/c", "syncing")])
+        self.assertEqual(delta, ShareDelta([], [], []))
+        self.assertIs(self.index.get("/a"), a)
+
+    def test_apply(self):
+        delta = self.index.apply(iter([
+            {"path": "/b", "status": "syncing"},
+            {"path": "/c", "status": "syncing"},
+            {"path": "/d", "status": "N/A"},
+        ]))
+        self.assertEqual(delta.added, [Share("/d", "N/A")])
+        self.assertEqual(delta.removed, [Share("/a", "N/A")])
+        self.assertEqual(delta.changed, [(Share("/b", "N/A"), Share("/b", "syncing"))])
+        self.assertEqual(self.index.with_status("N/A"), frozenset(["/d"]))
+        self.assertEqual(self.index.with_status("syncing"), frozenset(["/b", "/c"]))
+
+    def test_apply__table(self):
+        delta = self.index.apply(ShareTable([{"path": "/a", "status": "N/A"}]))
+        self.assertEqual(sorted(s.path for s in delta.removed), ["/b", "/c"])
+        self.assertEqual(self.index.count_by_status(), {"N/A": 1})
+
+    def test_update_discard(self):
+        self.assertEqual(self.index.update(Share("/a", "syncing")), Share("/a", "N/A"))
+        self.assertIsNone(self.index.update(Share("/d", "N/A")))
+        self.assertEqual(self.index.with_status("syncing"), frozenset(["/a", "/c"]))
+
+        self.assertEqual(self.index.discard("/c"), Share("/c", "syncing"))
+        self.assertIsNone(self.index.discard("/c"))
+        self.assertEqual(self.index.with_status("syncing"), frozenset(["/a"]))
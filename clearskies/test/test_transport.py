@@ -1,15 +1,31 @@
 from mock import patch, Mock
 import unittest
 import socket as _socket
+import struct
+import os
+import json
+import time
 
-from clearskies.exc import TransportException
-from clearskies.transport import Transport, UnixJsonTransport, WindowsJsonTransport
+from clearskies.exc import TransportException, TimeoutException
+from clearskies.codec import StdlibJsonCodec
+from clearskies.metrics import Metrics
+from clearskies.transport import Transport, UnixJsonTransport, WindowsJsonTransport, IOV_MAX
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 class TestTransport(unittest.TestCase):
     def test_init(self):
         Transport("foo.sock")
 
+    def test_codec(self):
+        codec = StdlibJsonCodec()
+        self.assertIs(Transport("foo.sock", codec).codec, codec)
+        self.assertIsNotNone(Transport("foo.sock").codec)
+
     def test_connect(self):
         s = Transport("foo.sock")
         self.assertRaises(NotImplementedError, s.connect)
@@ -18,6 +34,10 @@ class TestTransport(unittest.TestCase):
         s = Transport("foo.sock")
         self.assertRaises(NotImplementedError, s.send, {})
 
+    def test_send_many(self):
+        s = Transport("foo.sock")
+        self.assertRaises(NotImplementedError, s.send_many, [{}])
+
     def test_recv(self):
         s = Transport("foo.sock")
         self.assertRaises(NotImplementedError, s.recv)
@@ -26,13 +46,50 @@ class TestTransport(unittest.TestCase):
         s = Transport("foo.sock")
         self.assertRaises(NotImplementedError, s.close)
 
+    def test_alive(self):
+        s = Transport("foo.sock")
+        self.assertTrue(s.alive())
+
+    def test_read_into(self):
+        s = Transport("foo.sock")
+        self.assertRaises(TransportException, s.recv_chunks().__next__)
+
+
+def recv_into(*chunks):
+    """
+    Make a mock socket's recv_into() deliver each of chunks in turn
+    """
+    chunks = list(chunks)
+
+    def recv_into(view):
+        chunk = chunks.pop(0)
+        if len(chunk) > len(view):
+            chunks.insert(0, chunk[len(view):])
+            chunk = chunk[:len(view)]
+        view[:len(chunk)] = chunk
+        return len(chunk)
+    return recv_into
+
+
+def sendmsg(calls, limit=None):
+    """
+    Make a mock socket's sendmsg() append the buffers it's given to
+    `calls`, and accept at most `limit` bytes of them
+    """
+    def sendmsg(buffers):
+        buffers = [bytes(b) for b in buffers]
+        calls.append(buffers)
+        return min(sum(len(b) for b in buffers), limit or float("inf"))
+    return sendmsg
+
 
 @patch("socket.socket")
 class TestUnixJsonTransport(unittest.TestCase):
     def setUp(self):
         # This constant isn't defined at all under windows
         import socket
-        socket.AF_UNIX = 0
+        if not hasattr(socket, "AF_UNIX"):
+            socket.AF_UNIX = 0
 
     def test_init(self, socket):
         UnixJsonTransport("foo.sock")
@@ -49,44 +106,225 @@ class TestUnixJsonTransport(unittest.TestCase):
         socket().connect.side_effect = _socket.error(2)
         self.assertRaises(TransportException, s.connect)
 
-    def test_send(self, socket):
+    def test_connect__json(self, socket):
+        # every new connection starts off as JSON lines
         s = UnixJsonTransport("foo.sock")
+        s.binary = Mock()
         s.connect()
+        self.assertIsNone(s.binary)
+
+    def test_send(self, socket):
+        s = UnixJsonTransport("foo.sock", StdlibJsonCodec())
+        s.connect()
+        calls = []
+        socket().sendmsg.side_effect = sendmsg(calls)
         s.send({"foo": "bar"})
 
-        socket().send.assert_called_with('{"foo": "bar"}\n'.encode("utf8"))
+        self.assertEqual(calls, [['{"foo": "bar"}\n'.encode("utf8")]])
+
+    def test_send__partial(self, socket):
+        s = UnixJsonTransport("foo.sock", StdlibJsonCodec())
+        s.connect()
+        calls = []
+        socket().sendmsg.side_effect = sendmsg(calls, limit=10)
+        s.send_many([{"foo": "bar"}, {"foo": "baz"}])
+
+        # each write carries on from wherever the last one stopped
+        self.assertEqual(calls, [
+            [b'{"foo": "bar"}\n', b'{"foo": "baz"}\n'],
+            [b'ar"}\n', b'{"foo": "baz"}\n'],
+            [b'": "baz"}\n'],
+        ])
+
+    def test_send_many(self, socket):
+        s = UnixJsonTransport("foo.sock", StdlibJsonCodec())
+        s.connect()
+        calls = []
+        socket().sendmsg.side_effect = sendmsg(calls)
+        s.send_many([{"foo": "bar"}, {"foo": "baz"}])
+
+        self.assertEqual(calls, [[b'{"foo": "bar"}\n', b'{"foo": "baz"}\n']])
+
+    def test_queue(self, socket):
+        s = UnixJsonTransport("foo.sock", StdlibJsonCodec())
+        s.connect()
+        calls = []
+        socket().sendmsg.side_effect = sendmsg(calls)
+        s.queue({"foo": "bar"})
+        s.queue({"foo": "baz"})
+        self.assertEqual(calls, [])
+
+        s.flush()
+        self.assertEqual(calls, [[b'{"foo": "bar"}\n', b'{"foo": "baz"}\n']])
+        # nothing queued, nothing to write
+        s.flush()
+        self.assertEqual(len(calls), 1)
+
+    def test_queue__many(self, socket):
+        s = UnixJsonTransport("foo.sock", StdlibJsonCodec())
+        s.connect()
+        calls = []
+        socket().sendmsg.side_effect = sendmsg(calls)
+        s.send_many([{"n": n} for n in range(IOV_MAX + 1)])
+        self.assertEqual([len(c) for c in calls], [IOV_MAX, 1])
+
+    def test_queue__reconnect(self, socket):
+        s = UnixJsonTransport("foo.sock", StdlibJsonCodec())
+        s.connect()
+        s.queue({"foo": "bar"})
+        s.connect()
+        self.assertEqual(s.pending, [])
+
+    def test_send_many__unencodable(self, socket):
+        s = UnixJsonTransport("foo.sock", StdlibJsonCodec())
+        s.connect()
+        calls = []
+        socket().sendmsg.side_effect = sendmsg(calls)
+        self.assertRaises(TypeError, s.send_many, [{"foo": "bar"}, {"foo": object()}])
+        # nothing from the failed batch is left to go out with the next one
+        self.assertEqual(s.pending, [])
+        s.send({"foo": "baz"})
+        self.assertEqual(calls, [[b'{"foo": "baz"}\n']])
+
+    def test_connect__nonblocking(self, socket):
+        s = UnixJsonTransport("foo.sock")
+        s.connect()
+
+        socket().setblocking.assert_called_with(False)
 
     def test_send__error(self, socket):
         s = UnixJsonTransport("foo.sock")
         s.connect()
 
-        socket().send.side_effect = _socket.error(2)
+        socket().sendmsg.side_effect = _socket.error(2)
         self.assertRaises(TransportException, s.send, {"foo": "bar"})
 
     def test_recv(self, socket):
         s = UnixJsonTransport("foo.sock")
         s.connect()
 
-        socket().recv.return_value = '{"foo": "bar"}'.encode("utf8")
+        socket().recv_into.side_effect = recv_into('{"foo": "bar"}\n'.encode("utf8"))
         self.assertDictEqual(
             s.recv(),
             {"foo": "bar"}
         )
 
+    def test_recv__fragmented(self, socket):
+        s = UnixJsonTransport("foo.sock")
+        s.connect()
+
+        shares = [{"path": "/home/foo/Shared%d" % n, "status": "N/A"} for n in range(1000)]
+        data = (json.dumps({"shares": shares}) + "\n").encode("utf8")
+        socket().recv_into.side_effect = recv_into(*[data[n:n + 1000] for n in range(0, len(data), 1000)])
+        self.assertDictEqual(
+            s.recv(),
+            {"shares": shares}
+        )
+
+    def test_recv__buffer_management(self, socket):
+        s = UnixJsonTransport("foo.sock", StdlibJsonCodec())
+        s.read_size = 32
+        s.min_read = 8
+        s.max_idle_buffer = 64
+        s.connect()
+        self.assertEqual(len(s.buffer), 32)
+
+        # a frame bigger than the buffer makes it grow...
+        big = ('{"foo": "%s"}\n' % ("x" * 100)).encode("utf8")
+        small = b'{"a": 1}\n{"b": 2}\n{"c"'
+        socket().recv_into.side_effect = recv_into(big[:20], big[20:60], big[60:], small, b': 3}\n')
+        self.assertDictEqual(s.recv(), {"foo": "x" * 100})
+        # ... and shrink back once it's empty again
+        self.assertEqual(len(s.buffer), 32)
+
+        # while small frames get moved to the front to make room
+        self.assertDictEqual(s.recv(), {"a": 1})
+        self.assertDictEqual(s.recv(), {"b": 2})
+        self.assertDictEqual(s.recv(), {"c": 3})
+        self.assertEqual(len(s.buffer), 32)
+        self.assertEqual((s.start, s.end), (0, 0))
+
+    def test_recv__coalesced(self, socket):
+        s = UnixJsonTransport("foo.sock")
+        s.connect()
+
+        socket().recv_into.side_effect = recv_into(
+            '{"foo": "bar"}\n{"fo'.encode("utf8"),
+            'o": "baz"}\n'.encode("utf8"),
+        )
+        self.assertDictEqual(s.recv(), {"foo": "bar"})
+        self.assertDictEqual(s.recv(), {"foo": "baz"})
+
+    def test_recv__closed(self, socket):
+        s = UnixJsonTransport("foo.sock")
+        s.connect()
+
+        socket().recv_into.side_effect = recv_into('{"foo": '.encode("utf8"), b"")
+        self.assertRaises(TransportException, s.recv)
+
+    def test_recv_chunks(self, socket):
+        s = UnixJsonTransport("foo.sock")
+        s.connect()
+
+        socket().recv_into.side_effect = recv_into(
+            b'\n{"foo": ',
+            b'"bar"}\n{"foo"',
+            b': "baz"}\n',
+        )
+        self.assertEqual(list(s.recv_chunks()), [b'{"foo": ', b'"bar"}'])
+        self.assertDictEqual(s.recv(), {"foo": "baz"})
+
+    def test_recv_chunks__closed(self, socket):
+        s = UnixJsonTransport("foo.sock")
+        s.connect()
+
+        socket().recv_into.side_effect = recv_into(b'{"foo": ', b"")
+        self.assertRaises(TransportException, list, s.recv_chunks())
+
+        socket().recv_into.side_effect = _socket.error(2)
+        self.assertRaises(TransportException, list, s.recv_chunks())
+
+    def test_metrics(self, socket):
+        s = UnixJsonTransport("foo.sock", StdlibJsonCodec())
+        s.metrics = Metrics()
+        s.connect()
+
+        socket().recv_into.side_effect = recv_into('{"foo": "bar"}\n'.encode("utf8"))
+        socket().sendmsg.side_effect = sendmsg([])
+        s.send({"foo": "bar"})
+        s.send_many([{"foo": "bar"}, {"foo": "bar"}])
+        s.recv()
+        self.assertEqual(s.metrics.bytes_sent, 45)
+        self.assertEqual(s.metrics.writes, 2)
+        self.assertEqual(s.metrics.bytes_received, 15)
+        self.assertEqual(s.metrics.decode_time.count, 1)
+
     def test_recv__error(self, socket):
         s = UnixJsonTransport("foo.sock")
         s.connect()
 
-        socket().recv.side_effect = _socket.error(2)
+        socket().recv_into.side_effect = _socket.error(2)
         self.assertRaises(TransportException, s.recv)
 
     def test_recv__not_json(self, socket):
         s = UnixJsonTransport("foo.sock")
         s.connect()
 
-        socket().recv.return_value = 'somethingblah'.encode("utf8")
+        socket().recv_into.side_effect = recv_into('somethingblah\n'.encode("utf8"))
         self.assertRaises(TransportException, s.recv)
 
+    @patch("selectors.DefaultSelector")
+    def test_alive(self, DefaultSelector, socket):
+        s = UnixJsonTransport("foo.sock")
+        self.assertFalse(s.alive())
+
+        s.connect()
+        DefaultSelector().select.return_value = []
+        self.assertTrue(s.alive())
+
+        DefaultSelector().select.return_value = [(Mock(), 1)]
+        self.assertFalse(s.alive())
+
     def test_close(self, socket):
         s = UnixJsonTransport("foo.sock")
         s.connect()
@@ -94,6 +332,14 @@ class TestUnixJsonTransport(unittest.TestCase):
         s.close()
         socket().close.assert_called_with()
 
+    def test_interrupt(self, socket):
+        s = UnixJsonTransport("foo.sock")
+        s.connect()
+
+        s.interrupt()
+        socket().shutdown.assert_called_with(_socket.SHUT_RDWR)
+        self.assertFalse(socket().close.called)
+
     def test_close__error(self, socket):
         s = UnixJsonTransport("foo.sock")
         s.connect()
@@ -102,6 +348,100 @@ class TestUnixJsonTransport(unittest.TestCase):
         self.assertRaises(TransportException, s.close)
 
 
+@unittest.skipUnless(hasattr(_socket, "AF_UNIX"), "needs unix sockets")
+class TestUnixJsonTransportDeadlines(unittest.TestCase):
+    """
+    Deadlines with a real (non-blocking) socket at the other end
+    """
+    def setUp(self):
+        self.daemon, client = _socket.socketpair()
+        client.setblocking(False)
+        self.s = UnixJsonTransport("foo.sock", StdlibJsonCodec())
+        self.s.socket = client
+
+    def tearDown(self):
+        self.s.close()
+        self.daemon.close()
+
+    def test_recv(self):
+        self.daemon.sendall(b'{"foo": "bar"}\n')
+        self.assertEqual(self.s.recv(time.monotonic() + 5), {"foo": "bar"})
+
+    def test_recv__timeout(self):
+        self.daemon.sendall(b'{"foo": ')
+        started = time.monotonic()
+        self.assertRaises(TimeoutException, self.s.recv, started + 0.05)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_recv__expired(self):
+        self.assertRaises(TimeoutException, self.s.recv, time.monotonic() - 1)
+
+    def test_alive(self):
+        self.assertTrue(self.s.alive())
+        self.daemon.close()
+        self.assertFalse(self.s.alive())
+
+    @unittest.skipUnless(resource and resource.getrlimit(resource.RLIMIT_NOFILE)[0] > 1500, "needs lots of fds")
+    def test_alive__high_fd(self):
+        # processes with lots of files open have fds too big for select()
+        os.dup2(self.s.socket.fileno(), 1500)
+        self.s.socket.close()
+        self.s.socket = _socket.socket(fileno=1500)
+        self.assertTrue(self.s.alive())
+        self.daemon.sendall(b"{}\n")
+        self.assertFalse(self.s.alive())
+
+    def test_send__timeout(self):
+        # nobody is reading, so the socket buffer fills up
+        data = {"data": "x" * (16 * 1024 * 1024)}
+        self.assertRaises(TimeoutException, self.s.send, data, time.monotonic() + 0.05)
+
+
+class BinaryJsonCodec(StdlibJsonCodec):
+    """
+    JSON, but framed like a binary codec, so that framing can be tested
+    without msgpack or cbor2 installed
+    """
+    name = "binaryjson"
+    binary = True
+
+
+@unittest.skipUnless(hasattr(_socket, "AF_UNIX"), "needs unix sockets")
+class TestUnixJsonTransportBinary(unittest.TestCase):
+    def setUp(self):
+        self.daemon, client = _socket.socketpair()
+        self.s = UnixJsonTransport("foo.sock", StdlibJsonCodec())
+        self.s.socket = client
+        self.s.binary = BinaryJsonCodec()
+
+    def tearDown(self):
+        self.s.close()
+        self.daemon.close()
+
+    def frame(self, data):
+        return struct.pack(">I", len(data)) + data
+
+    def test_send(self):
+        self.s.send_many([{"foo": "bar"}, {"foo": "baz\n"}])
+        self.assertEqual(
+            self.daemon.recv(1024),
+            self.frame(b'{"foo": "bar"}') + self.frame(b'{"foo": "baz\\n"}'),
+        )
+
+    def test_recv(self):
+        # newlines mean nothing, and messages may arrive in any size of piece
+        data = self.frame(b'{"foo": "bar"}') + self.frame(b'\n{}') + self.frame(b'{"big": "%s"}' % (b"x" * 200000))
+        self.daemon.sendall(data[:2])
+        self.daemon.sendall(data[2:])
+        self.assertEqual(self.s.recv(), {"foo": "bar"})
+        self.assertEqual(self.s.recv(), {})
+        self.assertEqual(self.s.recv(), {"big": "x" * 200000})
+
+    def test_recv__not_binary(self):
+        self.daemon.sendall(self.frame(b"blah"))
+        self.assertRaises(TransportException, self.s.recv)
+
+
 @patch("clearskies.transport.win32file", None)
 class TestWindowsJsonTransportImportError(unittest.TestCase):
     def test_init(self):
@@ -137,13 +477,32 @@ class TestWindowsJsonTransport(unittest.TestCase):
         self.assertRaises(TransportException, s.connect)
 
     def test_send(self, win32file):
-        s = WindowsJsonTransport("foo.sock")
+        s = WindowsJsonTransport("foo.sock", StdlibJsonCodec())
         s.connect()
         win32file.WriteFile.return_value = (0, 16)
         s.send({"foo": "bar"})
 
         win32file.WriteFile.assert_called_with(s.socket, '{"foo": "bar"}\n'.encode("utf8"))
 
+    def test_send_many(self, win32file):
+        s = WindowsJsonTransport("foo.sock", StdlibJsonCodec())
+        s.connect()
+        win32file.WriteFile.return_value = (0, 32)
+        s.send_many([{"foo": "bar"}, {"foo": "baz"}])
+
+        win32file.WriteFile.assert_called_once_with(s.socket, '{"foo": "bar"}\n{"foo": "baz"}\n'.encode("utf8"))
+
+    def test_send__partial(self, win32file):
+        s = WindowsJsonTransport("foo.sock", StdlibJsonCodec())
+        s.connect()
+        win32file.WriteFile.side_effect = [(0, 5), (0, 10)]
+        s.send({"foo": "bar"})
+
+        self.assertEqual(
+            [c[0][1] for c in win32file.WriteFile.call_args_list],
+            [b'{"foo": "bar"}\n', b'": "bar"}\n'],
+        )
+
     def test_send__error(self, win32file):
         s = WindowsJsonTransport("foo.sock")
         s.connect()
@@ -158,7 +517,20 @@ class TestWindowsJsonTransport(unittest.TestCase):
         s = WindowsJsonTransport("foo.sock")
         s.connect()
 
-        win32file.ReadFile.return_value = (0, '{"foo": "bar"}'.encode("utf8"))
+        win32file.ReadFile.return_value = (0, '{"foo": "bar"}\n'.encode("utf8"))
+        self.assertDictEqual(
+            s.recv(),
+            {"foo": "bar"}
+        )
+
+    def test_recv__more_data(self, win32file):
+        s = WindowsJsonTransport("foo.sock")
+        s.connect()
+
+        win32file.ReadFile.side_effect = [
+            (234, '{"foo": '.encode("utf8")),
+            (0, '"bar"}\n'.encode("utf8")),
+        ]
         self.assertDictEqual(
             s.recv(),
             {"foo": "bar"}
@@ -178,7 +550,7 @@ class TestWindowsJsonTransport(unittest.TestCase):
         s = WindowsJsonTransport("foo.sock")
         s.connect()
 
-        win32file.ReadFile.return_value = (0, 'somethingblah'.encode("utf8"))
+        win32file.ReadFile.return_value = (0, 'somethingblah\n'.encode("utf8"))
         self.assertRaises(TransportException, s.recv)
 
     def test_close(self, win32file):
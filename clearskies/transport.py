@@ -1,63 +1,390 @@
 import socket
-import json
+import selectors
+import errno
+import os
+import re
+import struct
+import time
 import logging
 
-from clearskies.exc import TransportException
+from clearskies.exc import TransportException, TimeoutException
+from clearskies.codec import default_codec
 
 log = logging.getLogger(__name__)
 
+_not_blank = re.compile(br"\S")
+
+# the most buffers one sendmsg() call may be given (Linux's UIO_MAXIOV)
+IOV_MAX = 1024
+
+# binary messages are sent as a 4-byte big-endian length, then the message
+_length = struct.Struct(">I")
+
 
 class Transport(object):
-    def __init__(self, control_path):
+    # initial size of the receive buffer; replies are newline-terminated
+    # and may be far larger than this, see _recv_frame()
+    read_size = 65536
+    # don't bother reading into less space than this; make more room first
+    min_read = 4096
+    # an empty buffer bigger than this is replaced by a read_size one
+    max_idle_buffer = 4 * 1024 * 1024
+
+    def __init__(self, control_path, codec=None):
         self.control_path = control_path
+        self.codec = codec or default_codec()
+        self.metrics = None
+        self._reset_buffer()
+
+    # Every blocking method takes an optional deadline, a time.monotonic()
+    # value after which it gives up with TimeoutException; transports
+    # which can't interrupt their IO may ignore it.
 
-    def connect(self):
+    def connect(self, deadline=None):
         raise NotImplementedError()
 
-    def send(self, js):
+    def queue(self, js):
+        """
+        Encode a message and hold on to it until the next flush(), so that
+        a burst of messages can go out in as few writes as possible.
+        """
+        self.pending.append(self._encode(js))
+
+    def flush(self, deadline=None):
+        """
+        Write every queued message, in full
+        """
         raise NotImplementedError()
 
-    def recv(self):
+    def send(self, js, deadline=None):
+        self.queue(js)
+        self.flush(deadline)
+
+    def send_many(self, jss, deadline=None):
+        # encode them all before queueing any, so that one which can't be
+        # encoded doesn't leave the others behind for the next flush()
+        self.pending.extend([self._encode(js) for js in jss])
+        self.flush(deadline)
+
+    def recv(self, deadline=None):
         raise NotImplementedError()
 
     def close(self):
         raise NotImplementedError()
 
+    def interrupt(self):
+        """
+        Make a recv() blocked in another thread fail, without closing the
+        connection out from under it (which could leave it waiting
+        forever); close() once that thread has finished.
+        """
+        self.close()
+
+    def alive(self):
+        """
+        Cheap check that an idle connection is still usable, for pools
+        deciding whether to hand it out again.
+        """
+        return True
+
+    def _read_into(self, view, deadline=None):
+        """
+        Read whatever bytes are available (up to len(view)) into view,
+        blocking until there is at least one; returns the number read, with
+        0 meaning EOF.
+        """
+        raise NotImplementedError()
+
+    def _fill(self, deadline=None):
+        """
+        Read more data onto the end of the buffer. If there isn't much room
+        left, first move the unconsumed data to the front, or if it takes up
+        most of the buffer (ie, we're in the middle of a big frame), double
+        the buffer's size.
+        """
+        live = self.end - self.start
+        if len(self.buffer) - self.end < self.min_read:
+            if live + self.min_read <= len(self.buffer) // 2:
+                with memoryview(self.buffer) as view:
+                    view[:live] = view[self.start:self.end]
+            else:
+                buffer = bytearray(max(len(self.buffer) * 2, live + self.read_size))
+                buffer[:live] = memoryview(self.buffer)[self.start:self.end]
+                self.buffer = buffer
+            self._scanned -= self.start
+            self.start, self.end = 0, live
+
+        view = memoryview(self.buffer)[self.end:]
+        try:
+            n = self._read_into(view, deadline)
+        except TransportException:
+            raise
+        except Exception as e:
+            raise TransportException("Error while reading from socket: %s" % e)
+        finally:
+            view.release()
+        if not n:
+            raise TransportException("Connection closed by daemon")
+        self.end += n
+
+    def _consume(self, end):
+        """
+        Mark everything up to and including the newline at `end` as used
+        """
+        self.start = self._scanned = end + 1
+        if self.start == self.end:
+            self.start = self.end = self._scanned = 0
+            if len(self.buffer) > self.max_idle_buffer:
+                # don't hang on to the space a huge reply needed forever
+                self.buffer = bytearray(self.read_size)
+
+    def _recv_frame(self, deadline=None):
+        """
+        Return the next newline-terminated frame (without the newline) as
+        a memoryview into our buffer, reading more data as needed. Bytes
+        after the newline stay in the buffer for the next call, so replies
+        which arrive together are handed out one at a time.
+
+        The data is read straight into a preallocated buffer and handed to
+        the codec without being copied; we only search bytes we haven't
+        searched before, so a multi-megabyte reply is read in one linear
+        pass. The view must be released before the next read.
+        """
+        while True:
+            end = self.buffer.find(b"\n", self._scanned, self.end)
+            if end >= 0:
+                # _consume() may swap in a new buffer, so hold on to this one
+                buffer, start = self.buffer, self.start
+                self._consume(end)
+                if _not_blank.search(buffer, start, end):
+                    return memoryview(buffer)[start:end]
+                continue
+            self._scanned = self.end
+            self._fill(deadline)
+
+    def _recv_sized_frame(self, deadline=None):
+        """
+        Like _recv_frame(), for length-prefixed binary messages
+        """
+        while self.end - self.start < _length.size:
+            self._fill(deadline)
+        size = _length.unpack_from(self.buffer, self.start)[0]
+        while self.end - self.start < _length.size + size:
+            self._fill(deadline)
+        buffer, start = self.buffer, self.start + _length.size
+        self._consume(start + size - 1)
+        return memoryview(buffer)[start:start + size]
+
+    def recv_chunks(self, deadline=None):
+        """
+        Yield the next frame piece by piece as it arrives, rather than
+        waiting for all of it; the newline is not included. The frame must
+        be read to the end before anything else is received. Only for
+        JSON lines, not binary messages.
+        """
+        started = False
+        while True:
+            end = self.buffer.find(b"\n", self.start, self.end)
+            if end >= 0:
+                chunk = bytes(self.buffer[self.start:end])
+                self._consume(end)
+                if chunk.strip() or started:
+                    if chunk:
+                        yield chunk
+                    return
+                continue
+            if self.end > self.start:
+                chunk = bytes(self.buffer[self.start:self.end])
+                self.start = self.end = self._scanned = 0
+                started = started or bool(chunk.strip())
+                yield chunk
+            self._fill(deadline)
+
+    def _recv_decoded(self, deadline=None):
+        if self.binary is None:
+            frame = self._recv_frame(deadline)
+        else:
+            frame = self._recv_sized_frame(deadline)
+        try:
+            return self._decode(frame)
+        except ValueError as e:
+            if self.binary is not None:
+                raise TransportException("Couldn't decode %s: %s" % (self.binary.name, e))
+            raise TransportException("Couldn't decode JSON: %r" % bytes(frame))
+        finally:
+            frame.release()
+
+    def _encode(self, js):
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("> %s", js)
+        binary = self.binary
+        if binary is None:
+            return self.codec.dumps(js) + b"\n"
+        data = binary.dumps(js)
+        return _length.pack(len(data)) + data
+
+    def _decode(self, data):
+        binary = self.binary
+        if log.isEnabledFor(logging.DEBUG):
+            if binary is None:
+                log.debug("< %s", bytes(data).strip().decode("utf8", "replace"))
+            else:
+                log.debug("< (%d bytes of %s)", len(data), binary.name)
+        codec = binary or self.codec
+        metrics = self.metrics
+        if metrics is None:
+            return codec.loads(data)
+        start = time.perf_counter()
+        js = codec.loads(data)
+        overhead = 1 if binary is None else _length.size
+        metrics.received(len(data) + overhead, time.perf_counter() - start)
+        return js
+
+    def _sent(self, nbytes):
+        if self.metrics is not None:
+            self.metrics.sent(nbytes)
+
+    def _reset_buffer(self):
+        self.buffer = bytearray(self.read_size)
+        self.start = self.end = self._scanned = 0
+        # anything queued for an old connection is no use on a new one
+        self.pending = []
+        # every connection starts out speaking JSON lines; this is set to
+        # a binary Codec once both ends agree to switch
+        self.binary = None
+
 
 class UnixJsonTransport(Transport):
-    def __init__(self, control_path):
-        Transport.__init__(self, control_path)
+    def __init__(self, control_path, codec=None):
+        Transport.__init__(self, control_path, codec)
         self.socket = None
+        # one per kind of event, so that one thread can wait to read while
+        # another waits to write
+        self.selectors = {}
+
+    def _wait(self, events, deadline):
+        """
+        Wait until the socket is ready for `events`, or the deadline passes
+        """
+        if deadline is None:
+            timeout = None
+        else:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise TimeoutException("Timed out waiting for the daemon")
+        if not self._selector(events).select(timeout):
+            raise TimeoutException("Timed out waiting for the daemon")
+
+    def _selector(self, events):
+        # only set up on first use, since usually the data is already there
+        selector = self.selectors.get(events)
+        if selector is None:
+            selector = self.selectors[events] = selectors.DefaultSelector()
+            selector.register(self.socket, events)
+        return selector
 
-    def connect(self):
+    def connect(self, deadline=None):
         try:
+            self._reset_buffer()
             self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            self.socket.connect(self.control_path)
+            self.socket.setblocking(False)
+            self._close_selectors()
+            while True:
+                try:
+                    self.socket.connect(self.control_path)
+                    break
+                except (BlockingIOError, InterruptedError) as e:
+                    if e.errno == errno.EAGAIN:
+                        # the daemon's listen queue is full; nothing is in
+                        # progress, so try again shortly
+                        self._sleep(0.01, deadline)
+                        continue
+                    self._wait(selectors.EVENT_WRITE, deadline)
+                    err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err:
+                        raise socket.error(err, os.strerror(err))
+                    break
         except socket.error as e:
             raise TransportException(e)
 
-    def recv(self):
-        data = None
+    def _close_selectors(self):
+        for selector in self.selectors.values():
+            selector.close()
+        self.selectors = {}
+
+    def _sleep(self, seconds, deadline):
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutException("Timed out connecting to the daemon")
+            seconds = min(seconds, remaining)
+        time.sleep(seconds)
+
+    def _read_into(self, view, deadline=None):
+        while True:
+            try:
+                return self.socket.recv_into(view)
+            except (BlockingIOError, InterruptedError):
+                self._wait(selectors.EVENT_READ, deadline)
+
+    def _write_all(self, buffers, deadline=None):
+        """
+        Write all of buffers with as few sendmsg() calls as we can,
+        carrying on after short writes.
+        """
+        i = 0
+        while i < len(buffers):
+            try:
+                n = self.socket.sendmsg(buffers[i:i + IOV_MAX])
+            except (BlockingIOError, InterruptedError):
+                self._wait(selectors.EVENT_WRITE, deadline)
+                continue
+            self._sent(n)
+            # skip past whatever was written, which may end part-way
+            # through a buffer
+            while n:
+                size = len(buffers[i])
+                if n < size:
+                    buffers[i] = memoryview(buffers[i])[n:]
+                    break
+                n -= size
+                i += 1
+
+    def alive(self):
+        # an idle connection should have nothing to read; if it does, that's
+        # either EOF (daemon went away) or a stray reply we'd mismatch
+        if self.socket is None or self.end > self.start:
+            return False
         try:
-            data = self.socket.recv(1024)
-            log.debug("< %s" % data.strip())
-            js = json.loads(data.decode("utf8"))
-            return js
-        except ValueError as e:
-            raise TransportException("Couldn't decode JSON: %r" % data)
+            # not select.select(), which can't cope with fds over 1024
+            return not self._selector(selectors.EVENT_READ).select(0)
+        except (socket.error, ValueError):
+            return False
+
+    def recv(self, deadline=None):
+        try:
+            return self._recv_decoded(deadline)
         except socket.error as e:
             raise TransportException(e)
 
-    def send(self, js):
+    def flush(self, deadline=None):
+        pending, self.pending = self.pending, []
         try:
-            log.debug("> %s" % js)
-            data = json.dumps(js)
-            self.socket.send((data + "\n").encode("utf8"))
+            self._write_all(pending, deadline)
         except socket.error as e:
             raise TransportException(e)
 
+    def interrupt(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
     def close(self):
+        # shutdown() first, to wake up any other thread blocked in recv()
+        self.interrupt()
         try:
+            self._close_selectors()
             self.socket.close()
         except socket.error as e:
             raise TransportException(e)
@@ -68,17 +395,22 @@ try:
 except ImportError:
     win32file = None
 
+# ReadFile() on a message-mode pipe returns this when the message is bigger
+# than our read; the rest will come with the next read, so it isn't an error
+ERROR_MORE_DATA = 234
+
 
 class WindowsJsonTransport(Transport):
-    def __init__(self, control_path):
-        Transport.__init__(self, control_path)
+    def __init__(self, control_path, codec=None):
+        Transport.__init__(self, control_path, codec)
         self.socket = None
 
-    def connect(self):
+    def connect(self, deadline=None):
         try:
             if not win32file:
                 raise TransportException("Error importing win32file module")
 
+            self._reset_buffer()
             self.socket = win32file.CreateFile(
                 self.control_path,
                 win32file.GENERIC_READ | win32file.GENERIC_WRITE,
@@ -89,27 +421,37 @@ class WindowsJsonTransport(Transport):
         except Exception as e:
             raise TransportException(e)
 
-    def recv(self):
-        data = None
+    def _read_into(self, view, deadline=None):
+        # blocking ReadFile() can't be given a timeout, so the deadline is
+        # only checked between reads
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutException("Timed out waiting for the daemon")
+        status, data = win32file.ReadFile(self.socket, len(view))
+        if status not in (0, ERROR_MORE_DATA):
+            raise Exception("Error %d" % status)
+        view[:len(data)] = data
+        return len(data)
+
+    def recv(self, deadline=None):
         try:
-            status, data = win32file.ReadFile(self.socket, 4096)
-            if status != 0:
-                raise Exception("Error %d" % status)
-            log.debug("< %s" % data.strip())
-            js = json.loads(data.decode("utf8"))
-            return js
-        except ValueError as e:
-            raise TransportException("Couldn't decode JSON: %r" % data)
+            return self._recv_decoded(deadline)
+        except TransportException:
+            raise
         except Exception as e:
             raise TransportException("Error while reading from socket: %s" % e)
 
-    def send(self, js):
+    def flush(self, deadline=None):
+        pending, self.pending = self.pending, []
         try:
-            log.debug("> %s" % js)
-            data = json.dumps(js)
-            status, bytes_written = win32file.WriteFile(self.socket, (data + "\n").encode("utf8"))
-            if status != 0:
-                raise Exception("Error %d" % status)
+            data = b"".join(pending)
+            while data:
+                status, bytes_written = win32file.WriteFile(self.socket, data)
+                if status != 0:
+                    raise Exception("Error %d" % status)
+                if not bytes_written:
+                    raise Exception("Nothing written")
+                self._sent(bytes_written)
+                data = data[bytes_written:]
         except Exception as e:
             raise TransportException("Error while writing to socket: %s" % e)
 
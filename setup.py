@@ -12,8 +12,8 @@ requires = [
     'pyxdg',
 
     # testing
-    'nose',
-    'coverage',
+    'pytest',
+    'pytest-cov',
     'mock',
 ]
 
@@ -25,6 +25,11 @@ setup(
     classifiers=[
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
     ],
     author='Shish',
     author_email='shish+clsk@shishnet.org',
@@ -33,8 +38,20 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     zip_safe=False,
+    # the transports need selectors and non-blocking sockets, the asyncio
+    # client async/await, and scanning shutdown(cancel_futures=True)
+    python_requires=">=3.9",
     test_suite='clearskies',
     install_requires=requires,
+    extras_require={
+        # picked up automatically by clearskies.codec when installed
+        "fast": ["orjson"],
+        # lets follow_log() wake up as soon as the log changes
+        "inotify": ["inotify_simple"],
+        # binary encodings for ClearSkies(binary=True)
+        "msgpack": ["msgpack"],
+        "cbor": ["cbor2"],
+    },
     entry_points="""\
     [console_scripts]
     cscli = clearskies.cli:main